@@ -0,0 +1,321 @@
+from bisect import bisect_left, bisect_right
+
+def construct_graph(aligns, max_olap=0.2, max_gap=0.2):
+    """Links alignments that can follow each other along the query
+
+    Alignments must be like to be an edge
+       ----> j
+    ----> i
+    i.e. j starts and ends after i, and the overlap or gap between i and j is less than
+    max_olap or max_gap of the length of either alignment.
+    The start of j is limited to a window around the end of i, so only alignments starting
+    in that window (found by binary search on sorted query starts) are tested.
+
+    Args:
+        aligns: (list) Alignments of a single query
+        max_olap: (float) maximum fraction of alignment length that can be overlapped
+        max_gap: (float) maximum gap between alignments, as fraction of alignment length
+    Returns:
+        dict of index of alignment: list of indices of alignments that can follow it
+        (only alignments with at least one edge are keys)
+    """
+    order = sorted(range(len(aligns)), key=lambda i: aligns[i].qstart)
+    qstarts = [aligns[i].qstart for i in order]
+
+    graph = {}
+    for i in range(len(aligns)):
+        len_i = aligns[i].qend - aligns[i].qstart + 1
+        # window is widened by 1 on each side, exact criteria are tested below
+        first = bisect_right(qstarts, max(aligns[i].qstart, aligns[i].qend - max_olap * len_i))
+        last = bisect_left(qstarts, aligns[i].qend + 2 + max_gap * len_i)
+        for j in sorted(order[first:last]):
+            if i == j or aligns[j].qend <= aligns[i].qend or aligns[j].qstart <= aligns[i].qstart:
+                continue
+            len_j = aligns[j].qend - aligns[j].qstart + 1
+            olap = max(0, aligns[i].qend - aligns[j].qstart + 1)
+            gap = max(0, aligns[j].qstart - aligns[i].qend - 1)
+            if float(olap)/len_i >= max_olap or\
+               float(olap)/len_j >= max_olap or\
+               float(gap)/len_i >= max_gap or\
+               float(gap)/len_j >= max_gap:
+                continue
+            try:
+                graph[i].append(j)
+            except KeyError:
+                graph[i] = [j]
+
+    return graph
+
+def trim_aligns(aligns, no_trim=[], max_mappings=100):
+    """Removes promiscuous alignments
+
+    Only the first max_mappings alignments covering the same query region on the same strand are kept
+
+    Args:
+        aligns: (list) Alignments
+        no_trim: (list) indices of alignments that are always kept
+        max_mappings: (int) maximum number of alignments kept for each query region
+    Returns:
+        list of indices of alignments kept
+    """
+    counts = {}
+    kept = []
+    for i in range(len(aligns)):
+        if i not in no_trim:
+            key = (aligns[i].qstart, aligns[i].qend, aligns[i].strand)
+            counts[key] = counts.get(key, 0) + 1
+            if counts[key] > max_mappings:
+                continue
+        kept.append(i)
+
+    return kept
+
+def group_by_region(aligns):
+    """Groups alignments covering the same query region
+
+    Args:
+        aligns: (list) Alignments
+    Returns:
+        list of (qstart, qend, list of indices of alignments), in order of first alignment
+    """
+    regions = []
+    region_index = {}
+    for i in range(len(aligns)):
+        key = (aligns[i].qstart, aligns[i].qend)
+        if not region_index.has_key(key):
+            region_index[key] = len(regions)
+            regions.append((aligns[i].qstart, aligns[i].qend, []))
+        regions[region_index[key]][2].append(i)
+    return regions
+
+class Region:
+    """Query region covered by one or more alignments, node of path graph"""
+    def __init__(self, qstart, qend):
+        self.qstart = qstart
+        self.qend = qend
+
+def best_paths(aligns, regions, graph, sources, max_aligns=None, min_aligns=1, count_targets=True, max_target_sets=8):
+    """Finds best paths from any of the source alignments to every query region reachable from them
+
+    Dynamic programming over query regions in order of query start.
+    A path is scored by (bases covered, -bases overlapped, -number of targets), compared in that order.
+    Overlaps between non-consecutive alignments are not possible as overlaps are limited to
+    a fraction of the alignment lengths (see construct_graph()), so covered and overlapped bases
+    add up along a path.
+    The number of targets does not add up, as it depends on which alignment covers each region,
+    so every state keeps the alternative paths with the best coverage and overlap whose sets of targets
+    are not supersets of one another (at most max_target_sets of them, smallest sets first).
+    A path that is not kept can always be replaced by a kept one with a subset of its targets,
+    so the search is exact as long as the limit is not reached.
+
+    Args:
+        aligns: (list) Alignments
+        regions: (list) regions returned by group_by_region()
+        graph: (dict) edges between regions returned by construct_graph()
+        sources: (dict) index of region: indices of alignments that can start a path
+        max_aligns: (int) maximum number of alignments in path
+        min_aligns: (int) minimum number of alignments in path
+        count_targets: (boolean) use number of targets as the last criterion
+        max_target_sets: (int) maximum number of paths kept for each state
+    Returns:
+        dict of state: ((bases covered, -bases overlapped), list of options)
+        where state is (index of region, number of alignments),
+        the number of alignments being capped at min_aligns if max_aligns is not given,
+        and an option is (targets, previous option, index of alignment),
+        previous option being (previous state, index of option) or None
+    """
+    def _prune(options):
+        kept = []
+        # sort is stable, so the first alignment of a region is used among those giving the same targets
+        for option in sorted(options, key=lambda option: len(option[0])):
+            if [k for k in kept if k[0] <= option[0]]:
+                continue
+            kept.append(option)
+            if len(kept) == max_target_sets:
+                break
+        return kept
+
+    def _extend(path_targets, prev, members):
+        if not count_targets:
+            return [(path_targets, prev, members[0])]
+        return [(path_targets | frozenset([aligns[i].target]), prev, i) for i in members]
+
+    def _update(state, score, options):
+        if not best.has_key(state) or score > best[state][0]:
+            best[state] = (score, _prune(options))
+        elif score == best[state][0]:
+            best[state] = (score, _prune(best[state][1] + options))
+
+    max_n = max_aligns if max_aligns is not None else max(1, min_aligns)
+    best = {}
+    for r, members in sources.iteritems():
+        _update((r, 1), (regions[r][1] - regions[r][0] + 1, 0), _extend(frozenset(), None, members))
+
+    # edges go to regions with larger query start, so predecessors are always done first
+    order = sorted(graph.keys(), key=lambda r: (regions[r][0], r))
+    for r in order:
+        qend = regions[r][1]
+        for n in range(1, max_n + 1):
+            if not best.has_key((r, n)) or (max_aligns is not None and n == max_aligns):
+                continue
+            (covered, overlapped), options = best[(r, n)]
+            next_n = min(n + 1, max_n)
+            for s in graph[r]:
+                qstart_s, qend_s, members = regions[s]
+                olap = max(0, qend - qstart_s + 1)
+                next_options = []
+                for k in range(len(options)):
+                    next_options.extend(_extend(options[k][0], ((r, n), k), members))
+                _update((s, next_n), (covered + qend_s - qstart_s + 1 - olap, overlapped - olap), next_options)
+
+    return best
+
+def trace_path(best, state, option_index=0, last_align_index=None):
+    """Returns path (list of indices of alignments) ending at given option of a state of best_paths()
+
+    Args:
+        best: (dict) returned by best_paths()
+        state: (tuple) state of last region
+        option_index: (int) index of option of state
+        last_align_index: (int) index of alignment used for last region instead of the one picked
+    Returns:
+        list of indices of alignments
+    """
+    path = []
+    option = (state, option_index)
+    while option is not None:
+        state, k = option
+        path.append(best[state][1][k][2])
+        option = best[state][1][k][1]
+    path.reverse()
+    if last_align_index is not None:
+        path[-1] = last_align_index
+    return path
+
+def find_paths(aligns, starts, ends, min_coverage=None, use_end_to_end=True, get_all=False, max_paths=5,
+               min_aligns=1, max_aligns=None, count_targets=True):
+    """Finds best path of alignments covering the query
+
+    Alignments covering the same query region only differ by their targets in a path,
+    so paths are searched between distinct query regions, which keeps the search fast
+    when there are many secondary alignments of repeats.
+
+    Args:
+        aligns: (list) Alignments of a single query
+        starts: (list) indices of alignments that can start a path
+        ends: (list) indices of alignments that can end a path
+        min_coverage: (float) minimum fraction of query covered by path
+        use_end_to_end: (boolean) coverage is the span from first to last alignment instead of bases covered
+        get_all: (boolean) return the best path between each start and end alignment
+        max_paths: (int) maximum number of paths returned when get_all is True
+        min_aligns: (int) minimum number of alignments in path
+        max_aligns: (int) maximum number of alignments in path
+        count_targets: (boolean) prefer paths with fewer targets when coverage and overlap are equal
+    Returns:
+        list of indices of alignments (best path), or list of paths if get_all is True,
+        empty list if there is no path
+    """
+    query_len = float(aligns[0].query_len)
+    regions = group_by_region(aligns)
+    graph = construct_graph([Region(qstart, qend) for qstart, qend, members in regions])
+
+    region_of = {}
+    for r in range(len(regions)):
+        for i in regions[r][2]:
+            region_of[i] = r
+    # start and end alignments by region, in the order they are given
+    start_regions = []
+    start_members = {}
+    for i in starts:
+        if not start_members.has_key(region_of[i]):
+            start_regions.append(region_of[i])
+            start_members[region_of[i]] = []
+        start_members[region_of[i]].append(i)
+    end_regions = []
+    end_members = {}
+    for i in ends:
+        if not end_members.has_key(region_of[i]):
+            end_regions.append(region_of[i])
+            end_members[region_of[i]] = []
+        end_members[region_of[i]].append(i)
+
+    def _screen(start_region, end_region, score):
+        if min_coverage is None:
+            return True
+        if not use_end_to_end:
+            coverage = score[0] / query_len
+        else:
+            coverage = (regions[end_region][1] - regions[start_region][0] + 1) / query_len
+        return coverage >= min_coverage
+
+    def _end_paths(sources):
+        """Best path ending at each end alignment, over allowed path lengths
+
+        Returns:
+            dict of index of end alignment: (score, path)
+        """
+        best = best_paths(aligns, regions, graph, sources,
+                          max_aligns=max_aligns, min_aligns=min_aligns, count_targets=count_targets)
+        end_paths = {}
+        for state in sorted(best.keys()):
+            r, n = state
+            if n < min_aligns or not end_members.has_key(r):
+                continue
+            score, options = best[state]
+            for k in range(len(options)):
+                prev = options[k][1]
+                # last alignment must be an end alignment (and a start alignment too if path has one alignment)
+                if prev is None:
+                    members = [i for i in end_members[r] if i in sources[r]]
+                    prev_targets = frozenset()
+                else:
+                    members = end_members[r]
+                    prev_targets = best[prev[0]][1][prev[1]][0]
+                for i in members:
+                    targets = prev_targets | frozenset([aligns[i].target]) if count_targets else prev_targets
+                    path_score = score + (-len(targets),)
+                    if not end_paths.has_key(i) or path_score > end_paths[i][0]:
+                        end_paths[i] = (path_score, trace_path(best, state, k, i))
+        return end_paths
+
+    if get_all:
+        # best path between each start and end alignment
+        paths = []
+        for i in starts:
+            end_paths = _end_paths({region_of[i]: [i]})
+            for j in ends:
+                if end_paths.has_key(j) and _screen(region_of[i], region_of[j], end_paths[j][0]):
+                    paths.append(end_paths[j][1])
+                    if max_paths and len(paths) >= max_paths:
+                        return paths
+        return paths
+
+    # with end-to-end coverage, the starts that can pass screening for an end are those
+    # starting early enough, so ends are grouped by these starts and a path is searched from
+    # all starts of a group at once
+    start_regions_by_qstart = sorted(start_regions, key=lambda r: regions[r][0])
+    groups = {}
+    for end_region in end_regions:
+        if min_coverage is None or not use_end_to_end:
+            num_starts = len(start_regions)
+        else:
+            num_starts = len([r for r in start_regions_by_qstart if _screen(r, end_region, None)])
+        if num_starts > 0:
+            groups.setdefault(num_starts, []).append(end_region)
+
+    best_score = None
+    best_path = []
+    for num_starts in sorted(groups.keys(), reverse=True):
+        end_paths = _end_paths(dict([(r, start_members[r]) for r in start_regions_by_qstart[:num_starts]]))
+        for end_region in groups[num_starts]:
+            for i in end_members[end_region]:
+                if not end_paths.has_key(i):
+                    continue
+                score, path = end_paths[i]
+                if not _screen(region_of[path[0]], end_region, score):
+                    continue
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_path = path
+
+    return best_path
@@ -0,0 +1,231 @@
+import pysam
+import mmap
+from collections import OrderedDict
+
+class SequenceCache:
+    """LRU cache of whole sequences of a FASTA file
+
+    Drop-in replacement of pysam.Fastafile for fetching sequences that are accessed repeatedly
+    (e.g. contigs), the whole sequence is fetched once and subsequences are sliced from it.
+    Attributes not defined here (e.g. references, lengths) are delegated to the pysam object.
+    """
+    def __init__(self, fasta, max_bases=50000000):
+        """Initializes cache
+
+        Args:
+            fasta: (str) path of indexed FASTA file, or (pysam.Fastafile)
+            max_bases: (int) maximum total length of sequences kept in cache
+        """
+        if isinstance(fasta, basestring):
+            fasta = pysam.Fastafile(fasta)
+        self.fasta = fasta
+        self.max_bases = max_bases
+        self.seqs = OrderedDict()
+        self.bases = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.fasta, name)
+
+    def get(self, name, upper=False):
+        """Gets whole sequence
+
+        Args:
+            name: (str) sequence name
+            upper: (boolean) return uppercased sequence
+        Returns:
+            sequence (str)
+        """
+        key = (name, upper)
+        try:
+            seq = self.seqs.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            if upper:
+                seq = self.get(name).upper()
+            else:
+                seq = self.fasta.fetch(name)
+            self.bases += len(seq)
+            while self.seqs and self.bases > self.max_bases:
+                self.bases -= len(self.seqs.popitem(last=False)[1])
+
+        # most recently used at the end
+        self.seqs[key] = seq
+        return seq
+
+    def fetch(self, reference=None, start=None, end=None, upper=False):
+        """Same as pysam.Fastafile.fetch()
+
+        Args:
+            reference: (str) sequence name
+            start: (int) 0-based start
+            end: (int) 0-based end (exclusive)
+            upper: (boolean) return uppercased sequence
+        Returns:
+            sequence (str)
+        """
+        if start is not None and start < 0:
+            raise ValueError('start out of range (%i)' % start)
+        if start is not None and end is not None and start > end:
+            raise ValueError('invalid region: start (%i) > stop (%i)' % (start, end))
+
+        seq = self.get(reference, upper=upper)
+        if start is None and end is None:
+            return seq
+        return seq[start:end]
+
+    def fetch_upper(self, reference, start=None, end=None):
+        """Same as fetch(), but sequence is uppercased"""
+        return self.fetch(reference, start, end, upper=True)
+
+    def stats(self):
+        """Returns cache statistics (str)"""
+        return 'hits:%d misses:%d sequences:%d bases:%d' % (self.hits, self.misses, len(self.seqs), self.bases)
+
+class BlockCache:
+    """Reference sequence reader that caches fixed-size blocks of sequences (LRU)
+
+    Drop-in replacement of pysam.Fastafile for fetching many short subsequences near each other
+    (e.g. bases at breakpoints). Requests without coordinates are not cached.
+    Attributes not defined here (e.g. references, lengths) are delegated to the underlying reader.
+    """
+    def __init__(self, fasta, block_size=65536, max_blocks=512, use_mmap=False):
+        """Initializes cache
+
+        Args:
+            fasta: (str) path of indexed FASTA file, or (pysam.Fastafile/MmapFasta)
+            block_size: (int) size of each block in bases
+            max_blocks: (int) maximum number of blocks kept in cache
+            use_mmap: (boolean) read uncompressed FASTA file with MmapFasta if path is given
+        """
+        if isinstance(fasta, basestring):
+            if use_mmap:
+                fasta = MmapFasta(fasta)
+            else:
+                fasta = pysam.Fastafile(fasta)
+        self.fasta = fasta
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.fasta, name)
+
+    def get_block(self, reference, block):
+        """Gets sequence of given block (str)"""
+        key = (reference, block)
+        try:
+            seq = self.blocks.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            seq = self.fasta.fetch(reference, block * self.block_size, (block + 1) * self.block_size)
+            if len(self.blocks) >= self.max_blocks:
+                self.blocks.popitem(last=False)
+
+        # most recently used at the end
+        self.blocks[key] = seq
+        return seq
+
+    def fetch(self, reference=None, start=None, end=None):
+        """Same as pysam.Fastafile.fetch()
+
+        Args:
+            reference: (str) sequence name
+            start: (int) 0-based start
+            end: (int) 0-based end (exclusive)
+        Returns:
+            sequence (str)
+        """
+        if end is None:
+            return self.fasta.fetch(reference, start, end)
+        if start is None:
+            start = 0
+        if start < 0:
+            raise ValueError('start out of range (%i)' % start)
+        if start > end:
+            raise ValueError('invalid region: start (%i) > stop (%i)' % (start, end))
+        if start == end:
+            return ''
+
+        first_block = start / self.block_size
+        last_block = (end - 1) / self.block_size
+        if first_block == last_block:
+            seq = self.get_block(reference, first_block)
+        else:
+            seq = ''.join([self.get_block(reference, block) for block in xrange(first_block, last_block + 1)])
+        offset = start - first_block * self.block_size
+        return seq[offset:offset + end - start]
+
+    def stats(self):
+        """Returns cache statistics (str)"""
+        return 'hits:%d misses:%d blocks:%d' % (self.hits, self.misses, len(self.blocks))
+
+class MmapFasta:
+    """Reader of uncompressed FASTA file that maps the file into memory
+
+    Subsequences are located with the FASTA index (.fai), so no I/O call is made per fetch
+    and pages of the file are shared by all processes reading it.
+    """
+    def __init__(self, fasta_file):
+        """Maps FASTA file
+
+        Args:
+            fasta_file: (str) path of uncompressed FASTA file, indexed by samtools faidx
+        """
+        self.filename = fasta_file
+        self.index = {}
+        self.references = []
+        self.lengths = []
+        for line in open(fasta_file + '.fai', 'r'):
+            cols = line.rstrip('\n').split('\t')
+            name = cols[0]
+            length, offset, line_bases, line_width = map(int, cols[1:5])
+            self.index[name] = (length, offset, line_bases, line_width)
+            self.references.append(name)
+            self.lengths.append(length)
+
+        with open(fasta_file, 'rb') as fasta:
+            self.mm = mmap.mmap(fasta.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get_reference_length(self, reference):
+        """Returns length of given sequence (int)"""
+        return self.index[reference][0]
+
+    def fetch(self, reference=None, start=None, end=None):
+        """Same as pysam.Fastafile.fetch()
+
+        Args:
+            reference: (str) sequence name
+            start: (int) 0-based start
+            end: (int) 0-based end (exclusive)
+        Returns:
+            sequence (str)
+        """
+        if not self.index.has_key(reference):
+            raise KeyError("sequence '%s' not present" % reference)
+        length, offset, line_bases, line_width = self.index[reference]
+
+        if start is None:
+            start = 0
+        if end is None or end > length:
+            end = length
+        if start < 0:
+            raise ValueError('start out of range (%i)' % start)
+        if start >= end:
+            return ''
+
+        # file offset of base = offset of sequence + full lines before it + position in line
+        file_start = offset + start / line_bases * line_width + start % line_bases
+        file_end = offset + (end - 1) / line_bases * line_width + (end - 1) % line_bases + 1
+        seq = self.mm[file_start:file_end]
+        if line_width > line_bases:
+            seq = seq.replace('\n', '').replace('\r', '')
+        return seq
+
+    def close(self):
+        self.mm.close()
@@ -1,11 +1,27 @@
 from sets import Set
 from vcf import VCF
+from itertools import groupby
 import sys
+import os
 import copy
+import heapq
+import tempfile
+import cPickle
 from variant import Variant
 from alignment import reverse_complement
 
-class Adjacency:
+class Adjacency(object):
+    # attributes are slots to keep memory per adjacency low,
+    # id, event_id and read_depth are not set until adjacencies are merged/grouped
+    __slots__ = ('chroms', 'breaks', 'rearrangement', 'novel_seq', 'homol_seq', 'homol_coords',
+		 'contigs', 'contig_breaks', 'contig_support_span', 'contig_sizes', 'probes',
+		 'aligns', 'align_types', 'orients',
+		 'support', 'support_normal', 'final_support', 'final_support_normal',
+		 'filtered_out', 'filtered_out_normal', 'somatic', 'insertion_size',
+		 'partner_contig', 'stigmas', 'dubious',
+		 'repeat_seq', 'repeat_num', 'repeat_num_change',
+		 'id', 'event_id', 'read_depth')
+
     def __init__(self, chroms, breaks, rearrangement, novel_seq='-',
                  contig=None, contig_breaks=None, contig_sizes=None, contig_support_span=None,
                  probes=None, orients=None, 
@@ -83,6 +99,13 @@ class Adjacency:
 	self.repeat_num = None
 	self.repeat_num_change = None
 		
+    def __getstate__(self):
+	return dict([(attr, getattr(self, attr)) for attr in self.__slots__ if hasattr(self, attr)])
+
+    def __setstate__(self, state):
+	for attr, value in state.iteritems():
+	    setattr(self, attr, value)
+
     def debug(self):
         print '%s %s %s %s %s %s' % (self.rearrangement, self.chroms, self.breaks, self.get_size(), ','.join(self.contigs), self.orients)
 	
@@ -183,7 +206,7 @@ class Adjacency:
 	    #infos[1]['READSUPPORT'] = self.final_support
 	    infos[0]['SPANNING_READS'] = self.support['spanning']
 	    infos[1]['SPANNING_READS'] = self.support['spanning']
-	    if self.support['flanking'] is not NONE:
+	    if self.support['flanking'] is not None:
 		infos[0]['FLANKING_PAIRS'] = self.support['flanking']
 		infos[1]['FLANKING_PAIRS'] = self.support['flanking']
 	    
@@ -381,6 +404,9 @@ class Adjacency:
 	    for key, value in info_ext.iteritems():
 		if key == 'SVLEN' and value == 'NA':
 		    continue
+		if value is None:
+		    info.pop(key, None)
+		    continue
 		info[key] = value
 	
 	if ref is not None and alt is not None:
@@ -668,11 +694,13 @@ class Adjacency:
 	return variants
     
     @classmethod
-    def extract_interchrom_ins(cls, trls):
+    def extract_interchrom_ins(cls, trls, indexed=True):
 	"""Group translocation events that are possibly insertions
 	
 	Args:
 	    trls: (List) Adjacencies that are translocations
+	    indexed: (Boolean) only compare adjacencies in the same chromosome pair and
+		     neighbourhood of target breaks (False compares all pairs, same results)
 	Returns:
 	    A list of variants that are possibly insertions
 	    A list of remaining translocation adjacencies
@@ -698,11 +726,33 @@ class Adjacency:
 	    insertions = []
 	    used = Set()
 
+	    # bin adjacencies by chromosomes and target break, partners of an adjacency are in the
+	    # same or adjacent bins as their target breaks are at most neighborhood apart
+	    target_index = 0 if ins_at_first else 1
+	    bins = {}
+	    if indexed:
+		for j in range(len(trls)):
+		    key = (trls[j].chroms, trls[j].breaks[target_index] / neighborhood)
+		    try:
+			bins[key].append(j)
+		    except KeyError:
+			bins[key] = [j]
+
 	    for i in range(len(trls)):
 		if i in used:
 		    continue
 		
-		for j in range(len(trls)):
+		if indexed:
+		    bin_i = trls[i].breaks[target_index] / neighborhood
+		    candidates = []
+		    for b in (bin_i - 1, bin_i, bin_i + 1):
+			candidates.extend(bins.get((trls[i].chroms, b), []))
+		    # same order as comparing all pairs
+		    candidates.sort()
+		else:
+		    candidates = range(len(trls))
+		
+		for j in candidates:
 		    if i == j or j in used:
 			continue
 		    
@@ -812,9 +862,20 @@ class Adjacency:
 	return variants, trls_remained
     
     @classmethod
-    def extract_imprecise_ins(cls, adjs, debug=False):
+    def extract_imprecise_ins(cls, adjs, indexed=True, debug=False):
+	"""Groups pairs of split adjacencies from different contigs that are possibly insertions
+	
+	Args:
+	    adjs: (List) split Adjacencies
+	    indexed: (Boolean) only compare adjacencies with breaks near each other
+		     (False compares all pairs, same results)
+	Returns:
+	    A list of variants that are insertions
+	    A set of IDs of the adjacencies grouped
+	"""
+	neighborhood= 50
+	
 	def screen_insertion(adj1, adj2):
-	    neighborhood= 50
 	    
 	    # s1, t1 = source can 0, 1 of adj1.breaks
 	    for s1 in range(2):
@@ -859,11 +920,36 @@ class Adjacency:
 			    
 	    return None
 	    
+	# grid of (chromosome, break bin): adjacencies, a pair can only be an insertion if
+	# a break of each is on the same chromosome and at most neighborhood apart i.e. in the same or adjacent bins
+	grid = {}
+	if indexed:
+	    for j in range(len(adjs)):
+		for k in (0, 1):
+		    key = (adjs[j].chroms[k], adjs[j].breaks[k] / neighborhood)
+		    try:
+			grid[key].append(j)
+		    except KeyError:
+			grid[key] = [j]
+	
 	insertions = []
 	used_contigs = Set()
 	used_adjs = Set()
 	for i in range(len(adjs) - 1):	
-	    for j in range(i + 1, len(adjs)):		
+	    if indexed:
+		if adjs[i].contigs[0] in used_contigs:
+		    continue
+		candidates = Set()
+		for k in (0, 1):
+		    bin_i = adjs[i].breaks[k] / neighborhood
+		    for b in (bin_i - 1, bin_i, bin_i + 1):
+			candidates.update([j for j in grid.get((adjs[i].chroms[k], b), []) if j > i])
+		# same order as comparing all pairs
+		candidates = sorted(candidates)
+	    else:
+		candidates = range(i + 1, len(adjs))
+		
+	    for j in candidates:
 		# same contig - skip
 		if adjs[i].contigs[0] == adjs[j].contigs[0]:
 		    continue
@@ -907,48 +993,41 @@ class Adjacency:
 		
 	return insertions, used_adjs    	
 		        
+    def copy_for_merge(self):
+	"""Creates copy that other adjacencies can be merged into without modifying this adjacency
+	
+	Only containers (lists of contigs, support, etc) are copied,
+	the objects in them (e.g. Alignment) are shared
+	
+	Returns:
+	    Adjacency
+	"""
+	merged = copy.copy(self)
+	for attr, value in self.__getstate__().iteritems():
+	    if isinstance(value, (list, dict, Set)):
+		setattr(merged, attr, copy.copy(value))
+	return merged
+    
     @classmethod
-    def merge(cls, adjs, transcriptome=False, multimapping=False):
+    def merge(cls, adjs, transcriptome=False, multimapping=False, stats=None):
 	"""Merge adjacencies that have the same breakpoint (and same event type) together
 	Args:
 	    adjs: (list) Adjacency
 	    transcriptome: (boolean) whether adjacency is genomic or transcriptomic
+	    stats: (dict) if given, filled with merge statistics (see update_merge_stats())
 	Returns:
 	    List of adjs with subsets that represent the same adjacency merged
 	"""
 	keys = {}
+	num_adjs = 0
 	for adj in adjs:
+	    num_adjs += 1
 	    key = adj.key(transcriptome=transcriptome)
 
 	    if not keys.has_key(key):
-		keys[key] = copy.deepcopy(adj)
+		keys[key] = adj.copy_for_merge()
 	    else:
-		first_adj = keys[key]
-		first_adj.contigs.append(adj.contigs[0])
-		first_adj.contig_breaks.append(adj.contig_breaks[0])
-		first_adj.contig_sizes.append(adj.contig_sizes[0])
-		if adj.contig_support_span:
-		    first_adj.contig_support_span.append(adj.contig_support_span[0])
-		if adj.probes:
-		    first_adj.probes.append(adj.probes[0])
-		else:
-		    first_adj.probes.append('-')
-		first_adj.aligns.append(adj.aligns[0])
-		first_adj.align_types.append(adj.align_types[0])
-		if adj.homol_seq:
-		    first_adj.homol_seq.append(adj.homol_seq[0])
-		if adj.homol_coords:
-		    first_adj.homol_coords.append(adj.homol_coords[0])
-		for support_type in ('spanning', 'flanking'):
-		    if first_adj.support is not None and adj.support is not None:
-			first_adj.support[support_type] += adj.support[support_type]
-
-		# add up read depth
-		attr = 'read_depth'
-		if hasattr(first_adj, attr) and hasattr(first_adj, attr) and\
-	           getattr(first_adj, attr) is not None and\
-	           getattr(adj, attr) is not None:
-		    setattr(first_adj, attr, getattr(first_adj, attr) + getattr(adj, attr))
+		cls.add_to_merged(keys[key], adj)
 	
 	# for generating ID
 	count = 1
@@ -957,19 +1036,153 @@ class Adjacency:
 	    adj.id = str(count)
 	    count += 1
 	    adjs_merged.append(adj)
+	    
+	if stats is not None:
+	    cls.update_merge_stats(stats, num_adjs, adjs_merged)
 	    		
 	return adjs_merged
+    
+    @classmethod
+    def update_merge_stats(cls, stats, num_adjs, adjs_merged):
+	"""Records merge statistics
+	
+	Args:
+	    stats: (dict) updated with 'adjs' (number of adjacencies before merging),
+		   'merged' (number of merged adjacencies), 'multi_contig' (number of merged adjacencies
+		   supported by more than 1 contig), 'max_contigs' (maximum number of contigs of a merged adjacency)
+	    num_adjs: (int) number of adjacencies before merging
+	    adjs_merged: (list) merged Adjacency
+	"""
+	num_contigs = [len(adj.contigs) for adj in adjs_merged]
+	stats['adjs'] = num_adjs
+	stats['merged'] = len(adjs_merged)
+	stats['multi_contig'] = len([n for n in num_contigs if n > 1])
+	stats['max_contigs'] = max(num_contigs) if num_contigs else 0
         
+    @classmethod
+    def add_to_merged(cls, first_adj, adj):
+	"""Adds contig information of an adjacency to the adjacency representing the merged event
+	Args:
+	    first_adj: (Adjacency) first adjacency of the group, updated in place
+	    adj: (Adjacency) adjacency having the same key as first_adj
+	"""
+	first_adj.contigs.append(adj.contigs[0])
+	first_adj.contig_breaks.append(adj.contig_breaks[0])
+	first_adj.contig_sizes.append(adj.contig_sizes[0])
+	if adj.contig_support_span:
+	    first_adj.contig_support_span.append(adj.contig_support_span[0])
+	if adj.probes:
+	    first_adj.probes.append(adj.probes[0])
+	else:
+	    first_adj.probes.append('-')
+	first_adj.aligns.append(adj.aligns[0])
+	first_adj.align_types.append(adj.align_types[0])
+	if adj.homol_seq:
+	    first_adj.homol_seq.append(adj.homol_seq[0])
+	if adj.homol_coords:
+	    first_adj.homol_coords.append(adj.homol_coords[0])
+	for support_type in ('spanning', 'flanking'):
+	    if first_adj.support is not None and adj.support is not None:
+		first_adj.support[support_type] += adj.support[support_type]
+
+	# add up read depth
+	attr = 'read_depth'
+	if hasattr(first_adj, attr) and hasattr(first_adj, attr) and\
+	   getattr(first_adj, attr) is not None and\
+	   getattr(adj, attr) is not None:
+	    setattr(first_adj, attr, getattr(first_adj, attr) + getattr(adj, attr))
+	    
+    @classmethod
+    def external_merge(cls, adjs, tmp_dir, run_size=100000, transcriptome=False, stats=None):
+	"""Same as merge(), but with bounded memory for large numbers of adjacencies
+	
+	Adjacencies are sorted by key in runs of at most run_size adjacencies,
+	each run is spilled to a file in tmp_dir, and runs are combined with a k-way merge.
+	Adjacencies sharing a key are merged in input order and IDs are assigned in key order,
+	so results are identical to merge().
+	Merged adjacencies are yielded in key order as soon as they are complete, so that the caller
+	decides which ones are kept in memory
+	
+	Args:
+	    adjs: (iterable) Adjacency, can be a generator
+	    tmp_dir: (str) directory for storing run files
+	    run_size: (int) maximum number of adjacencies kept in memory before spilling to disk
+	    transcriptome: (boolean) whether adjacency is genomic or transcriptomic
+	    stats: (dict) if given, filled with merge statistics (see update_merge_stats())
+		   once all merged adjacencies are yielded
+	Yields:
+	    Adjacency, with subsets that represent the same adjacency merged
+	"""
+	def spill(run):
+	    run.sort(key=lambda item: item[:2])
+	    run_file = tempfile.NamedTemporaryFile(dir=tmp_dir, prefix='adjs.', suffix='.run', delete=False)
+	    for item in run:
+		cPickle.dump(item, run_file, cPickle.HIGHEST_PROTOCOL)
+	    run_file.close()
+	    del run[:]
+	    return run_file.name
+	
+	def read_run(run_file):
+	    with open(run_file, 'rb') as run:
+		while True:
+		    try:
+			yield cPickle.load(run)
+		    except EOFError:
+			break
+	
+	run_files = []
+	run = []
+	num_adjs = 0
+	for seq_num, adj in enumerate(adjs):
+	    num_adjs += 1
+	    # sequence number keeps input order within same key
+	    run.append((adj.key(transcriptome=transcriptome), seq_num, adj))
+	    if len(run) >= run_size:
+		run_files.append(spill(run))
+		
+	if not run_files:
+	    run.sort(key=lambda item: item[:2])
+	    items = iter(run)
+	else:
+	    if run:
+		run_files.append(spill(run))
+	    items = heapq.merge(*[read_run(run_file) for run_file in run_files])
+	    
+	# for generating ID
+	count = 1
+	num_contigs = {}
+	try:
+	    for key, group in groupby(items, lambda item: item[0]):
+		first_adj = group.next()[2]
+		for item in group:
+		    cls.add_to_merged(first_adj, item[2])
+		first_adj.id = str(count)
+		count += 1
+		# only counts of contigs are kept for statistics
+		num_contigs[len(first_adj.contigs)] = num_contigs.get(len(first_adj.contigs), 0) + 1
+		yield first_adj
+	finally:
+	    for run_file in run_files:
+		os.remove(run_file)
+	    
+	if stats is not None:
+	    stats['adjs'] = num_adjs
+	    stats['merged'] = sum(num_contigs.values())
+	    stats['multi_contig'] = sum([num_contigs[n] for n in num_contigs.keys() if n > 1])
+	    stats['max_contigs'] = max(num_contigs.keys()) if num_contigs else 0
+    
     @classmethod
     def realign(cls, adjs, out_dir, 
                 probe=False, subseq=False, 
                 contigs_fasta = None,
                 use_realigns=False, 
-                name_sep='-', genome=None, index_dir=None, num_procs=None):
+		name_sep='-', genome=None, index_dir=None, num_procs=None, stream=False, cache_file=None):
 	"""Aligns probe and subsequences against reference genome
 	
 	The output of the fasta sequences will be called 'realign.fa',
 	and the alignments will be in 'realign.bam', put in the output directory
+	If stream is True, sequences are piped to the aligner and its alignments are returned
+	as they are output, without writing any file
 	
 	Args:
 	    adjs: (list) Adjacencies for extracting sequences
@@ -982,9 +1195,11 @@ class Adjacency:
 	    genome: (str) prefix of the index of the refernece genome
 	    index_dir: (str) full path of the directory of location of the genome index
 	    num_procs: (int) number of threads to run the alignment
+	    stream: (boolean) pipe sequences to aligner and return alignments instead of writing files
+	    cache_file: (str) path of realignment cache database, only sequences not in cache are aligned
 	
 	Returns:
-	    pysam.samfile handle of realignment bam
+	    path of realignment bam, or iterator of pysam.AlignedSegment if stream is True
 	"""
 	def write_probe(adj, out, name_sep):
 	    """Outputs the probe sequence to output file
@@ -1008,22 +1223,36 @@ class Adjacency:
 	    for i in range(len(subseqs)):
 		out.write('>%s%s%s%s%d\n%s\n' % (adj.contigs[0], name_sep, adj.key(), name_sep, i, subseqs[i]))
 	    
+	def write_seqs(out):
+	    """Outputs sequences of all adjacencies to output file"""
+	    for adj in adjs:
+		if probe:
+		    write_probe(adj, out, name_sep)
+		if subseq and contigs_fasta is not None:
+		    write_subseq(adj, out, name_sep, contigs_fasta)
+	    
 	import bwa_mem
+	
+	if stream:
+	    return bwa_mem.stream(write_seqs, genome, index_dir, num_procs)
 		
 	prefix = 'realign'
 	if not use_realigns:
 	    out_file = '%s/%s.fa' % (out_dir, prefix)
 	    out = open(out_file, 'w')
-	    for adj in adjs:
-		if probe:
-		    write_probe(adj, out, name_sep)
-		if subseq and contigs_fasta is not None:
-		    write_subseq(adj, out, name_sep, contigs_fasta)
+	    write_seqs(out)
 	    out.close()
 	    
 	# run aligner
 	realign_bam_file = '%s/%s.bam' % (out_dir, prefix)
 	if not use_realigns:
-	    return_code = bwa_mem.run(out_file, realign_bam_file, genome, index_dir, num_procs)
+	    if cache_file is not None:
+		from pavfinder.realign_cache import RealignCache
+		cache = RealignCache(cache_file, 'bwa', 'mem -a', '%s/%s' % (index_dir, genome))
+		cache.align(out_file, realign_bam_file,
+			    lambda fasta, bam: bwa_mem.run(fasta, bam, genome, index_dir, num_procs))
+		cache.close()
+	    else:
+		return_code = bwa_mem.run(out_file, realign_bam_file, genome, index_dir, num_procs)
 	
 	return realign_bam_file
@@ -6,8 +6,21 @@ from itertools import groupby
 import pysam
 import sys
 from operator import itemgetter
+from array import array
+
+# CIGAR operations in order of pysam codes
+CIGAR_OPS = 'MIDNSHP=XB'
+
+class Alignment(object):
+    """Alignment of query (contig) to target (genome)
+
+    There is an Alignment for every contig alignment, so attributes are slots,
+    blocks and cigar are kept as flat integer arrays, and no pysam object is retained.
+    """
+    __slots__ = ('query', 'qstart', 'qend', 'target', 'tstart', 'tend', 'strand',
+                 '_blocks', '_query_blocks', '_cigar',
+                 'identity', 'score', 'query_len', 'edit_distance', 'dubious')
 
-class Alignment:
     def __init__(self, query=None, qstart=None, qend=None, 
                  target=None, tstart=None, tend=None,
                  strand=None):
@@ -19,11 +32,12 @@ class Alignment:
         self.blocks = []
         self.query_blocks = []
         self.cigar = None
-        # used in gapped_align.py for indel discovery
-        self.cigarstring = ''
         self.identity = None
         self.score = None
 	self.query_len = None
+        # NM tag
+        self.edit_distance = None
+        self.dubious = False
         
     @classmethod
     def from_alignedRead(cls, read, bam):
@@ -34,18 +48,75 @@ class Alignment:
         align.blocks, align.query_blocks = cigar_to_blocks(read.cigar, read.pos + 1, align.strand)
         align.set_start_end_from_blocks()
         align.cigar = read.cigar
-        align.cigarstring = read.cigarstring
-	align.sam = read
+        try:
+            align.edit_distance = read.opt('NM')
+        except KeyError:
+            pass
         return align
+
+    def __getstate__(self):
+        return dict([(attr, getattr(self, attr)) for attr in self.__slots__ if hasattr(self, attr)])
+
+    def __setstate__(self, state):
+        for attr, value in state.iteritems():
+            setattr(self, attr, value)
+
+    def _get_blocks(self):
+        return unpack_pairs(self._blocks, list)
+
+    def _set_blocks(self, blocks):
+        self._blocks = pack_pairs(blocks)
+
+    # target blocks [[start, end], ...]
+    blocks = property(_get_blocks, _set_blocks)
+
+    def _get_query_blocks(self):
+        return unpack_pairs(self._query_blocks, list)
+
+    def _set_query_blocks(self, query_blocks):
+        self._query_blocks = pack_pairs(query_blocks)
+
+    # query blocks [[start, end], ...], in the same order as target blocks
+    query_blocks = property(_get_query_blocks, _set_query_blocks)
+
+    def _get_cigar(self):
+        return unpack_pairs(self._cigar, tuple)
+
+    def _set_cigar(self, cigar):
+        self._cigar = pack_pairs(cigar)
+
+    # same as pysam AlignedSegment.cigar [(op, length), ...]
+    cigar = property(_get_cigar, _set_cigar)
+
+    @property
+    def cigarstring(self):
+        """Same as pysam AlignedSegment.cigarstring (used in gapped_align.py for indel discovery)"""
+        if self._cigar is None:
+            return ''
+        return ''.join(['%d%s' % (length, CIGAR_OPS[op]) for op, length in self.cigar])
+
+    def effective_edit_distance(self):
+        """Returns edit distance without counting indels (None if NM tag not available)"""
+        if self.edit_distance is None or self._cigar is None:
+            return None
+        indel_len = 0
+        for op, length in self.cigar:
+            if op >= 1 and op <= 2:
+                indel_len += length
+
+        return self.edit_distance - indel_len
     
     def set_start_end_from_blocks(self):
-        if self.query_blocks and self.blocks:
-            if self.query_blocks[0][0] < self.query_blocks[0][1]:
-                self.qstart, self.qend = sorted([self.query_blocks[0][0], self.query_blocks[-1][1]], key=int)
-                self.tstart, self.tend = sorted([self.blocks[0][0], self.blocks[-1][1]], key=int)
+        # blocks are unpacked on every access
+        blocks = self.blocks
+        query_blocks = self.query_blocks
+        if query_blocks and blocks:
+            if query_blocks[0][0] < query_blocks[0][1]:
+                self.qstart, self.qend = sorted([query_blocks[0][0], query_blocks[-1][1]], key=int)
+                self.tstart, self.tend = sorted([blocks[0][0], blocks[-1][1]], key=int)
             else:
-                self.qstart, self.qend = sorted([self.query_blocks[-1][1], self.query_blocks[0][0]], key=int)
-                self.tstart, self.tend = sorted([self.blocks[-1][1], self.blocks[0][0]], key=int)
+                self.qstart, self.qend = sorted([query_blocks[-1][1], query_blocks[0][0]], key=int)
+                self.tstart, self.tend = sorted([blocks[-1][1], blocks[0][0]], key=int)
                 
     def is_valid(self):
         try:
@@ -58,6 +129,7 @@ class Alignment:
         return True
     
     def as_bed(self):
+	blocks = self.blocks
 	cols = [self.target, 
 	        int(self.tstart) - 1,
 	        int(self.tend),
@@ -67,24 +139,51 @@ class Alignment:
 	        int(self.tstart) - 1,
 	        int(self.tend),
 	        0,
-	        len(self.blocks),
-	        ','.join([str(int(b[1]) - int(b[0]) + 1) for b in self.blocks]),
-	        ','.join([str(int(b[0]) - int(self.tstart)) for b in self.blocks])
+	        len(blocks),
+	        ','.join([str(int(b[1]) - int(b[0]) + 1) for b in blocks]),
+	        ','.join([str(int(b[0]) - int(self.tstart)) for b in blocks])
 	        ]
 	        
 	return '\t'.join([str(col) for col in cols])
 
     def qpos_to_tpos(self, qpos):
 	"""Converts query position to target position"""
-	for i in range(len(self.query_blocks)):
-	    qblock = self.query_blocks[i]
-	    tblock = self.blocks[i]
+	for qblock, tblock in zip(self.query_blocks, self.blocks):
 	    if qblock[0] < qblock[1] and qpos >= qblock[0] and qpos <= qblock[1]:
 		return tblock[0] + qpos - qblock[0]
 
 	    elif qblock[0] > qblock[1] and qpos <= qblock[0] and qpos >= qblock[1]:
 		return tblock[0] + qblock[0] - qpos
         
+def pack_pairs(pairs):
+    """Packs list of pairs of ints (e.g. blocks, cigar) into flat array
+
+    Args:
+        pairs: (list) pairs of ints, or None
+    Returns:
+        array('i') [first1, second1, first2, second2, ...] or None
+    """
+    if pairs is None:
+        return None
+    packed = array('i')
+    for first, second in pairs:
+        packed.append(first)
+        packed.append(second)
+    return packed
+
+def unpack_pairs(packed, pair_type=list):
+    """Unpacks flat array created by pack_pairs()
+
+    Args:
+        packed: (array) flat array, or None
+        pair_type: (type) list or tuple, type of each pair
+    Returns:
+        list of pairs or None
+    """
+    if packed is None:
+        return None
+    return [pair_type(packed[i:i + 2]) for i in xrange(0, len(packed), 2)]
+
 def cigar_to_blocks(cigar, tstart, strand):
     query_len = get_query_len_from_cigar(cigar)
     qstart = 1 if strand == '+' else query_len
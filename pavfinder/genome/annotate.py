@@ -1,9 +1,12 @@
 from pybedtools import BedTool, create_interval_from_list
 from itertools import groupby
 from sets import Set
-from intspan import intspan
 import multiprocessing as mp
+import numpy as np
+import os
+import re
 import sys
+import gzip
 
 def get_acen_coords(cytobands_file):
     """Extracts acentromere coordinates from UCSC cytobands file
@@ -221,19 +224,14 @@ def locate_features(breaks, orients, features):
         A tuple of 2 feature (interval object) picked to annotate the 2 breakpoints
         can be (None, None) if nothing is found)
     """
-    # use intspan to intersect individual breakpoint with feature coodinates
-    break1_span = intspan('%s-%s' % (breaks[0][1], breaks[0][1]))
-    break2_span = intspan('%s-%s' % (breaks[1][1], breaks[1][1]))
-    
     # categories features where 1, 2, or both breakpoints overlap
     # use Set because there may be redundancy
     overlaps = {'both':Set(), '1':Set(), '2':Set()}
                           
     for feature in features:        
-        feature_span = intspan('%s-%s' %  (feature.start + 1, feature.stop))
-        
-        overlap1 = True if feature.chrom == breaks[0][0] and feature_span & break1_span else False
-        overlap2 = True if feature.chrom == breaks[1][0] and feature_span & break2_span else False
+        # feature coordinates are 0-based, breakpoint positions 1-based
+        overlap1 = feature.chrom == breaks[0][0] and feature.start < breaks[0][1] <= feature.stop
+        overlap2 = feature.chrom == breaks[1][0] and feature.start < breaks[1][1] <= feature.stop
         if overlap1 and overlap2:
             overlaps['both'].add(feature)
         elif overlap1:
@@ -292,6 +290,270 @@ def parse_overlaps(bed_file):
     
     return results
 
+class Feature:
+    """Exon or intron of annotation index, with the attributes of a Pybedtools Interval
+    of a GTF line used for annotation (chrom, start, stop, strand, attrs, feature[2])
+    """
+    def __init__(self, chrom, start, stop, feature_type, strand, attrs):
+        self.chrom = chrom
+        self.start = start
+        self.stop = self.end = stop
+        self.strand = strand
+        self.attrs = attrs
+        self.fields = [chrom, '.', feature_type, str(start + 1), str(stop), '.', strand, '.',
+                       ' '.join(['%s "%s";' % (key, value) for key, value in attrs.iteritems()])]
+
+    def __getitem__(self, key):
+        if type(key) is int:
+            return self.fields[key]
+        return self.attrs[key]
+
+class AnnotationIndex:
+    """In-memory index of exons and introns of a GTF file, for annotating breakpoints without bedtools
+
+    Features of each chromosome are kept as arrays sorted by start (0-based, end inclusive as in
+    Pybedtools Interval.stop), so features overlapping a breakpoint are found by binary search.
+    Transcript id, gene name and biotype are kept in a table of transcripts, and each feature keeps
+    its exon/intron number
+    """
+    feature_types = ('exon', 'intron')
+    columns = ('starts', 'stops', 'types', 'strands', 'transcripts', 'numbers')
+
+    def __init__(self, chroms, features, transcript_ids, gene_names, gene_biotypes):
+        """Builds index
+
+        Args:
+            chroms: (list) chromosome names, in order of features
+            features: (dict) column name: array of values of features, sorted by chromosome and start
+            transcript_ids, gene_names, gene_biotypes: (list) transcript table, '' for missing values
+        """
+        self.features = features
+        self.transcript_ids = transcript_ids
+        self.gene_names = gene_names
+        self.gene_biotypes = gene_biotypes
+        self.chroms = {}
+        first = 0
+        for chrom, count in chroms:
+            last = first + count
+            max_len = int((features['stops'][first:last] - features['starts'][first:last]).max()) if count else 0
+            self.chroms[chrom] = (first, last, max_len)
+            first = last
+
+    @classmethod
+    def from_gtf(cls, gtf_file, use_cache=True):
+        """Creates index from GTF file
+
+        The index is cached as a binary file (<gtf_file>.npz) beside the GTF file and
+        re-used as long as it is newer than the GTF file
+
+        Args:
+            gtf_file: (str) path of GTF file (can be gzipped)
+            use_cache: (boolean) read/write cached index
+        Returns:
+            AnnotationIndex
+        """
+        cache_file = gtf_file + '.npz'
+        if use_cache and os.path.exists(cache_file) and\
+           os.path.getmtime(cache_file) >= os.path.getmtime(gtf_file):
+            return cls.load(cache_file)
+
+        transcripts = {}
+        transcript_ids, gene_names, gene_biotypes = [], [], []
+        rows = []
+        if gtf_file[-3:] == '.gz':
+            gtf = gzip.open(gtf_file, 'rb')
+        else:
+            gtf = open(gtf_file, 'r')
+        with gtf:
+            for line in gtf:
+                if line[0] == '#':
+                    continue
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 9 or not cols[2] in cls.feature_types:
+                    continue
+                attrs = dict(re.findall(r'(\S+)\s+"([^"]*)"', cols[8]))
+                transcript_id = attrs.get('transcript_id', '')
+                if not transcripts.has_key(transcript_id):
+                    transcripts[transcript_id] = len(transcript_ids)
+                    transcript_ids.append(transcript_id)
+                    gene_names.append(attrs.get('gene_name', ''))
+                    gene_biotypes.append(attrs.get('gene_biotype', ''))
+                number = attrs.get('%s_number' % cols[2], '')
+                rows.append((cols[0],
+                             int(cols[3]) - 1,
+                             int(cols[4]),
+                             cls.feature_types.index(cols[2]),
+                             cols[6],
+                             transcripts[transcript_id],
+                             int(number) if number.isdigit() else -1))
+
+        rows.sort(key=lambda row: (row[0], row[1]))
+        chroms = [(chrom, len(list(group))) for chrom, group in groupby(rows, lambda row: row[0])]
+        columns = zip(*rows) if rows else [()] * 7
+        features = {}
+        for column, values in zip(cls.columns, columns[1:]):
+            if column == 'strands':
+                features[column] = np.array(values, dtype='S1')
+            else:
+                features[column] = np.array(values, dtype=np.int64)
+
+        index = cls(chroms, features, transcript_ids, gene_names, gene_biotypes)
+        if use_cache:
+            try:
+                index.save(cache_file)
+            except (IOError, OSError):
+                pass
+        return index
+
+    def save(self, out_file):
+        """Saves index in NumPy binary format
+
+        Args:
+            out_file: (str) path of output file (should end with .npz)
+        """
+        chroms = sorted(self.chroms.keys(), key=lambda chrom: self.chroms[chrom][0])
+        arrays = {'chroms': np.array(chroms, dtype=str),
+                  'counts': np.array([self.chroms[chrom][1] - self.chroms[chrom][0] for chrom in chroms], dtype=np.int64),
+                  'transcript_ids': np.array(self.transcript_ids, dtype=str),
+                  'gene_names': np.array(self.gene_names, dtype=str),
+                  'gene_biotypes': np.array(self.gene_biotypes, dtype=str)}
+        arrays.update(self.features)
+        with open(out_file, 'wb') as out:
+            np.savez(out, **arrays)
+
+    @classmethod
+    def load(cls, index_file):
+        """Loads index saved by save()
+
+        Args:
+            index_file: (str) path of index file
+        Returns:
+            AnnotationIndex
+        """
+        data = np.load(index_file)
+        return cls(zip([str(chrom) for chrom in data['chroms']], data['counts']),
+                   dict((column, data[column]) for column in cls.columns),
+                   [str(value) for value in data['transcript_ids']],
+                   [str(value) for value in data['gene_names']],
+                   [str(value) for value in data['gene_biotypes']])
+
+    def overlapping_rows(self, chrom, pos):
+        """Returns indices of features overlapping breakpoint, in order of start
+
+        Args:
+            chrom: (str) chromosome
+            pos: (int) 1-based position
+        """
+        if not self.chroms.has_key(chrom):
+            return []
+        first, last, max_len = self.chroms[chrom]
+        starts = self.features['starts'][first:last]
+        lo = starts.searchsorted(pos - max_len - 1, side='left')
+        hi = starts.searchsorted(pos, side='left')
+        return (first + lo + np.flatnonzero(self.features['stops'][first + lo:first + hi] >= pos)).tolist()
+
+    def feature(self, row, chrom):
+        """Creates Feature of row of index
+
+        Args:
+            row: (int) index of feature
+            chrom: (str) chromosome of feature
+        Returns:
+            Feature
+        """
+        transcript = self.features['transcripts'][row]
+        feature_type = self.feature_types[self.features['types'][row]]
+        attrs = {}
+        for key, value in (('gene_name', self.gene_names[transcript]),
+                           ('transcript_id', self.transcript_ids[transcript]),
+                           ('gene_biotype', self.gene_biotypes[transcript])):
+            if value:
+                attrs[key] = value
+        if self.features['numbers'][row] >= 0:
+            attrs['%s_number' % feature_type] = str(self.features['numbers'][row])
+        return Feature(chrom,
+                       int(self.features['starts'][row]),
+                       int(self.features['stops'][row]),
+                       feature_type,
+                       str(self.features['strands'][row]),
+                       attrs)
+
+    def locate_features(self, breaks, orients):
+        """Finds the 'best' gene features of the breakpoints of an event, as locate_features()
+
+        Args:
+            breaks: (tuple) the 2 breakpoints ((chr1, pos1), (chr2, pos2))
+            orients: (tuple) the 2 orientations ('L|R', 'L|R')
+        Returns:
+            A tuple of 2 Features picked to annotate the 2 breakpoints,
+            None if no feature overlaps either breakpoint
+        """
+        rows1 = self.overlapping_rows(breaks[0][0], breaks[0][1])
+        rows2 = self.overlapping_rows(breaks[1][0], breaks[1][1])
+        if not rows1 and not rows2:
+            return None
+
+        # only considers features that overlap both breakpoints if such are found
+        rows_both = Set(rows1) & Set(rows2)
+        if rows_both:
+            features = [self.feature(row, breaks[0][0]) for row in rows1 if row in rows_both]
+            return pick_feature(breaks[0], orients[0], features), pick_feature(breaks[1], orients[1], features)
+
+        return pick_feature(breaks[0], orients[0], [self.feature(row, breaks[0][0]) for row in rows1]),\
+               pick_feature(breaks[1], orients[1], [self.feature(row, breaks[1][0]) for row in rows2])
+
+def annotate_bedpe(bedpe_file, index):
+    """Annotates event breakpoints of bedpe file with annotation index,
+    in place of overlap_pe() and parallel_parse_overlaps()
+
+    Args:
+        bedpe_file: (str) Path of bedpe file of event coords, named by variant key
+        index: (AnnotationIndex) annotation index
+    Returns:
+        A dictionary of results with the variant key as the key
+        and a tuple of 2 Features as the value, for variants with overlapping features
+    """
+    results = {}
+    with open(bedpe_file, 'r') as bedpe:
+        for line in bedpe:
+            if line[0] == '#' or not line.strip():
+                continue
+            cols = line.rstrip('\n').split('\t')
+            variant_key = cols[6]
+            # break = (chrom, pos)
+            breaks = (cols[0], int(cols[2])), (cols[3], int(cols[5]))
+            result = index.locate_features(breaks, variant_key.split('-')[-2:])
+            if result is not None:
+                results[variant_key] = result
+    return results
+
+def parse_group(variant_key, group):
+    """Picks best features for the breakpoints of a variant from its lines of bedtools results
+
+    Args:
+        variant_key: (str) Key of variant (variant.key())
+        group: (list) Lines of bedtools results of variant
+    Returns:
+        (feature1, feature2), where a 'feature' is an Interval object (from Pybedtools) or None
+    """
+    cols = group[0].split('\t')
+    # break = (chrom, pos)
+    break1 = cols[0], int(cols[2])
+    break2 = cols[3], int(cols[5])
+
+    orient1, orient2 = variant_key.split('-')[-2:]
+
+    # extract all the overlapping features (Interval objects)
+    features = []
+    for line in group:
+        cols = line.split('\t')
+        features.append(create_interval_from_list(cols[-9:]))
+
+    result = None, None
+    if features:
+        result = locate_features((break1, break2), (orient1, orient2), features)
+    return result
+
 def parse_overlaps(bed_file, variant_keys=None):
     """Parses bedtools results of event breakpoints and annotation file and returns best features for 
     each breakpoint
@@ -310,65 +572,115 @@ def parse_overlaps(bed_file, variant_keys=None):
         for variant_key, group in groupby(f, lambda line: line.split('\t')[6]):
             if variant_keys is not None and not variant_key in variant_keys:
                 continue
-            
-            group = list(group)
-            cols = group[0].split('\t')
-            # break = (chrom, pos)
-            break1 = cols[0], int(cols[2])
-            break2 = cols[3], int(cols[5])
-            
-            orient1, orient2 = variant_key.split('-')[-2:]
-                        
-            # extract all the overlapping features (Interval objects)
-            features = []
-            for line in group:
-                cols = line.split('\t')
-                features.append(create_interval_from_list(cols[-9:]))      
-                            
-            result = None, None
-            if features:
-                result = locate_features((break1, break2), (orient1, orient2), features)
-            
-            results.append((variant_key, result))
-    f.close()
+            results.append((variant_key, parse_group(variant_key, list(group))))
     
     return results
 
-def create_batches(bed_file, variants, size):  
+def index_overlaps(bed_file, variant_keys=None):
+    """Finds byte offsets of the lines of each variant in bedtools results, in a single pass
+
+    Args:
+        bed_file: (str) Path of bedtools results of event coords vs. annotation
+        variant_keys: (Set) Keys of variants (variant.key()) to consider only
+
+    Returns:
+        List of (variant_key, offset, size) of consecutive lines of variants, in file order
+    """
+    groups = []
+    offset = 0
+    with open(bed_file, 'rb') as f:
+        for variant_key, group in groupby(f, lambda line: line.split('\t')[6]):
+            size = sum([len(line) for line in group])
+            if variant_keys is None or variant_key in variant_keys:
+                groups.append((variant_key, offset, size))
+            offset += size
+    return groups
+
+def read_group(f, offset, size):
+    """Reads lines of a variant in bedtools results at given offset
+
+    Args:
+        f: (file) bedtools results opened in binary mode
+        offset: (int) byte offset of first line
+        size: (int) number of bytes of lines
+    Returns:
+        List of lines, with line endings as when iterating over file
+    """
+    f.seek(offset)
+    lines = f.read(size).split('\n')
+    return [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+
+def feature_to_tuple(feature):
+    """Converts feature (Interval object) to tuple of its fields and 'exon_bound' attribute,
+    which is cheaper to pass between processes
+
+    Args:
+        feature: (Interval) feature returned by pick_feature(), can be None
+    Returns:
+        (fields, exon_bound), None if feature is None
+    """
+    if feature is None:
+        return None
+    exon_bound = feature.attrs['exon_bound'] if feature.attrs.has_key('exon_bound') else None
+    return tuple(feature.fields), exon_bound
+
+def feature_from_tuple(feature_tuple):
+    """Converts tuple returned by feature_to_tuple() back to feature (Interval object)"""
+    if feature_tuple is None:
+        return None
+    fields, exon_bound = feature_tuple
+    feature = create_interval_from_list(list(fields))
+    if exon_bound is not None:
+        feature.attrs['exon_bound'] = exon_bound
+    return feature
+
+def create_batches(bed_file, groups, num_batches):
     """Creates batches for parallel parsing of bedtools results
     
     Args:
         bed_file: (str) Path of bedtools results of event coords vs. annotation
-	variants: (list) Entire list of variant keys to be divided 
-	size: (int) Number of variant keys to be processed in each batch
+        groups: (list) (variant_key, offset, size) returned by index_overlaps()
+        num_batches: (int) Number of batches, of consecutive groups with similar number of bytes
 	
     Yields:
-        Tuple of (bed_file, list of variant_keys)
+        Tuple of (bed_file, list of groups)
     """
-    if size == 0:
-        yield bed_file, variants
-    else:
-        for i in xrange(0, len(variants), size):
-            if len(variants) - (i + size) < size:
-                yield bed_file, variants[i:]
-                break
-            else:
-                yield bed_file, variants[i:i + size]
+    total_size = sum([size for variant_key, offset, size in groups])
+    batch_size = max(1, total_size / max(1, num_batches))
+    batch = []
+    batch_bytes = 0
+    for group in groups:
+        batch.append(group)
+        batch_bytes += group[2]
+        if batch_bytes >= batch_size:
+            yield bed_file, batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield bed_file, batch
 
 def worker(args):
     """Creates worker process of multi-processing
     
     Args:
-        args: (tuple) Bed file, list of variant keys
+        args: (tuple) Bed file, list of (variant_key, offset, size) of variants
 	
     Returns:
-        Function call to parse_overlaps()
+        List of (variant_key, (feature1, feature2)) where features are tuples from feature_to_tuple()
     """
-    bed_file, variant_keys = args
-    return parse_overlaps(bed_file, Set(variant_keys))
+    bed_file, groups = args
+    results = []
+    with open(bed_file, 'rb') as f:
+        for variant_key, offset, size in groups:
+            features = parse_group(variant_key, read_group(f, offset, size))
+            results.append((variant_key, tuple([feature_to_tuple(feature) for feature in features])))
+    return results
         
 def parallel_parse_overlaps(bed_file, variant_keys, num_procs):   
     """Parses annotation overlap results using Multi-processing module
+
+    The file is read once to find the offsets of the lines of each variant, then
+    batches of consecutive variants are parsed by processes that seek directly to their lines
     
     Args:
         bed_file: (str) Path of bedtools results of event coords vs. annotation
@@ -379,17 +691,17 @@ def parallel_parse_overlaps(bed_file, variant_keys, num_procs):
         A dictionary of results with the variant key as the key 
 	and a tuple of Interval objects as the value
     """
-    batches = list(create_batches(bed_file, variant_keys, len(variant_keys)/num_procs))
+    groups = index_overlaps(bed_file, Set(variant_keys))
+    batches = list(create_batches(bed_file, groups, num_procs * 4))
     pool = mp.Pool(processes=num_procs)
-    batch_results = pool.map(worker, batches)
+    results = {}
+    # results are received in file order
+    for batch_result in pool.imap(worker, batches):
+        for variant_key, features in batch_result:
+            results[variant_key] = tuple([feature_from_tuple(feature) for feature in features])
     pool.close()
     pool.join()
         
-    results = {}
-    for batch_result in batch_results:
-        for variant_key, result in batch_result:
-            results[variant_key] = result
-        
     return results
 
 def overlap_pe(variants_bedpe_file, gtf_file, result_file):
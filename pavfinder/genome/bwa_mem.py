@@ -1,8 +1,10 @@
 import re
 from alignment import Alignment, reverse_complement, target_non_canonical
-from subprocess import check_call, CalledProcessError
+from subprocess import check_call, CalledProcessError, Popen, PIPE
 import sys
-from intspan import intspan
+import threading
+import pysam
+from pavfinder.intervals import IntervalSet
 from sets import Set
 
 def find_chimera(alns, bam, debug=False, check_haplotype=True):
@@ -165,6 +167,65 @@ def run(fasta, output_bam, genome, index_dir=None, num_threads=4):
         
     return returncode
 
+def stream(write_fasta, genome, index_dir=None, num_threads=4):
+    """Runs BWA-mem with sequences piped to it, yields alignments as they are output
+
+    No Fasta or BAM file is written: sequences are written to the aligner's stdin in a separate thread
+    while SAM records are parsed from its stdout, so alignments can be processed before all
+    sequences are aligned
+
+    Args:
+        write_fasta: (function) writes Fasta sequences to the file handle given as its only argument
+        genome: (str) Prefix of genome indices in index_dir
+        index_dir: (str) Path of directory containing indices of genome
+        num_threads: (int) Number of threads in running alignment
+    Yields:
+        pysam.AlignedSegment, in order of output of aligner
+    Raises:
+        CalledProcessError if aligner fails,
+        ValueError or IOError if output of aligner cannot be parsed although it succeeded
+    """
+    cmd = ['bwa', 'mem', '-a', '-t', str(num_threads), '%s/%s' % (index_dir, genome), '-']
+
+    print ' '.join(cmd)
+    proc = Popen(cmd, stdin=PIPE, stdout=PIPE)
+
+    def feed():
+        try:
+            write_fasta(proc.stdin)
+        except IOError:
+            # aligner exited early, reported by its return code
+            pass
+        finally:
+            proc.stdin.close()
+    writer = threading.Thread(target=feed)
+    writer.daemon = True
+    writer.start()
+
+    parse_error = None
+    try:
+        sam = pysam.AlignmentFile(proc.stdout, 'r')
+        for aln in sam:
+            yield aln
+        sam.close()
+    except (ValueError, IOError):
+        # no or truncated SAM output is expected if the aligner failed, which takes precedence;
+        # remaining output is drained so that the aligner is not killed by a broken pipe
+        parse_error = sys.exc_info()
+        try:
+            while proc.stdout.read(65536):
+                pass
+        except (ValueError, IOError):
+            pass
+
+    proc.stdout.close()
+    writer.join()
+    returncode = proc.wait()
+    if returncode != 0:
+        raise CalledProcessError(returncode, ' '.join(cmd))
+    if parse_error is not None:
+        raise parse_error[0], parse_error[1], parse_error[2]
+
 def find_microhomology(aligns, contig_seq):
     """Finds micromology given 2 alignments and contig sequence
     The homology sequence is based on the contig sequence
@@ -181,8 +242,8 @@ def find_microhomology(aligns, contig_seq):
     homol_seq = None
     homol_coords = None
     
-    contig_span1 = intspan('%s-%s' % (aligns[0].qstart, aligns[0].qend))
-    contig_span2 = intspan('%s-%s' % (aligns[1].qstart, aligns[1].qend))
+    contig_span1 = IntervalSet.span(aligns[0].qstart, aligns[0].qend)
+    contig_span2 = IntervalSet.span(aligns[1].qstart, aligns[1].qend)
     overlap = contig_span1.intersection(contig_span2)
     if len(overlap) > 0:
         homol_coords = overlap.ranges()[0]
@@ -205,10 +266,10 @@ def find_untemplated_sequence(aligns, contig_seq):
     """
     untemplated_seq = '-'
     
-    contig_span1 = intspan('%s-%s' % (aligns[0].qstart, aligns[0].qend))
-    contig_span2 = intspan('%s-%s' % (aligns[1].qstart, aligns[1].qend))
+    contig_span1 = IntervalSet.span(aligns[0].qstart, aligns[0].qend)
+    contig_span2 = IntervalSet.span(aligns[1].qstart, aligns[1].qend)
     sorted_contig_coords = sorted([aligns[0].qstart, aligns[0].qend, aligns[1].qstart, aligns[1].qend])
-    whole_span = intspan('%s-%s' % (min(sorted_contig_coords), max(sorted_contig_coords)))
+    whole_span = IntervalSet.span(min(sorted_contig_coords), max(sorted_contig_coords))
     unmapped = whole_span - contig_span1 - contig_span2
     
     if len(unmapped) > 0:
@@ -28,18 +28,20 @@ def find_adjs(align, contig_seq, is_transcriptome, ins_as_ins=False, query_fasta
         count += 1
         
     gap_count = 0
-    for i in range(0, len(align.blocks) - 1):
-        target_gap = align.blocks[i + 1][0] - align.blocks[i][1] - 1
+    blocks = align.blocks
+    query_blocks = align.query_blocks
+    for i in range(0, len(blocks) - 1):
+        target_gap = blocks[i + 1][0] - blocks[i][1] - 1
         if align.strand == '+':
-            query_gap = align.query_blocks[i + 1][0] - align.query_blocks[i][1] - 1
+            query_gap = query_blocks[i + 1][0] - query_blocks[i][1] - 1
         else:
-            query_gap = align.query_blocks[i][1] - align.query_blocks[i + 1][0] - 1
+            query_gap = query_blocks[i][1] - query_blocks[i + 1][0] - 1
             
         # deletion or indel
         if target_gap > 0:
             if target_gaps.has_key(gap_count):
-		breaks = (align.blocks[i][1], align.blocks[i + 1][0])
-		contig_breaks = (align.query_blocks[i][1], align.query_blocks[i + 1][0])
+		breaks = (blocks[i][1], blocks[i + 1][0])
+		contig_breaks = (query_blocks[i][1], query_blocks[i + 1][0])
 
 		del_seq = target_fasta.fetch(align.target, breaks[0], breaks[1]-1)
 		if align.strand == '-':
@@ -81,14 +83,14 @@ def find_adjs(align, contig_seq, is_transcriptome, ins_as_ins=False, query_fasta
         # insertion
         elif query_gap > 0:
 	    event = 'ins'
-	    breaks = (align.blocks[i][1], align.blocks[i][1])
-	    contig_breaks = (align.query_blocks[i][1], align.query_blocks[i + 1][0])
+	    breaks = (blocks[i][1], blocks[i][1])
+	    contig_breaks = (query_blocks[i][1], query_blocks[i + 1][0])
 	    
             if align.strand == '+':
-                novel_seq = contig_seq[align.query_blocks[i][1] : align.query_blocks[i][1] + query_gap]
+                novel_seq = contig_seq[query_blocks[i][1] : query_blocks[i][1] + query_gap]
 		novel_seq_ref = novel_seq
             else:
-                novel_seq = contig_seq[align.query_blocks[i + 1][0] : align.query_blocks[i + 1][0] + query_gap]
+                novel_seq = contig_seq[query_blocks[i + 1][0] : query_blocks[i + 1][0] + query_gap]
 		novel_seq_ref = reverse_complement(novel_seq)
 		
 	    length_novel_seq = len(novel_seq)
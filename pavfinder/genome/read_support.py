@@ -1,13 +1,16 @@
 import pysam
 import sys
+import os
+import numpy as np
 import re
 from itertools import groupby, chain
 import argparse
 from sets import Set
-import multiprocessing as mp
-from intspan import intspan
 from collections import OrderedDict, defaultdict
 from operator import itemgetter
+from pavfinder.fasta import SequenceCache
+from pavfinder.intervals import coalesce_arrays
+from pavfinder import scheduler
 
 def find_flanking(reads, span, contig_len, overlap_buffer=1, allow_clipped=False, min_ratio_mapped=None, debug=False):
     uniq_frags = defaultdict(list)
@@ -16,12 +19,12 @@ def find_flanking(reads, span, contig_len, overlap_buffer=1, allow_clipped=False
     proper_pairs = Set()
     for read in reads:
 	if read.is_proper_pair and is_fully_mapped(read, contig_len, allow_clipped=allow_clipped, min_ratio_mapped=min_ratio_mapped):
-	    proper_pairs.add(read.qname + str(read.pos))
+	    proper_pairs.add((read.qname, read.pos))
 	    #if read.tlen > 0:
 		#tlens.append(read.tlen)
 
     for read in [r for r in reads if not r.is_unmapped and r.tlen > 0]:
-	if read.qname + str(read.pos) in proper_pairs:
+	if (read.qname, read.pos) in proper_pairs:
 	    # internal fragment
 	    frag = (read.pos + read.alen, read.pnext)
 
@@ -72,6 +75,494 @@ def find_spanning(reads, span, contig_seq, overlap_buffer=1, debug=False, perfec
 
     return num_frags
 
+class SpanSupport:
+    """Read support of a contig breakpoint, accumulated one read at a time by sweep_support()"""
+    def __init__(self, span, contig_seq, overlap_buffer):
+	self.span = span
+	self.break_seq = contig_seq[span[0] - 1 - overlap_buffer: span[1] + overlap_buffer]
+	# keys and names of spanning reads
+	self.spanning_keys = Set()
+	self.spanning_names = Set()
+	# keys of proper pairs and (key, fragment, name) of reads that could flank span
+	self.proper_pairs = Set()
+	self.frags = []
+
+    def num_flanking(self, debug=False):
+	"""Returns number of unique fragments flanking span, as find_flanking()"""
+	uniq_frags = defaultdict(list)
+	for key, frag, qname in self.frags:
+	    if key in self.proper_pairs:
+		uniq_frags[frag].append(qname)
+
+	if debug:
+	    for f in uniq_frags.keys():
+		sys.stdout.write("Accepted flanking: %s %s %s\n" % (self.span, f, ','.join(uniq_frags[f])))
+
+	return len(uniq_frags.keys())
+
+def sweep_support(reads, spans, contig_seq, overlap_buffer=0, perfect=False, allow_clipped=False, min_ratio_mapped=None,
+		  window_size=2000, debug=False):
+    """Finds spanning reads and flanking pairs of all breakpoints of a contig in a single pass over its reads
+
+    Reads are swept in coordinate order while the spans whose window (span extended by window_size on both sides)
+    the current read can overlap are kept active, so each read is checked once against the spans it can touch.
+    Results are the same as find_spanning() and find_flanking() on the reads fetched within the window of each span.
+
+    Args:
+	reads: (iterator) Pysam AlignedRead objects of contig in coordinate order
+	spans: (list) (start, end) of breakpoints
+	contig_seq: (str) contig sequence
+	overlap_buffer: (int) minimum breakpoint overlap
+	window_size: (int) reads within this distance of a span are considered
+    Returns:
+	dictionary of span: (number of spanning reads, number of flanking pairs)
+    """
+    contig_len = len(contig_seq)
+    spans_sorted = sorted(Set(spans), key=lambda span: span[0])
+    results = {}
+    active = []
+    next_span = 0
+
+    def finish(support):
+	results[support.span] = (len(support.spanning_keys), support.num_flanking(debug=debug))
+
+    for read in reads:
+	read_end = read.pos + read.alen if read.alen else read.pos + 1
+
+	# spans whose window ends before read can't be touched by any following read
+	if active and [support for support in active if read.pos >= support.span[1] + window_size]:
+	    remaining = []
+	    for support in active:
+		if read.pos >= support.span[1] + window_size:
+		    finish(support)
+		else:
+		    remaining.append(support)
+	    active = remaining
+	while next_span < len(spans_sorted) and spans_sorted[next_span][0] - window_size < read_end:
+	    active.append(SpanSupport(spans_sorted[next_span], contig_seq, overlap_buffer))
+	    next_span += 1
+
+	fully_mapped = None
+	fully_mapped_spanning = None
+	key = (read.qname, read.pos)
+	for support in active:
+	    span = support.span
+	    if span[0] - window_size >= read_end or read.pos >= span[1] + window_size:
+		continue
+
+	    # spanning (find_spanning())
+	    if read.alen and read.pos < span[0] - overlap_buffer and read.pos + read.alen >= span[1] + overlap_buffer:
+		if fully_mapped_spanning is None:
+		    fully_mapped_spanning = is_fully_mapped(read, contig_len, perfect=perfect, allow_clipped=allow_clipped, min_ratio_mapped=min_ratio_mapped)
+		if fully_mapped_spanning and is_break_region_perfect(read, support.break_seq, span, overlap_buffer):
+		    strand = '+' if not read.is_reverse else '-'
+		    start_pos = read.pos
+		    if read.cigar[0][0] >= 4 and read.cigar[0][0] <= 5:
+			start_pos = -1 * read.cigar[0][1]
+		    spanning_key = str(start_pos) + strand
+		    if not spanning_key in support.spanning_keys and not read.qname in support.spanning_names:
+			support.spanning_keys.add(spanning_key)
+			support.spanning_names.add(read.qname)
+
+			if debug:
+			    sys.stdout.write("Accepted spanning read(perfect:%s): %s %s %s %s %s\n" % (perfect,
+												       read.qname,
+												       span,
+												       (read.pos + 1, read.pos + read.alen),
+												       read.seq,
+												       strand))
+
+	    # flanking (find_flanking())
+	    if read.is_proper_pair:
+		if fully_mapped is None:
+		    fully_mapped = is_fully_mapped(read, contig_len, allow_clipped=allow_clipped, min_ratio_mapped=min_ratio_mapped)
+		if fully_mapped:
+		    support.proper_pairs.add(key)
+	    if not read.is_unmapped and read.tlen > 0:
+		frag = (read.pos + read.alen, read.pnext)
+		if frag[0] <= span[0] - overlap_buffer and frag[1] >= span[1] + overlap_buffer:
+		    support.frags.append((key, frag, read.qname))
+
+    for support in active:
+	finish(support)
+    for span in spans_sorted[next_span:]:
+	results[span] = (0, 0)
+
+    return results
+
+class ReadArrays:
+    """Features of the reads of a contig as NumPy arrays (struct of arrays), for batch_support()
+
+    Reads are kept in the order given (coordinate order), so positions are sorted.
+    Query names are replaced by integer ids, and (query name, position) by an integer key.
+    """
+    def __init__(self, reads, contig_len, perfect=False, allow_clipped=False, min_ratio_mapped=None):
+	"""Loads reads
+
+	Args:
+	    reads: (iterator) Pysam AlignedRead objects of contig in coordinate order
+	    contig_len: (int) contig length
+	    perfect, allow_clipped, min_ratio_mapped: see is_fully_mapped()
+	"""
+	self.reads = []
+	qname_ids = {}
+	features = []
+	for read in reads:
+	    self.reads.append(read)
+	    qname_id = qname_ids.setdefault(read.qname, len(qname_ids))
+	    cigar = read.cigar
+	    ops = [op for op, length in cigar] if cigar else []
+	    nm = -1
+	    if perfect and not read.is_unmapped and read.has_tag('NM'):
+		nm = read.opt('NM')
+	    features.append((read.pos,
+			     read.alen or 0,
+			     read.tlen,
+			     read.pnext,
+			     read.is_unmapped,
+			     read.is_reverse,
+			     read.is_proper_pair,
+			     len(ops),
+			     ops[0] if ops else -1,
+			     cigar[0][1] if ops else 0,
+			     ops[1] if len(ops) > 1 else -1,
+			     ops[2] if len(ops) > 2 else -1,
+			     4 in ops or 5 in ops,
+			     4 in ops,
+			     read.inferred_length if ops else 0,
+			     read.rlen,
+			     nm,
+			     qname_id))
+
+	columns = zip(*features) if features else [()] * 18
+	(self.pos, self.alen, self.tlen, self.pnext, self.unmapped, self.reverse, self.proper_pair,
+	 num_ops, op0, len0, op1, op2, has_clip, has_soft_clip, inferred_len, rlen, nm, self.qname_ids) =\
+	    [np.array(column, dtype=np.int64) for column in columns]
+	self.unmapped = self.unmapped.astype(bool)
+	self.reverse = self.reverse.astype(bool)
+	self.proper_pair = self.proper_pair.astype(bool)
+	has_clip = has_clip.astype(bool)
+	has_soft_clip = has_soft_clip.astype(bool)
+
+	# end of read as in BAM index (unmapped reads occupy 1 base)
+	self.end = np.where(self.alen > 0, self.pos + self.alen, self.pos + 1)
+	self.max_len = int((self.end - self.pos).max()) if len(self.pos) else 0
+	# (query name, position) as integer
+	self.keys = self.qname_ids * (int(self.pos.max()) + 2 if len(self.pos) else 1) + self.pos + 1
+
+	# is_fully_mapped() and is_fully_mapped_to_edge()
+	op0_clip = (op0 == 4) | (op0 == 5)
+	full_len = inferred_len == rlen
+	to_edge = ((num_ops == 2) & ((op0_clip & (op1 == 0) & (self.pos == 0) & full_len) |\
+				     ((op0 == 0) & (op1 != 0) & (self.pos + self.alen == contig_len) & full_len))) |\
+		  ((num_ops == 3) & (self.pos == 0) & (self.pos + self.alen == contig_len) &\
+		   op0_clip & (op1 == 0) & ((op2 == 4) | (op2 == 5)) & full_len)
+	# fully mapped when clipped reads are not allowed
+	self.fully_mapped_strict = (~has_clip | to_edge) & (num_ops > 0) & ~self.unmapped
+	# ratio of read length mapped of reads that are fully mapped if clipped reads are allowed
+	# and ratio is above minimum, -1 for other reads
+	with np.errstate(divide='ignore', invalid='ignore'):
+	    self.ratio_mapped = np.where((num_ops == 2) & has_soft_clip & ~self.unmapped,
+					 self.alen.astype(float) / inferred_len, -1.0)
+	self.fully_mapped = self.fully_mapped_strict.copy()
+	if allow_clipped and min_ratio_mapped is not None:
+	    self.fully_mapped |= self.ratio_mapped >= min_ratio_mapped
+	self.fully_mapped_spanning = self.fully_mapped & (nm == 0) if perfect else self.fully_mapped
+
+	# read start used for identifying unique spanning reads
+	self.start_pos = np.where(op0_clip, -len0, self.pos)
+
+def batch_support(reads, spans, contig_seq, overlap_buffer=0, perfect=False, allow_clipped=False, min_ratio_mapped=None,
+		  window_size=2000, debug=False):
+    """Finds spanning reads and flanking pairs of all breakpoints of a contig with NumPy masks over its reads
+
+    Same results as sweep_support(), but read features are extracted once (ReadArrays) and the reads
+    of each span are selected with binary search on positions and masks
+
+    Args:
+	see sweep_support()
+    Returns:
+	dictionary of span: (number of spanning reads, number of flanking pairs)
+    """
+    contig_len = len(contig_seq)
+    arrays = ReadArrays(reads, contig_len, perfect=perfect, allow_clipped=allow_clipped, min_ratio_mapped=min_ratio_mapped)
+    pos, end = arrays.pos, arrays.end
+
+    results = {}
+    for span in Set(spans):
+	# spanning (find_spanning()): reads starting before and ending after span
+	lo = pos.searchsorted(span[1] + overlap_buffer - arrays.max_len, side='left')
+	hi = pos.searchsorted(span[0] - overlap_buffer, side='left')
+	candidates = lo + np.flatnonzero((arrays.alen[lo:hi] > 0) &\
+					 (end[lo:hi] >= span[1] + overlap_buffer) &\
+					 arrays.fully_mapped_spanning[lo:hi])
+	break_seq = contig_seq[span[0] - 1 - overlap_buffer: span[1] + overlap_buffer]
+	spanning_keys = Set()
+	spanning_names = Set()
+	for i in candidates:
+	    read = arrays.reads[i]
+	    if not is_break_region_perfect(read, break_seq, span, overlap_buffer):
+		continue
+	    spanning_key = (arrays.start_pos[i], arrays.reverse[i])
+	    if not spanning_key in spanning_keys and not arrays.qname_ids[i] in spanning_names:
+		spanning_keys.add(spanning_key)
+		spanning_names.add(arrays.qname_ids[i])
+		if debug:
+		    strand = '+' if not read.is_reverse else '-'
+		    sys.stdout.write("Accepted spanning read(perfect:%s): %s %s %s %s %s\n" % (perfect,
+											       read.qname,
+											       span,
+											       (read.pos + 1, read.pos + read.alen),
+											       read.seq,
+											       strand))
+
+	# flanking (find_flanking()): reads within window of span
+	lo = pos.searchsorted(span[0] - window_size - arrays.max_len, side='left')
+	hi = pos.searchsorted(span[1] + window_size, side='left')
+	window = slice(lo, hi)
+	in_window = end[window] > span[0] - window_size
+	proper_keys = arrays.keys[window][in_window & arrays.proper_pair[window] & arrays.fully_mapped[window]]
+	frag_ends = pos[window] + arrays.alen[window]
+	flanking = lo + np.flatnonzero(in_window &\
+				       ~arrays.unmapped[window] &\
+				       (arrays.tlen[window] > 0) &\
+				       (frag_ends <= span[0] - overlap_buffer) &\
+				       (arrays.pnext[window] >= span[1] + overlap_buffer))
+	flanking = flanking[np.in1d(arrays.keys[flanking], proper_keys)]
+	frags = Set(zip((pos[flanking] + arrays.alen[flanking]).tolist(), arrays.pnext[flanking].tolist()))
+	if debug:
+	    for frag in frags:
+		names = [arrays.reads[i].qname for i in flanking if (pos[i] + arrays.alen[i], arrays.pnext[i]) == frag]
+		sys.stdout.write("Accepted flanking: %s %s %s\n" % (span, frag, ','.join(names)))
+
+	results[span] = (len(spanning_keys), len(frags))
+
+    return results
+
+def break_region_overlap(read, contig_seq, span):
+    """Returns largest overlap buffer with which read spans breakpoint, as checked by find_spanning()
+
+    The read must start more than the buffer before the breakpoint, end at least the buffer after it,
+    and match the contig from the buffer before to the buffer after the breakpoint (is_break_region_perfect())
+
+    Args:
+	read: (AlignedRead) read aligned to contig
+	contig_seq: (str) contig sequence
+	span: (tuple) sorted breakpoint coordinates
+    Returns:
+	largest buffer (int), -1 if read doesn't span breakpoint with any buffer
+    """
+    max_buffer = min(span[0] - read.pos - 1, read.pos + read.alen - span[1])
+    if max_buffer < 0 or not is_break_region_perfect(read, contig_seq[span[0] - 1: span[1]], span, 0):
+	return -1
+
+    # extend matching region on both sides
+    seq = read.seq.lower()
+    start_idx = span[0] - read.pos - 1
+    if read.cigar[0][0] >= 4 and read.cigar[0][0] <= 5:
+	start_idx += read.cigar[0][1]
+    end_idx = start_idx + span[1] - span[0] + 1
+    buf = 0
+    while buf < max_buffer and\
+	  start_idx - buf - 1 >= 0 and end_idx + buf < len(seq) and span[1] + buf < len(contig_seq) and\
+	  seq[start_idx - buf - 1] == contig_seq[span[0] - buf - 2].lower() and\
+	  seq[end_idx + buf] == contig_seq[span[1] + buf].lower():
+	buf += 1
+    return buf
+
+class EvidenceStore:
+    """Reads that can support contig breakpoints, for counting support with any thresholds without scanning the BAM again
+
+    For each breakpoint, candidate spanning reads and flanking pairs are stored in columns (NumPy arrays) with
+    the features that the thresholds are tested on: largest overlap buffer they pass (min_overlap),
+    whether they are fully mapped without clipping, and their ratio of read length mapped (allow_clipped, min_ratio_mapped).
+    Spanning reads also keep what identifies unique reads, flanking pairs their fragment.
+    """
+    spanning_columns = ('span', 'overlap', 'strict', 'ratio_mapped', 'start_pos', 'reverse', 'qname')
+    flanking_columns = ('span', 'overlap', 'strict', 'ratio_mapped', 'frag_end', 'pnext')
+
+    def __init__(self, contigs, starts, ends, spanning, flanking):
+	"""Creates store
+
+	Args:
+	    contigs, starts, ends: (list) contig and sorted coordinates of each breakpoint
+	    spanning: (dict) column name: array of values of candidate spanning reads, 'span' is index of breakpoint
+	    flanking: (dict) column name: array of values of candidate flanking reads, 'span' is index of breakpoint
+	"""
+	self.contigs = list(contigs)
+	self.starts = np.array(starts, dtype=np.int64)
+	self.ends = np.array(ends, dtype=np.int64)
+	self.spanning = spanning
+	self.flanking = flanking
+
+    @classmethod
+    def collect(cls, reads, contig, spans, contig_seq, window_size=2000):
+	"""Collects evidence of breakpoints of a contig, with reads fetched as in batch_support()
+
+	Args:
+	    reads: (iterator) Pysam AlignedRead objects of contig in coordinate order
+	    contig: (str) contig name
+	    spans: (list) (start, end) of breakpoints
+	    contig_seq: (str) contig sequence
+	    window_size: (int) reads within this distance of a span are considered
+	Returns:
+	    EvidenceStore
+	"""
+	arrays = ReadArrays(reads, len(contig_seq))
+	pos, end = arrays.pos, arrays.end
+	spans = sorted(Set(spans))
+
+	spanning = dict((column, []) for column in cls.spanning_columns)
+	flanking = dict((column, []) for column in cls.flanking_columns)
+	for i in range(len(spans)):
+	    span = spans[i]
+	    # spanning: reads starting before and ending after span
+	    lo = pos.searchsorted(span[1] - arrays.max_len, side='left')
+	    hi = pos.searchsorted(span[0], side='left')
+	    for j in lo + np.flatnonzero((arrays.alen[lo:hi] > 0) & (end[lo:hi] >= span[1])):
+		overlap = break_region_overlap(arrays.reads[j], contig_seq, span)
+		if overlap < 0:
+		    continue
+		for column, value in zip(cls.spanning_columns,
+					 (i, overlap, arrays.fully_mapped_strict[j], arrays.ratio_mapped[j],
+					  arrays.start_pos[j], arrays.reverse[j], arrays.qname_ids[j])):
+		    spanning[column].append(value)
+
+	    # flanking: pairs within window of span, a read is fully mapped if any read
+	    # of the same name and position is a fully mapped proper pair
+	    lo = pos.searchsorted(span[0] - window_size - arrays.max_len, side='left')
+	    hi = pos.searchsorted(span[1] + window_size, side='left')
+	    window = lo + np.flatnonzero(end[lo:hi] > span[0] - window_size)
+	    if not len(window):
+		continue
+	    keys, key_index = np.unique(arrays.keys[window], return_inverse=True)
+	    strict = np.zeros(len(keys), dtype=bool)
+	    np.logical_or.at(strict, key_index, arrays.proper_pair[window] & arrays.fully_mapped_strict[window])
+	    ratio_mapped = np.full(len(keys), -1.0)
+	    np.maximum.at(ratio_mapped, key_index, np.where(arrays.proper_pair[window], arrays.ratio_mapped[window], -1.0))
+
+	    frag_ends = pos[window] + arrays.alen[window]
+	    candidates = np.flatnonzero(~arrays.unmapped[window] &\
+					(arrays.tlen[window] > 0) &\
+					(frag_ends <= span[0]) &\
+					(arrays.pnext[window] >= span[1]))
+	    flanking['span'].extend([i] * len(candidates))
+	    flanking['overlap'].extend(np.minimum(span[0] - frag_ends[candidates], arrays.pnext[window][candidates] - span[1]))
+	    flanking['strict'].extend(strict[key_index[candidates]])
+	    flanking['ratio_mapped'].extend(ratio_mapped[key_index[candidates]])
+	    flanking['frag_end'].extend(frag_ends[candidates])
+	    flanking['pnext'].extend(arrays.pnext[window][candidates])
+
+	return cls([contig] * len(spans), [span[0] for span in spans], [span[1] for span in spans],
+		   cls.to_arrays(spanning), cls.to_arrays(flanking))
+
+    @classmethod
+    def to_arrays(cls, columns):
+	arrays = {}
+	for column, values in columns.iteritems():
+	    if column in ('strict', 'reverse'):
+		arrays[column] = np.array(values, dtype=bool)
+	    elif column == 'ratio_mapped':
+		arrays[column] = np.array(values, dtype=float)
+	    else:
+		arrays[column] = np.array(values, dtype=np.int64)
+	return arrays
+
+    @classmethod
+    def merge(cls, stores):
+	"""Merges stores of different breakpoints into one EvidenceStore"""
+	contigs, starts, ends = [], [], []
+	spanning = dict((column, []) for column in cls.spanning_columns)
+	flanking = dict((column, []) for column in cls.flanking_columns)
+	for store in stores:
+	    for columns, store_columns in ((spanning, store.spanning), (flanking, store.flanking)):
+		for column in columns.keys():
+		    if column == 'span':
+			columns[column].append(store_columns[column] + len(contigs))
+		    else:
+			columns[column].append(store_columns[column])
+	    contigs.extend(store.contigs)
+	    starts.extend(store.starts)
+	    ends.extend(store.ends)
+	def concatenate(columns):
+	    return dict((column, np.concatenate(values)) for column, values in columns.iteritems() if values)
+	if not stores:
+	    return cls([], [], [], cls.to_arrays(spanning), cls.to_arrays(flanking))
+	return cls(contigs, starts, ends, concatenate(spanning), concatenate(flanking))
+
+    def save(self, out_file):
+	"""Saves store in NumPy binary format
+
+	Args:
+	    out_file: (str) path of output file (should end with .npz)
+	"""
+	arrays = {'contigs': np.array(self.contigs, dtype=str), 'starts': self.starts, 'ends': self.ends}
+	for prefix, columns in (('spanning', self.spanning), ('flanking', self.flanking)):
+	    for column, values in columns.iteritems():
+		arrays['%s_%s' % (prefix, column)] = values
+	with open(out_file, 'wb') as out:
+	    np.savez(out, **arrays)
+
+    @classmethod
+    def load(cls, store_file):
+	"""Loads store saved by save()
+
+	Args:
+	    store_file: (str) path of store file
+	Returns:
+	    EvidenceStore
+	"""
+	data = np.load(store_file)
+	spanning = dict((column, data['spanning_%s' % column]) for column in cls.spanning_columns)
+	flanking = dict((column, data['flanking_%s' % column]) for column in cls.flanking_columns)
+	return cls([str(contig) for contig in data['contigs']], data['starts'], data['ends'], spanning, flanking)
+
+    def support(self, min_overlap=4, allow_clipped=False, min_ratio_mapped=None):
+	"""Counts support of breakpoints with given thresholds
+
+	Args:
+	    see gather_support()
+	Returns:
+	    dict of contig: dict of 'start-end' (sorted coordinates): (spanning reads, flanking pairs)
+	    same as gather_support()
+	"""
+	def passed(columns):
+	    mask = columns['overlap'] >= min_overlap
+	    if allow_clipped and min_ratio_mapped is not None:
+		return mask & (columns['strict'] | (columns['ratio_mapped'] >= min_ratio_mapped))
+	    return mask & columns['strict']
+
+	# unique spanning reads, in coordinate order (find_spanning())
+	spanning = np.zeros(len(self.contigs), dtype=np.int64)
+	keys, names = Set(), Set()
+	span = None
+	columns = self.spanning
+	for i in np.flatnonzero(passed(columns)):
+	    if columns['span'][i] != span:
+		span = columns['span'][i]
+		keys, names = Set(), Set()
+	    key = (columns['start_pos'][i], columns['reverse'][i])
+	    if not key in keys and not columns['qname'][i] in names:
+		keys.add(key)
+		names.add(columns['qname'][i])
+		spanning[span] += 1
+
+	# unique fragments (find_flanking())
+	flanking = np.zeros(len(self.contigs), dtype=np.int64)
+	columns = self.flanking
+	selected = np.flatnonzero(passed(columns))
+	if len(selected):
+	    spans, frag_ends, pnexts = columns['span'][selected], columns['frag_end'][selected], columns['pnext'][selected]
+	    order = np.lexsort((pnexts, frag_ends, spans))
+	    spans, frag_ends, pnexts = spans[order], frag_ends[order], pnexts[order]
+	    first = np.concatenate(([True], (spans[1:] != spans[:-1]) | (frag_ends[1:] != frag_ends[:-1]) | (pnexts[1:] != pnexts[:-1])))
+	    flanking = np.bincount(spans[first], minlength=len(self.contigs))
+
+	results = defaultdict(dict)
+	for i in range(len(self.contigs)):
+	    results[self.contigs[i]]['%s-%s' % (self.starts[i], self.ends[i])] = (int(spanning[i]), int(flanking[i]))
+	return results
+
 def is_break_region_perfect(read, break_seq, breaks, overlap_buffer):
     start_idx = breaks[0] - read.pos - 1
     if read.cigar[0][0] >= 4 and read.cigar[0][0] <= 5:
@@ -95,7 +586,8 @@ def check_tiling(reads, breaks, contig_len, debug=False):
     Returns:
         Boolean if there are reads spanning across breakpoints with no gaps
     """
-    span = None
+    starts = []
+    ends = []
     for read in reads:
 	# skip reads that is unmapped, not properly paired, or the second mate, or not fully mapped
         if not read.alen or not is_fully_mapped(read, contig_len):
@@ -105,15 +597,13 @@ def check_tiling(reads, breaks, contig_len, debug=False):
 	if read.pos + read.alen < breaks[0] or read.pos > breaks[1]:
 	    continue
 	
-	try:
-	    span = span.union(intspan('%d-%d' % (read.pos + 1, read.pos + read.alen)))
-	except:
-	    span = intspan('%d-%d' % (read.pos + 1, read.pos + read.alen))
+	starts.append(read.pos + 1)
+	ends.append(read.pos + read.alen)
 	    	
-    if span is not None:
-	break_span = intspan('%d-%d' % (breaks[0], breaks[1]))
+    if starts:
+	span_starts, span_ends = coalesce_arrays(starts, ends)
 	# make sure there is no gap in tiling reads and spans the entire breakpoint
-	if len(span.ranges()) == 1 and len(span & break_span) == len(break_span):
+	if len(span_starts) == 1 and span_starts[0] <= breaks[0] and span_ends[0] >= breaks[1]:
 	    return True
     
     return False
@@ -155,12 +645,15 @@ def is_fully_mapped_to_edge(read, contig_len):
     return False
 
 def worker(args):
-    bam_file, coords, overlap_buffer, contig_fasta_file, perfect, get_seq, allow_clipped, min_ratio_mapped, debug = args
-    contig_fasta = pysam.Fastafile(contig_fasta_file)
+    bam_file, coords, overlap_buffer, contig_fasta_file, perfect, get_seq, allow_clipped, min_ratio_mapped, batch, evidence, debug = args
+    contig_fasta = SequenceCache(contig_fasta_file)
 
     coords_batch = defaultdict(list)
     for contig, start, end, align_type in coords:
 	coords_batch[contig].append(((start, end), align_type))
+
+    if evidence:
+	return fetch_evidence(coords_batch, bam_file, contig_fasta)
     
     results, tlens = fetch_support(coords_batch,
                                    bam_file,
@@ -170,6 +663,7 @@ def worker(args):
                                    get_seq=get_seq,
                                    allow_clipped=allow_clipped,
                                    min_ratio_mapped=min_ratio_mapped,
+				   batch=batch,
                                    debug=debug)
 
     supports = []
@@ -184,24 +678,48 @@ def worker(args):
     supports.append(tlens)
     return supports
 
-def create_batches(bam_file, coords, size, overlap_buffer, contig_fasta_file, perfect, get_seq, allow_clipped, min_ratio_mapped, debug=False):
-    if size == 0:
-        yield bam_file, coords, overlap_buffer, contig_fasta_file, perfect, get_seq, debug
-    else:
-        for i in xrange(0, len(coords), size):
-            if len(coords) - (i + size) < size:
-                yield bam_file, coords[i:], overlap_buffer, contig_fasta_file, perfect, get_seq, allow_clipped, min_ratio_mapped, debug
-                break
-            else:
-                yield bam_file, coords[i:i + size], overlap_buffer, contig_fasta_file, perfect, get_seq, allow_clipped, min_ratio_mapped, debug
-
-def fetch_support(coords, bam_file, contig_fasta, overlap_buffer=0, perfect=False, get_seq=False, allow_clipped=False, min_ratio_mapped=None, debug=False):
+def samples_worker(args):
+    """Runs worker() on coords of each sample of a chunk
+
+    Args:
+	args: (list) (sample index, arguments of worker())
+    Returns:
+	list of (sample index, result of worker())
+    """
+    return [(sample, worker(worker_args)) for sample, worker_args in args]
+
+def create_batches(samples, chunks, contig_fasta_file, perfect, get_seq, batch=True, evidence=False, debug=False):
+    """Iterator of arguments of samples_worker() for each chunk of coords
+
+    Args:
+	samples: (list) (coords, bam_file, min_overlap, allow_clipped, min_ratio_mapped) of each sample
+	chunks: (list) (cost, list of (sample index, coords)) returned by scheduler.make_chunks()
+    Yields:
+	tuple of cost and arguments of samples_worker()
+    """
+    for cost, items in chunks:
+	coords_by_sample = OrderedDict()
+	for sample, coords in items:
+	    coords_by_sample.setdefault(sample, []).append(coords)
+	args = []
+	for sample, coords in coords_by_sample.iteritems():
+	    bam_file, overlap_buffer, allow_clipped, min_ratio_mapped = samples[sample][1:]
+	    args.append((sample, (bam_file, coords, overlap_buffer, contig_fasta_file, perfect, get_seq, allow_clipped, min_ratio_mapped, batch, evidence, debug)))
+	yield cost, args
+
+def fetch_support(coords, bam_file, contig_fasta, overlap_buffer=0, perfect=False, get_seq=False, allow_clipped=False, min_ratio_mapped=None,
+		  sweep=True, batch=True, debug=False):
     """Fetches read support when number given coords is relatively small
     It will use Pysam's fetch() instead of going through all read alignments
+    With sweep, reads of each contig are fetched once and evaluated against all its spans,
+    with NumPy arrays (batch_support()) if batch is True, or one read at a time (sweep_support()),
+    otherwise reads are fetched around each span
     Args:
         coords: (dictionary) coords[contig] = [spans]
                 spans = (list) of (start, end) where 'start' and 'end' are not sorted
         bam_file: (string) absolute path of reads-to-contigs bam file
+	sweep: (boolean) fetch reads of each contig once
+	batch: (boolean) evaluate reads of each contig with NumPy arrays, used with sweep
         debug: (boolean) prints debug statements
     Returns:
         dictionary of number of read support
@@ -223,6 +741,25 @@ def fetch_support(coords, bam_file, contig_fasta, overlap_buffer=0, perfect=Fals
 	contig_seq = contig_fasta.fetch(contig)
 	contig_len = len(contig_seq)
 
+	if sweep:
+	    spans = [span for span, align_type in spans_align_types]
+	    start = max(0, min([span[0] for span in spans]) - window_size)
+	    end = min(contig_len, max([span[1] for span in spans]) + window_size)
+	    if batch:
+		support_fn = batch_support
+	    else:
+		support_fn = sweep_support
+	    support = support_fn(bam.fetch(contig, start, end), spans, contig_seq,
+				 overlap_buffer=overlap_buffer,
+				 perfect=perfect,
+				 allow_clipped=allow_clipped,
+				 min_ratio_mapped=min_ratio_mapped,
+				 window_size=window_size,
+				 debug=debug)
+	    for span in spans:
+		results[contig]['-'.join(map(str, span))] = [support[span][0], support[span][1], None, []]
+	    continue
+
 	spans = []
 	for span, align_type in spans_align_types:
 	    spans.append(span)
@@ -253,6 +790,28 @@ def fetch_support(coords, bam_file, contig_fasta, overlap_buffer=0, perfect=Fals
 
     return results, tlens_all
 
+def fetch_evidence(coords, bam_file, contig_fasta, window_size=2000):
+    """Collects evidence of breakpoints, reads are fetched as in fetch_support()
+
+    Args:
+	coords: (dictionary) coords[contig] = [(span, align_type)]
+	bam_file: (string) absolute path of reads-to-contigs bam file
+	contig_fasta: (SequenceCache) contig sequences
+	window_size: (int) reads within this distance of a span are considered
+    Returns:
+	EvidenceStore
+    """
+    bam = pysam.Samfile(bam_file, 'rb')
+    stores = []
+    for contig, spans_align_types in coords.iteritems():
+	contig_seq = contig_fasta.fetch(contig)
+	spans = [tuple(sorted(span)) for span, align_type in spans_align_types]
+	start = max(0, min([span[0] for span in spans]) - window_size)
+	end = min(len(contig_seq), max([span[1] for span in spans]) + window_size)
+	stores.append(EvidenceStore.collect(bam.fetch(contig, start, end), contig, spans, contig_seq, window_size=window_size))
+    bam.close()
+    return EvidenceStore.merge(stores)
+
 def expand_contig_breaks(chrom, breaks, contig, contig_breaks, event, ref_fasta, contig_fasta, debug=False):
     def extract_repeat(seq):
 	repeat = {'start':None, 'end':None}
@@ -349,55 +908,251 @@ def filter_support(spanning, flanking, min_support, use_spanning=True, use_flank
 
     return support >= min_support
 
+def gather_support(coords, bam_file, contig_fasta_file, num_procs=1, min_overlap=4, allow_clipped=False, min_ratio_mapped=None, batch=True, debug=False):
+    """Gathers read support of contig breakpoints with a pool of processes
+
+    Args:
+	coords: (list) (contig, start, end, align_type) of contig breakpoints, start and end don't need to be sorted
+	bam_file: (str) path of reads-to-contigs BAM file
+	contig_fasta_file: (str) path of contig Fasta file
+	num_procs: (int) number of processes
+	min_overlap: (int) minimum breakpoint overlap for identifying read support
+	allow_clipped: (boolean) allow using clipped reads as support
+	min_ratio_mapped: (float) when clipped reads are allowed, minimum ratio of read length mapped
+	batch: (boolean) evaluate reads with NumPy arrays instead of one at a time
+	debug: (boolean) prints debug statements
+    Returns:
+	dict of contig: dict of 'start-end' (sorted coordinates): (spanning reads, flanking pairs)
+    """
+    return gather_support_samples([(coords, bam_file, min_overlap, allow_clipped, min_ratio_mapped)],
+				  contig_fasta_file,
+				  num_procs=num_procs,
+				  batch=batch,
+				  debug=debug)[0]
+
+def gather_support_samples(samples, contig_fasta_file, num_procs=1, batch=True, evidence=False, debug=False):
+    """Gathers read support of contig breakpoints in several samples (e.g. tumor and normal) with one pool of processes
+
+    Breakpoints are grouped by sample and contig and packed into chunks of similar estimated cost
+    (from numbers of mapped reads in BAM index and numbers of breakpoints), which
+    are dispatched largest first to processes as they become free, so samples are processed concurrently
+
+    Args:
+	samples: (list) (coords, bam_file, min_overlap, allow_clipped, min_ratio_mapped) of each sample,
+		 see gather_support()
+	contig_fasta_file: (str) path of contig Fasta file
+	num_procs: (int) number of processes shared by all samples
+	batch: (boolean) evaluate reads with NumPy arrays instead of one at a time
+	evidence: (boolean) collect evidence of breakpoints instead of counting support,
+		  min_overlap, allow_clipped and min_ratio_mapped of samples are not used
+	debug: (boolean) prints debug statements
+    Returns:
+	list of support of each sample, see gather_support(), or EvidenceStore of each sample if evidence is True
+    """
+    results = [defaultdict(dict) for sample in samples]
+    stores = [[] for sample in samples]
+    units = []
+    for i in range(len(samples)):
+	coords, bam_file = samples[i][:2]
+	coords_by_contig = OrderedDict()
+	for contig, start, end, align_type in sorted(Set([(contig, min(int(start), int(end)), max(int(start), int(end)), align_type)\
+							  for contig, start, end, align_type in coords]), key=itemgetter(0,1,2)):
+	    coords_by_contig.setdefault(contig, []).append((contig, start, end, align_type))
+	if not coords_by_contig:
+	    continue
+	# reads are fetched within 2000bp of breakpoints (fetch_support())
+	costs = scheduler.contig_costs(bam_file,
+				       dict((contig, [(start, end) for contig, start, end, align_type in contig_coords])\
+					    for contig, contig_coords in coords_by_contig.iteritems()),
+				       window_size=2000)
+	for contig, contig_coords in coords_by_contig.iteritems():
+	    units.append((costs[contig], [(i, coords) for coords in contig_coords]))
+    if not units:
+	if evidence:
+	    return [EvidenceStore.merge([]) for sample in samples]
+	return results
+
+    num_procs = max(1, min(num_procs, sum([len(items) for cost, items in units])))
+    chunks = scheduler.make_chunks(units, num_procs, divisible=True)
+    batches = list(create_batches(samples,
+				  chunks,
+				  contig_fasta_file,
+				  False,
+				  False,
+				  batch=batch,
+				  evidence=evidence,
+				  debug=debug,
+				  ))
+    batch_results = scheduler.run(samples_worker, batches, num_procs, name='read support', out=sys.stdout if num_procs > 1 else None)
+
+    for sample_results in batch_results:
+	for i, batch_result in sample_results:
+	    if evidence:
+		stores[i].append(batch_result)
+		continue
+	    # last item is insert sizes
+	    for contig, start, stop, spanning, flanking, tiling, support_reads in batch_result[:-1]:
+		results[i][contig]['%s-%s' % (start, stop)] = (spanning, flanking)
+
+    if evidence:
+	return [EvidenceStore.merge(sample_stores) for sample_stores in stores]
+    return results
+
+def support_coords(variants):
+    """Returns contig breakpoints of Variants for gather_support()
+
+    Args:
+	variants: (list) Variants
+    Returns:
+	list of (contig, start, end, align_type)
+    """
+    coords = []
+    for variant in variants:
+	align_type = 'split' if len(variant.adjs) > 1 else 'gapped'
+	for adj in variant.adjs:
+	    for contig, contig_breaks in zip(adj.contigs, adj.contig_breaks):
+		coords.append((contig, contig_breaks[0], contig_breaks[1], align_type))
+    return coords
+
+def annotate_support(variants, bam_file, contig_fasta_file, min_support, num_procs=1, min_overlap=4,
+		     allow_clipped=False, min_ratio_mapped=None, normal=False, debug=False):
+    """Gathers read support of Variants and annotates them and their Adjacencies in place
+
+    Support of an Adjacency is the sum of the support of its contigs,
+    support of a Variant is the minimum support of its Adjacencies.
+    'support' is set to {'spanning':int, 'flanking':int} and 'final_support' to the number
+    of spanning reads ('support_normal' and 'final_support_normal' if normal is True)
+
+    Args:
+	variants: (list) Variants
+	bam_file: (str) path of reads-to-contigs BAM file
+	contig_fasta_file: (str) path of contig Fasta file
+	min_support: (int) minimum number of spanning reads
+	normal: (boolean) annotate support of normal sample
+	see gather_support() for other arguments
+    Returns:
+	Set of ids of Adjacencies and list of Variants with enough support
+    """
+    support = gather_support(support_coords(variants), bam_file, contig_fasta_file,
+			     num_procs=num_procs,
+			     min_overlap=min_overlap,
+			     allow_clipped=allow_clipped,
+			     min_ratio_mapped=min_ratio_mapped,
+			     debug=debug)
+    return apply_support(variants, support, min_support, normal=normal)
+
+def apply_support(variants, support, min_support, normal=False):
+    """Annotates Variants and their Adjacencies with support returned by gather_support(), see annotate_support()
+
+    Args:
+	variants: (list) Variants
+	support: (dict) returned by gather_support()
+	min_support: (int) minimum number of spanning reads
+	normal: (boolean) annotate support of normal sample
+    Returns:
+	Set of ids of Adjacencies and list of Variants with enough support
+    """
+    if normal:
+	support_attr, final_support_attr = 'support_normal', 'final_support_normal'
+    else:
+	support_attr, final_support_attr = 'support', 'final_support'
+
+    def set_support(obj, spanning, flanking):
+	setattr(obj, support_attr, {'spanning': spanning, 'flanking': flanking})
+	setattr(obj, final_support_attr, spanning)
+
+    passed_adjs = Set()
+    passed_variants = []
+    for variant in variants:
+	spanning_adjs, flanking_adjs = [], []
+	passed = True
+	for adj in variant.adjs:
+	    spanning, flanking = [], []
+	    for contig, contig_breaks in zip(adj.contigs, adj.contig_breaks):
+		span = '%d-%d' % tuple(sorted(contig_breaks))
+		if support.has_key(contig) and support[contig].has_key(span):
+		    spanning.append(support[contig][span][0])
+		    flanking.append(support[contig][span][1])
+	    spanning = sum_support(spanning) if spanning else None
+	    flanking = sum_support(flanking) if flanking else None
+	    set_support(adj, spanning, flanking)
+	    spanning_adjs.append(spanning)
+	    flanking_adjs.append(flanking)
+
+	    if filter_support(spanning, flanking, min_support, use_spanning=True):
+		passed_adjs.add(adj.id)
+	    else:
+		passed = False
+
+	set_support(variant,
+		    sum_support(spanning_adjs, use_minimum=True) if not None in spanning_adjs else None,
+		    sum_support(flanking_adjs, use_minimum=True) if not None in flanking_adjs else None)
+	if passed and filter_support(getattr(variant, final_support_attr), None, min_support, use_spanning=True):
+	    passed_variants.append(variant)
+
+    return passed_adjs, passed_variants
+
+def write_support(support, out_file):
+    """Outputs support returned by gather_support() in tsv format
+
+    Args:
+	support: (dict) returned by gather_support()
+	out_file: (str) path of output file
+    """
+    with open(out_file, 'w') as out:
+	for contig in support.keys():
+	    for coords in support[contig]:
+		out.write('%s\n' % '\t'.join(map(str, [contig, coords, support[contig][coords][0], support[contig][coords][1]])))
+
 def main(args):
     coords = []
     for line in open(args.coords, 'r'):
         cols = line.rstrip('\n').split()
-        span = tuple(sorted((int(cols[1]), int(cols[2]))))
-	coords.append((cols[0], span[0], span[1], cols[3]))
-    coords_sorted = sorted(coords, key=itemgetter(0,1,2))
-            
-    batches = list(create_batches(args.bam,
-                                  coords_sorted,
-                                  len(coords_sorted)/args.num_procs,
-                                  args.min_overlap,
-                                  args.contigs,
-                                  False,
-                                  False,
-                                  args.allow_clipped_support,
-                                  args.support_min_mapped,
-                                  debug=args.debug,
-                                  ))
-    pool = mp.Pool(processes=args.num_procs)
-    batch_results = pool.map(worker, batches)
-    pool.close()
-    pool.join()
-    
-    results = {}
-    tlens_all = []
-    support_reads = []
-    for batch_result in batch_results:
-        for support in batch_result:
-	    # insert sizes
-	    if len(support) > 7:
-		tlens_all.extend(support)
-		continue
+	coords.append((cols[0], cols[1], cols[2], cols[3]))
 
-	    if len(support) == 0:
-		continue
-
-            contig, start, stop, spanning, flanking, tiling, support_reads = support
-            coords = '%s-%s' % (start, stop)
-            try:
-                results[contig][coords] = (spanning, flanking, tiling, support_reads)
-            except:
-                results[contig] = {}
-                results[contig][coords] = (spanning, flanking, tiling, support_reads)
+    if args.evidence:
+	# support is counted from evidence store, which is only created if it doesn't exist
+	if os.path.exists(args.evidence):
+	    store = EvidenceStore.load(args.evidence)
+	else:
+	    store = gather_support_samples([(coords, args.bam, args.min_overlap, args.allow_clipped_support, args.support_min_mapped)],
+					   args.contigs,
+					   num_procs=args.num_procs,
+					   evidence=True,
+					   debug=args.debug)[0]
+	    store.save(args.evidence)
+	support = store.support(min_overlap=args.min_overlap,
+				allow_clipped=args.allow_clipped_support,
+				min_ratio_mapped=args.support_min_mapped)
+    else:
+	support = gather_support(coords, args.bam, args.contigs,
+				 num_procs=args.num_procs,
+				 min_overlap=args.min_overlap,
+				 allow_clipped=args.allow_clipped_support,
+				 min_ratio_mapped=args.support_min_mapped,
+				 debug=args.debug)
+    write_support(support, args.outfile)
 
-    with open(args.outfile, 'w') as out:
-	for contig in results.keys():
-	    for coords in results[contig]:
-		out.write('%s\n' % '\t'.join(map(str, [contig, coords, results[contig][coords][0], results[contig][coords][1]])))
+    # compare with evaluating reads one at a time
+    if args.validate:
+	support_scalar = gather_support(coords, args.bam, args.contigs,
+					num_procs=args.num_procs,
+					min_overlap=args.min_overlap,
+					allow_clipped=args.allow_clipped_support,
+					min_ratio_mapped=args.support_min_mapped,
+					batch=False,
+					debug=args.debug)
+	mismatches = 0
+	for contig in Set(support.keys()) | Set(support_scalar.keys()):
+	    for coords in Set(support[contig].keys()) | Set(support_scalar[contig].keys()):
+		if support[contig].get(coords) != support_scalar[contig].get(coords):
+		    sys.stdout.write('mismatch %s %s batch:%s scalar:%s\n' % (contig, coords,
+									      support[contig].get(coords),
+									      support_scalar[contig].get(coords)))
+		    mismatches += 1
+	print 'validation mismatches:%d' % mismatches
+	if mismatches:
+	    sys.exit(1)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -409,6 +1164,8 @@ if __name__ == '__main__':
     parser.add_argument("--min_overlap", help="minimum breakpoint overlap for identifying read support. Default:4", type=int, default=4)
     parser.add_argument("--allow_clipped_support", help="allow using clipped reads in gathering read support", action="store_true", default=False)
     parser.add_argument("--support_min_mapped", help="when clipped reads are allowed as read support, minimum ratio of read length mapped Default:0.8", type=float, default=0.8)
+    parser.add_argument("--evidence", type=str, help="evidence store (.npz) of reads supporting breakpoints; support is counted from it if it exists, otherwise it is created")
+    parser.add_argument("--validate", help="check that support (from batch evaluation of reads or evidence store) is the same as evaluating reads one at a time", action="store_true", default=False)
     parser.add_argument("--debug", help="debug mode", action="store_true", default=False)
 
     args = parser.parse_args()
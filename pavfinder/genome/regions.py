@@ -0,0 +1,229 @@
+import os
+import sys
+import gzip
+import numpy as np
+from alignment import target_non_canonical
+
+class RegionIndex:
+    """In-memory index of genomic regions for overlap queries
+
+    Regions of each chromosome are merged and kept as sorted arrays of starts and ends
+    (0-based, end exclusive), so a query is a binary search.
+    """
+    def __init__(self, regions):
+        """Builds index
+
+        Args:
+            regions: (dict) chrom: list of (start, end), 0-based, end exclusive
+        """
+        self.starts = {}
+        self.ends = {}
+        for chrom, spans in regions.iteritems():
+            merged = []
+            for start, end in sorted(spans):
+                if merged and start <= merged[-1][1]:
+                    if end > merged[-1][1]:
+                        merged[-1][1] = end
+                else:
+                    merged.append([start, end])
+            self.starts[chrom] = np.array([span[0] for span in merged], dtype=np.int64)
+            self.ends[chrom] = np.array([span[1] for span in merged], dtype=np.int64)
+
+    @classmethod
+    def from_bed(cls, bed_file, use_cache=True):
+        """Creates index from BED file
+
+        The index is cached as a binary file (<bed_file>.npz) beside the BED file and
+        re-used as long as it is newer than the BED file
+
+        Args:
+            bed_file: (str) path of BED file (can be gzipped)
+            use_cache: (boolean) read/write cached index
+        Returns:
+            RegionIndex
+        """
+        cache_file = bed_file + '.npz'
+        if use_cache and os.path.exists(cache_file) and\
+           os.path.getmtime(cache_file) >= os.path.getmtime(bed_file):
+            return cls.load(cache_file)
+
+        regions = {}
+        if bed_file[-3:] == '.gz':
+            bed = gzip.open(bed_file, 'rb')
+        else:
+            bed = open(bed_file, 'r')
+        with bed:
+            for line in bed:
+                if not line.strip() or line[0] == '#' or line.startswith('track') or line.startswith('browser'):
+                    continue
+                cols = line.rstrip('\n').split('\t')
+                try:
+                    regions[cols[0]].append((int(cols[1]), int(cols[2])))
+                except KeyError:
+                    regions[cols[0]] = [(int(cols[1]), int(cols[2]))]
+
+        index = cls(regions)
+        if use_cache:
+            try:
+                index.save(cache_file)
+            except (IOError, OSError):
+                pass
+        return index
+
+    @classmethod
+    def from_cytobands(cls, cytobands_file, stain='acen', buf=0):
+        """Creates index of bands of given stain from UCSC cytobands file
+
+        Args:
+            cytobands_file: (str) path of cytobands file
+            stain: (str) value of column 5 for selecting bands
+            buf: (int) number of bases added to either side of each band
+        Returns:
+            RegionIndex
+        """
+        regions = {}
+        with open(cytobands_file, 'r') as cytobands:
+            for line in cytobands:
+                chrom, start, end, band, band_stain = line.rstrip('\n').split('\t')
+                if band_stain == stain:
+                    span = (max(0, int(start) - buf), int(end) + buf)
+                    try:
+                        regions[chrom].append(span)
+                    except KeyError:
+                        regions[chrom] = [span]
+        return cls(regions)
+
+    def save(self, out_file):
+        """Saves index in NumPy binary format
+
+        Args:
+            out_file: (str) path of output file (should end with .npz)
+        """
+        chroms = sorted(self.starts.keys())
+        counts = [len(self.starts[chrom]) for chrom in chroms]
+        with open(out_file, 'wb') as out:
+            np.savez(out,
+                     chroms=np.array(chroms),
+                     counts=np.array(counts, dtype=np.int64),
+                     starts=np.concatenate([self.starts[chrom] for chrom in chroms] or [np.array([], dtype=np.int64)]),
+                     ends=np.concatenate([self.ends[chrom] for chrom in chroms] or [np.array([], dtype=np.int64)]))
+
+    @classmethod
+    def load(cls, index_file):
+        """Loads index saved by save()
+
+        Args:
+            index_file: (str) path of index file
+        Returns:
+            RegionIndex
+        """
+        index = cls({})
+        data = np.load(index_file)
+        first = 0
+        for chrom, count in zip(data['chroms'], data['counts']):
+            index.starts[str(chrom)] = data['starts'][first:first + count]
+            index.ends[str(chrom)] = data['ends'][first:first + count]
+            first += count
+        return index
+
+    def overlaps(self, chrom, start, end):
+        """Checks if given span overlaps any region
+
+        Args:
+            chrom: (str) chromosome name
+            start: (int) 0-based start
+            end: (int) 0-based end (exclusive)
+        Returns:
+            True if overlapped
+        """
+        if not self.starts.has_key(chrom):
+            return False
+        # last region starting before end of span, regions are disjoint so it ends last
+        i = self.starts[chrom].searchsorted(end, side='left') - 1
+        return i >= 0 and self.ends[chrom][i] > start
+
+    def contains(self, chrom, pos):
+        """Checks if given position is in any region
+
+        Args:
+            chrom: (str) chromosome name
+            pos: (int) 0-based position
+        Returns:
+            True if position in region
+        """
+        return self.overlaps(chrom, pos, pos + 1)
+
+class GenomicMask:
+    """Genomic regions where alignments or breakpoints are not trusted
+
+    Combines acentromeric regions (from cytobands), regions to screen out
+    (BED file e.g. segdups), and non-canonical chromosomes (e.g. haplotypes)
+    """
+    def __init__(self, acen=None, bad_regions=None, non_canonical=False):
+        """Initializes mask
+
+        Args:
+            acen: (RegionIndex) acentromeric regions
+            bad_regions: (RegionIndex) regions where breakpoints are screened out
+            non_canonical: (boolean) mask non-canonical chromosomes
+        """
+        self.acen = acen
+        self.bad_regions = bad_regions
+        self.non_canonical = non_canonical
+
+    @classmethod
+    def from_files(cls, cytobands_file=None, acen_buffer=0, bad_bed_file=None, non_canonical=False):
+        """Creates mask from files
+
+        Args:
+            cytobands_file: (str) path of UCSC cytobands file for acentromeric regions
+            acen_buffer: (int) buffer added to either side of acentromeric regions
+            bad_bed_file: (str) path of BED file of regions where breakpoints are screened out
+            non_canonical: (boolean) mask non-canonical chromosomes
+        Returns:
+            GenomicMask
+        """
+        acen = None
+        if cytobands_file is not None:
+            try:
+                acen = RegionIndex.from_cytobands(cytobands_file, buf=acen_buffer)
+            except IOError:
+                sys.stderr.write("can't open cytobands file:%s\n" % cytobands_file)
+
+        bad_regions = None
+        if bad_bed_file is not None and os.path.exists(bad_bed_file):
+            bad_regions = RegionIndex.from_bed(bad_bed_file)
+
+        return cls(acen=acen, bad_regions=bad_regions, non_canonical=non_canonical)
+
+    def align_in_acen(self, align):
+        """Checks if alignment overlaps acentromeric region
+
+        Args:
+            align: (Alignment)
+        Returns:
+            True if overlapped
+        """
+        # alignment coordinates are 1-based
+        return self.acen is not None and self.acen.overlaps(align.target, align.tstart - 1, align.tend + 1)
+
+    def break_in_bad_region(self, chrom, pos):
+        """Checks if breakpoint is in region to be screened out
+
+        Args:
+            chrom: (str) chromosome name
+            pos: (int) 1-based breakpoint position
+        Returns:
+            True if in region
+        """
+        return self.bad_regions is not None and self.bad_regions.contains(chrom, pos - 1)
+
+    def is_non_canonical(self, chrom):
+        """Checks if chromosome is masked for being non-canonical
+
+        Args:
+            chrom: (str) chromosome name
+        Returns:
+            True if masked
+        """
+        return self.non_canonical and target_non_canonical(chrom)
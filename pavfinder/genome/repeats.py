@@ -0,0 +1,268 @@
+import argparse
+import os
+import shutil
+import numpy as np
+import pysam
+
+# repeat interval in index: 0-based start, end (exclusive), unit length,
+# and running maximum of end (records of a chromosome are sorted by start) for overlap queries
+RECORD_DTYPE = np.dtype([('start', '<u4'), ('end', '<u4'), ('unit_len', 'u1'), ('max_end', '<u4')])
+
+def tandem_repeat_at(seq, start, end):
+    """Finds the tandem repeat starting at a given position of a sequence
+
+    The repeat unit is the shortest sequence that occurs at least twice in a row from start,
+    i.e. the unit the regex (.+?)\\1+ would capture if anchored at start.
+    The number of units is the number of consecutive copies of the unit that fit before end.
+
+    Args:
+        seq: (str) sequence
+        start: (int) 0-based position in seq where the repeat should start
+        end: (int) 0-based position (exclusive) in seq where search stops
+    Returns:
+        Tuple of (repeat unit, number of units), None if no tandem repeat starts at start
+    """
+    max_unit_len = (end - start) / 2
+    if max_unit_len < 1:
+        return None
+
+    # a unit can only be as long as the distance to the next occurrence of the first base
+    first_base = seq[start]
+    next_pos = seq.find(first_base, start + 1, start + max_unit_len + 1)
+    while next_pos > 0:
+        unit_len = next_pos - start
+        unit = seq[start:next_pos]
+        if seq[next_pos:next_pos + unit_len] == unit:
+            num_units = 2
+            pos = next_pos + unit_len
+            while pos + unit_len <= end and seq[pos:pos + unit_len] == unit:
+                num_units += 1
+                pos += unit_len
+            return unit, num_units
+
+        next_pos = seq.find(first_base, next_pos + 1, start + max_unit_len + 1)
+
+    return None
+
+def break_region_repeat(region, region_start, breaks, min_units=4, buf=1, window=100):
+    """Finds tandem repeat that contains deletion/insertion breakpoint by scanning reference sequence
+
+    Repeats are searched from every position at most "window" bases upstream of breakpoint,
+    within a window (100bp) starting at the position (tandem_repeat_at()).
+    The repeat has to have at least "min_units" units and contain the breakpoint
+
+    Args:
+        region: (str) reference sequence from max(0, breaks[0] - window) to breaks[1] + window
+        region_start: (int) 0-based position of region
+        breaks: (List/Tuple) genomic breakpoint (start, end)
+        min_units: (int) minimum number of repeat units
+        buf: (int) buffer allowed for considering if repeats reside in breakpoint region
+        window: (int) window size
+    Returns:
+        Tuple of (repeat start, repeat end, repeat unit, number of units), 1-based coordinates,
+        None if breakpoint not in repeat
+    """
+    region_end = region_start + len(region)
+
+    # repeats found at positions outside this range are too far to contain the breakpoints
+    for i in range(max(breaks[0] - window, breaks[1] - 1 - buf - window), min(breaks[0] + buf, breaks[1]) + 1):
+        seq_start = max(0, i)
+        seq_end = min(i + window, region_end)
+        repeat = None
+        if seq_end > seq_start:
+            repeat = tandem_repeat_at(region, seq_start - region_start, seq_end - region_start)
+
+        if repeat is not None and repeat[0].upper() != 'N':
+            repeat_unit, num_units = repeat
+            repeat_start = i + 1
+            repeat_end = i + len(repeat_unit) * num_units
+            if num_units >= min_units:
+                if breaks[0] != breaks[1] and\
+                   breaks[0] + 1 >= repeat_start - buf and breaks[1] - 1 <= repeat_end + buf:
+                    return repeat_start, repeat_end, repeat_unit, num_units
+                elif breaks[0] == breaks[1] and\
+                     breaks[0] >= repeat_start - buf and breaks[0] + 1 <= repeat_end + buf:
+                    return repeat_start, repeat_end, repeat_unit, num_units
+
+    return None
+
+def find_tandem_repeats(seq, max_unit_len=25, min_units=4):
+    """Finds maximal tandem repeats of primitive units in a sequence
+
+    Sequence is compared case-insensitively, repeats of N are ignored.
+
+    Args:
+        seq: (str) sequence
+        max_unit_len: (int) maximum length of repeat unit
+        min_units: (int) minimum number of repeat units
+    Returns:
+        numpy array of RECORD_DTYPE sorted by start
+    """
+    bases = np.frombuffer(seq.upper(), dtype=np.uint8)
+    starts, ends, unit_lens = [], [], []
+    for unit_len in range(1, max_unit_len + 1):
+        if len(bases) <= unit_len:
+            break
+
+        # runs of positions where base is same as the one unit_len downstream
+        same = bases[:-unit_len] == bases[unit_len:]
+        edges = np.diff(np.concatenate((np.zeros(1, np.int8), same.view(np.int8), np.zeros(1, np.int8))))
+        run_starts = np.flatnonzero(edges == 1)
+        run_ends = np.flatnonzero(edges == -1)
+        keep = run_ends - run_starts >= (min_units - 1) * unit_len
+
+        if unit_len == 1:
+            keep &= bases[run_starts] != ord('N')
+        else:
+            # unit made up of a shorter unit would have been found with the shorter unit
+            for sub_len in range(1, unit_len):
+                if unit_len % sub_len != 0:
+                    continue
+                periodic = keep.copy()
+                for i in range(unit_len - sub_len):
+                    periodic &= bases[run_starts + i] == bases[run_starts + i + sub_len]
+                keep &= ~periodic
+
+        starts.append(run_starts[keep])
+        ends.append(run_ends[keep] + unit_len)
+        unit_lens.append(np.repeat(unit_len, keep.sum()))
+
+    repeats = np.zeros(sum(len(s) for s in starts), dtype=RECORD_DTYPE)
+    if len(repeats) > 0:
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+        unit_lens = np.concatenate(unit_lens)
+        order = np.lexsort((ends, starts))
+        repeats['start'] = starts[order]
+        repeats['end'] = ends[order]
+        repeats['unit_len'] = unit_lens[order]
+        repeats['max_end'] = np.maximum.accumulate(repeats['end'])
+
+    return repeats
+
+def build_index(genome_fasta, index_file, max_unit_len=25, min_units=4):
+    """Builds index of tandem repeats of a genome
+
+    Index file consists of a text header listing the records of each chromosome,
+    followed by the records (RECORD_DTYPE), so that it can be memory-mapped
+
+    Args:
+        genome_fasta: (str) path of genome FASTA file (indexed)
+        index_file: (str) path of output index file
+        max_unit_len: (int) maximum length of repeat unit
+        min_units: (int) minimum number of repeat units
+    """
+    fasta = pysam.Fastafile(genome_fasta)
+    records_file = index_file + '.records'
+    chroms = []
+    num_records = 0
+    with open(records_file, 'wb') as records:
+        for chrom in fasta.references:
+            repeats = find_tandem_repeats(fasta.fetch(chrom), max_unit_len=max_unit_len, min_units=min_units)
+            repeats.tofile(records)
+            chroms.append((chrom, num_records, len(repeats)))
+            num_records += len(repeats)
+
+    with open(index_file, 'wb') as out:
+        out.write('#repeats\t%d\t%d\n' % (max_unit_len, min_units))
+        for chrom, first, count in chroms:
+            out.write('%s\t%d\t%d\n' % (chrom, first, count))
+        out.write('#end\n')
+        with open(records_file, 'rb') as records:
+            shutil.copyfileobj(records, out)
+    os.remove(records_file)
+
+class RepeatIndex:
+    """Memory-mapped index of tandem repeats created by build_index()"""
+    def __init__(self, index_file):
+        self.chroms = {}
+        with open(index_file, 'rb') as index:
+            cols = index.readline().rstrip('\n').split('\t')
+            self.max_unit_len, self.min_units = int(cols[1]), int(cols[2])
+            num_records = 0
+            while True:
+                line = index.readline()
+                if not line or line.startswith('#end'):
+                    break
+                chrom, first, count = line.rstrip('\n').split('\t')
+                self.chroms[chrom] = (int(first), int(count))
+                num_records += int(count)
+            offset = index.tell()
+
+        self.records = None
+        if num_records > 0:
+            self.records = np.memmap(index_file, dtype=RECORD_DTYPE, mode='r', offset=offset, shape=(num_records,))
+
+    def overlap(self, chrom, start, end):
+        """Finds repeats overlapping given region
+
+        Args:
+            chrom: (str) chromosome name
+            start: (int) 0-based start of region
+            end: (int) 0-based end (exclusive) of region
+        Returns:
+            List of (start, end, unit length) of repeats, 0-based coordinates
+        """
+        if not self.chroms.has_key(chrom) or self.records is None:
+            return []
+
+        first, count = self.chroms[chrom]
+        records = self.records[first:first + count]
+        # max_end is non-decreasing, so repeats before lo all end before start
+        lo = records['max_end'].searchsorted(max(0, start), side='right')
+        hi = records['start'].searchsorted(max(0, end), side='left')
+        return [(int(r['start']), int(r['end']), int(r['unit_len'])) for r in records[lo:hi] if r['end'] > start]
+
+    def find_break_region_repeat(self, chrom, breaks, min_units=4, buf=1, window=100):
+        """Finds repeat that may contain deletion/insertion breakpoint
+
+        Same window, unit count and containment criteria as break_region_repeat(): the part of the repeat
+        that lies within a window (100bp) starting at a position at most "window" bases upstream of
+        breakpoint has at least "min_units" units and contains the breakpoint.
+        min_units should not be smaller, and window / min_units not larger than the maximum unit length,
+        than the ones used for building the index.
+
+        A repeat is returned whenever break_region_repeat() finds one in the reference, but also for some
+        breakpoints where it does not: the scan only considers the shortest unit found at each position
+        (e.g. A in AACAACAACAAC), and compares bases case-sensitively whereas the index is built on
+        upper-cased sequence. The index is therefore used to skip the scan of breakpoints not in any repeat.
+
+        Args:
+            chrom: (str) chromosome name
+            breaks: (List/Tuple) genomic breakpoint (start, end)
+            min_units: (int) minimum number of repeat units
+            buf: (int) buffer allowed for considering if repeats reside in breakpoint region
+            window: (int) window size
+        Returns:
+            Tuple of (repeat start, repeat end, unit length, number of units), 1-based coordinates,
+            None if breakpoint not in repeat
+        """
+        if breaks[0] != breaks[1]:
+            # deletion
+            last_start, min_end = breaks[0] + buf, breaks[1] - 1 - buf
+        else:
+            # insertion
+            last_start, min_end = breaks[0] + buf - 1, breaks[0] + 1 - buf
+
+        for start, end, unit_len in self.overlap(chrom, breaks[0] - window, breaks[1] + window):
+            if unit_len * min_units > window:
+                continue
+            first_i = max(start, breaks[0] - window)
+            last_i = min(last_start, breaks[1], end - unit_len * min_units)
+            # repeat reaches furthest from one of the last unit_len positions
+            for i in range(last_i, max(first_i, last_i - unit_len + 1) - 1, -1):
+                num_units = min(end - i, window) / unit_len
+                if i + num_units * unit_len >= min_end:
+                    return i + 1, i + num_units * unit_len, unit_len, num_units
+
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Builds index of tandem repeats of a genome")
+    parser.add_argument("genome_fasta", type=str, help="genome fasta")
+    parser.add_argument("index", type=str, help="output index file")
+    parser.add_argument("--max_unit_len", type=int, help="maximum repeat unit length. Default:25", default=25)
+    parser.add_argument("--min_units", type=int, help="minimum number of repeat units. Default:4", default=4)
+    args = parser.parse_args()
+
+    build_index(args.genome_fasta, args.index, max_unit_len=args.max_unit_len, min_units=args.min_units)
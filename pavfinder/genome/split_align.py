@@ -1,11 +1,12 @@
 import pysam
-from intspan import intspan
 from sets import Set
 import sys
 import re
 import bwa_mem
 from adjacency import Adjacency
 from alignment import compare_chr, Alignment, target_non_canonical
+from pavfinder import chimera_paths
+from pavfinder.intervals import IntervalSet
 
 def find_chimera(alns, bam, min_coverage=0.95, check_alt_paths=False, max_splits=3, check_haplotype=True, debug=False):
     """Finds primary_aligns alignments corresponding to chimera
@@ -26,9 +27,9 @@ def find_chimera(alns, bam, min_coverage=0.95, check_alt_paths=False, max_splits
 	    primary_edit_distance = 0
 	    secondary_edit_distance = 0
 	    for align in primary_chimera:
-		primary_edit_distance += bwa_mem.effective_edit_distance(align.sam)
+		primary_edit_distance += align.effective_edit_distance()
 	    for align in secondary_chimera:
-		secondary_edit_distance += bwa_mem.effective_edit_distance(align.sam)
+		secondary_edit_distance += align.effective_edit_distance()
 	    if secondary_edit_distance <= primary_edit_distance:
 		return True
 	    else:
@@ -38,7 +39,7 @@ def find_chimera(alns, bam, min_coverage=0.95, check_alt_paths=False, max_splits
     
     def _has_end_to_end_secondary_align(aligns):
 	for align in aligns:
-	    ops = [a[0] for a in align.sam.cigar]    
+	    ops = [a[0] for a in align.cigar]    
 	    if ops[0] == 0 and ops[-1] == 0:
 		return align
 	return None
@@ -47,7 +48,7 @@ def find_chimera(alns, bam, min_coverage=0.95, check_alt_paths=False, max_splits
 	alt_paths = []
 	for primary_align in primary_aligns:
 	    aligns = [align for align in secondary_aligns if align.target == primary_align.target] + [primary_align]
-	    alt_paths = [path for path in find_paths(aligns, min_coverage=min_coverage, max_ends=50, get_all=True, debug=debug)\
+	    alt_paths = [path for path in find_paths(aligns, min_coverage=min_coverage, max_ends=50, get_all=True, max_aligns=2, debug=debug)\
 	                 if len(path) == 2 and abs(aligns[path[0]].tstart - aligns[path[1]].tstart) < max_span]
 	    	    
 	    if alt_paths:
@@ -79,7 +80,7 @@ def find_chimera(alns, bam, min_coverage=0.95, check_alt_paths=False, max_splits
 			                                                                                                          align.target,
 			                                                                                                          align.tstart,
 			                                                                                                          align.tend,
-			                                                                                                          align.sam.cigarstring
+																  align.cigarstring
 			                                                                                                          ))
 		    return None, None
 
@@ -119,7 +120,7 @@ def find_chimera(alns, bam, min_coverage=0.95, check_alt_paths=False, max_splits
 		                                     align.target, 
 		                                     align.tstart, 
 		                                     align.tend, 
-		                                     align.sam.cigarstring, 
+						     align.cigarstring, 
 		                                     align.strand]))
 		    sys.stdout.write('%s\n' % output_line)
 	    
@@ -233,7 +234,24 @@ def screen_subseq_alns(adj_aligns, subseq_alns, realign_bam, name_sep, debug=Fal
 		    
     return passed
 
-def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, max_nodes=500, max_paths=5, max_ends=50, no_trim=[], same_target=None, from_edge=0.02, debug=False):
+def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, max_nodes=None, max_paths=5, max_ends=50, no_trim=[], same_target=None, from_edge=0.02, max_aligns=None, debug=False):
+    """Finds path(s) of alignments that cover the query (see chimera_paths.find_paths())
+    
+    Args:
+	aligns: (list) Alignments of a single query
+	min_coverage: (float) minimum fraction of query covered by path
+	use_end_to_end: (boolean) coverage is the span from first to last alignment instead of bases covered
+	get_all: (boolean) return best path between each start and end alignment
+	max_nodes: (int) no path is constructed if more alignments have links
+	max_paths: (int) maximum number of paths returned when get_all is True
+	max_ends: (int) maximum number of start and end alignments
+	no_trim: (list) indices of alignments never removed for being promiscuous
+	same_target: (str) only use alignments to this target
+	from_edge: (float) fraction of query length from either end where paths start and end
+	max_aligns: (int) maximum number of alignments in path
+    Returns:
+	list of indices of aligns (best path), or list of paths if get_all is True
+    """
     def _find_end_points():
 	starts = []
 	ends = []
@@ -261,156 +279,24 @@ def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, ma
 		
 	return starts, ends
     
-    def _trim_aligns(max_mappings=100):
-	regions = {}
-	for i in range(len(aligns)):
-	    if i in no_trim:
-		continue
-	    
-	    key = '%s-%s:%s' % (aligns[i].qstart, aligns[i].qend, aligns[i].strand)
-	    try:
-		regions[key].append(i)
-	    except:
-		regions[key] = [i]
-		
-	extra = []
-	for key in regions.keys():
-	    if len(regions[key]) > max_mappings:
-		for i in regions[key][max_mappings:]:
-		    extra.append(i)
-		
-	if extra:
-	    new_aligns = []
-	    for i in range(len(aligns)):
-		if not i in extra:
-		    new_aligns.append(aligns[i])
-		    
-	    return new_aligns
-	
-	return None
-
-    def _construct_graph(max_links=100, max_olap=0.2, max_gap=0.2):
-	"""
-	Alignments must be like to be an edge
-	   ----> j
-	----> i
-	"""
-	graph = {}
-	for i in range(len(aligns)):
-	    len_i = aligns[i].qend - aligns[i].qstart + 1
-	    for j in range(len(aligns)):
-		if i != j:
-		    len_j = aligns[j].qend - aligns[j].qstart + 1
-		    olap = max(0, aligns[i].qend - aligns[j].qstart + 1)
-		    gap = max(0, aligns[j].qstart - aligns[i].qend - 1)
-		    # only allows gap = 0, gap > 0, or partial overlap
-		    if aligns[j].qend > aligns[i].qend and aligns[j].qstart > aligns[i].qstart:
-			if float(olap)/len_i >= max_olap or\
-			   float(olap)/len_j >= max_olap or\
-			   float(gap)/len_i >= max_gap or\
-			   float(gap)/len_j >= max_gap:
-			    continue
-			try:
-			    graph[i].append(j)
-			except:
-			    graph[i] = [j]
-			    
-	return graph
-
-    
-    def _bfs(graph, start, end):
-	"""Breath-first search
-	http://stackoverflow.com/questions/8922060/breadth-first-search-trace-path
-	"""
-	paths = []
-	# maintain a queue of paths
-	queue = []
-	# push the first path into the queue
-	queue.append([start])
-	while queue:
-	    # get the first path from the queue
-	    path = queue.pop(0)
-	    # get the last node from the path
-	    node = path[-1]
-	    # path found
-	    if node == end:
-		# captures all paths
-		paths.append(path)
-		# this will return shortest path
-		#return path
-	    # enumerate all adjacent nodes, construct a new path and push it into the queue
-	    for adjacent in graph.get(node, []):
-		new_path = list(path)
-		new_path.append(adjacent)
-		queue.append(new_path)
-		
-	return paths
-    
-    def _coverage(path):
-	spans = [intspan('%d-%d' % (aligns[i].qstart, aligns[i].qend)) for i in path]
-	covered = spans[0]
-	overlaps = []
-	for i in range(1, len(spans)):
-	    covered = covered.union(spans[i])
-	    
-	    overlap = spans[i - 1].intersection(spans[i])
-	    if len(overlap) > 0:
-		overlaps.append(overlap)
-	    
-	return covered, overlaps
-    
-    def _screen(covered, overlaps):
-	passed = True
-	if min_coverage is not None:
-	    if not use_end_to_end:
-		coverage = len(covered) / float(aligns[0].query_len)
-	    else:
-		coverage = (max(covered) - min(covered) + 1) / float(aligns[0].query_len)
-
-	    if coverage < min_coverage:
-		passed = False
-		
-	return passed
-    
-    def _pick_best(path_info):
-	best = {'index': None, 'covered': None, 'overlapped': None}
-	for i in sorted(path_info.keys()):
-	    covered = len(path_info[i]['covered'])
-	    if not path_info[i]['overlaps']:
-		overlapped = 0
-	    else:
-		overlapped = sum([len(olap) for olap in path_info[i]['overlaps']])
-		
-	    if best['index'] is None or\
-	       covered > best['covered'] or\
-	       overlapped < best['overlapped'] or\
-	       len(path_info[i]['chroms']) < len(path_info[best['index']]['chroms']):
-		best['index'] = i
-		best['covered'] = covered
-		best['overlapped'] = overlapped
-	
-	return best['index']
-    
-	    
     # check promiscuity
-    trimmed_aligns = _trim_aligns()
-    if trimmed_aligns:
-	aligns = trimmed_aligns
-	
+    indices = chimera_paths.trim_aligns(aligns, no_trim=no_trim)
+    
     # same target
     if same_target:
-	aligns = [align for align in aligns if align.target == same_target]
+	indices = [i for i in indices if aligns[i].target == same_target]
     
-    if not aligns:
+    if not indices:
 	return []
+    # paths are found in the selected alignments, and converted back to indices of given alignments
+    aligns = [aligns[i] for i in indices]
     
-    # construct graph
-    graph = _construct_graph()
-	    
-    if len(graph.keys()) > max_nodes:
-	if debug:
-	    sys.stdout.write('%s: too many nodes(%d) to construct path(max:%d)\n' % (aligns[0].query, len(graph.keys()), max_nodes))
-	return []
+    if max_nodes is not None:
+	num_nodes = len(chimera_paths.construct_graph(aligns).keys())
+	if num_nodes > max_nodes:
+	    if debug:
+		sys.stdout.write('%s: too many nodes(%d) to construct path(max:%d)\n' % (aligns[0].query, num_nodes, max_nodes))
+	    return []
     
     # get end points
     starts, ends = _find_end_points()
@@ -422,32 +308,13 @@ def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, ma
     if len(ends) > max_ends:
 	ends = ends[:max_ends]
     
-    # find paths
-    paths = []
-    for start in starts:
-	if max_paths and len(paths) >= max_paths:
-	    break
-	for end in ends:
-	    paths.extend(_bfs(graph, start, end))
-	    if max_paths and len(paths) >= max_paths:
-		break
-	    	
-    # screen
-    path_info = {}
-    for i in range(len(paths)):
-	covered, overlaps = _coverage(paths[i])
-	if _screen(covered, overlaps):
-	    chroms = Set([aligns[j].target for j in paths[i]])
-	    path_info[i] = {'path': paths[i], 'covered': covered, 'overlaps': overlaps, 'chroms':chroms}
-	    	
-    if path_info:
-	if get_all:
-	    return [paths[i] for i in path_info.keys()]
-	else:
-	    return paths[_pick_best(path_info)]
+    paths = chimera_paths.find_paths(aligns, starts, ends, min_coverage=min_coverage, use_end_to_end=use_end_to_end,
+				     get_all=get_all, max_paths=max_paths, max_aligns=max_aligns)
+    if get_all:
+	return [[indices[i] for i in path] for path in paths]
     else:
-	return []
-	    
+	return [indices[i] for i in paths]
+	
 def get_contig_coverage(aligns, end_to_end=False):
     """Coverage of the contig by the union of the primary_aligns alignments
     
@@ -457,14 +324,12 @@ def get_contig_coverage(aligns, end_to_end=False):
     Returns:
         Fraction corresponding to coverage
     """
-    span = intspan('%d-%d' % (aligns[0].qstart, aligns[0].qend))
-    for i in range(1, len(aligns)):
-	span = span.union(intspan('%d-%d' % (aligns[i].qstart, aligns[i].qend)))
+    span = IntervalSet([(align.qstart, align.qend) for align in aligns])
 	
     if not end_to_end:
 	return len(span) / float(aligns[0].query_len)
     else:
-	return (max(span) - min(span) + 1) / float(aligns[0].query_len)
+	return (span.max() - span.min() + 1) / float(aligns[0].query_len)
 
 def find_adjs(aligns, contig_seq, dubious=None, debug=False):
     """Create adjs given primary_aligns alignments
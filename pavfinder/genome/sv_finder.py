@@ -3,86 +3,75 @@ import re
 import sys
 import os
 import subprocess
+import shutil
+import tempfile
+import multiprocessing as mp
 from sets import Set
 from itertools import groupby
 from pavfinder.genome import gapped_align
 from pavfinder.genome import split_align
 from pavfinder.genome.adjacency import Adjacency
 from pavfinder.genome.variant import Variant
-from pavfinder.genome.annotate import overlap_pe, parallel_parse_overlaps, annotate_rna_event, annotate_gene_fusion, update_features, get_acen_coords
-from pavfinder.genome.alignment import reverse_complement, target_non_canonical
+from pavfinder.genome.annotate import overlap_pe, parallel_parse_overlaps, annotate_rna_event, annotate_gene_fusion, update_features
+from pavfinder.genome.alignment import reverse_complement
+from pavfinder.genome.repeats import break_region_repeat, RepeatIndex
+from pavfinder.genome.regions import GenomicMask
 from pavfinder.genome.vcf import VCF
+from pavfinder.genome.writer import SortedWriter
+from pavfinder.genome.read_support import annotate_support, apply_support, gather_support_samples, support_coords
+from pavfinder.fasta import SequenceCache, BlockCache
+
+def swap_support(variants):
+    """Swaps tumor and normal support of Variants and their Adjacencies"""
+    for variant in variants:
+	for obj in [variant] + variant.adjs:
+	    obj.support, obj.support_normal = obj.support_normal, obj.support
+	    obj.final_support, obj.final_support_normal = obj.final_support_normal, obj.final_support
 
 class SVFinder:    
     def __init__(self, bam_file, contig_fasta, genome_fasta, out_dir,
                  genome=None, index_dir=None, num_procs=0,
-                 skip_simple_repeats=False, cytobands_file=None, acen_buffer=0, debug=False):
+		 skip_simple_repeats=False, cytobands_file=None, acen_buffer=0, repeats_index=None, mmap_genome=False, debug=False):
+	self.bam_file = bam_file
 	self.bam = pysam.Samfile(bam_file, 'rb')
 	self.contig_fasta_file = contig_fasta
-	self.contig_fasta = pysam.Fastafile(contig_fasta)
-	self.ref_fasta = pysam.Fastafile(genome_fasta)
+	# contig sequences are fetched by several stages, so they are cached
+	self.contig_fasta = SequenceCache(contig_fasta)
+	self.genome_fasta_file = genome_fasta
+	# reference is fetched a few bases at a time around breakpoints
+	self.mmap_genome = mmap_genome
+	self.ref_fasta = BlockCache(genome_fasta, use_mmap=mmap_genome)
 	self.genome = genome
 	self.index_dir = index_dir
 	self.num_procs = num_procs
 	self.out_dir = out_dir
 	self.adjs = []
 	self.skip_simple_repeats = skip_simple_repeats
+	self.repeats_index_file = repeats_index
+	self.repeat_index = None
+	if repeats_index is not None:
+	    self.repeat_index = RepeatIndex(repeats_index)
 	self.cytobands_file = cytobands_file
 	self.acen_buffer = acen_buffer
+	# acen and bad regions are added in find_adjs()
+	self.mask = GenomicMask(non_canonical=True)
 	self.debug = debug
 	
 	self.avg_tlen = None
 	self.avg_tlen_normal = None
 	
-    def find_adjs(self, min_ctg_cov, max_size=None, min_size=None, ins_as_ins=False, skip_acen=False, check_alt_paths=False, min_ctg_size=0, bad_coords=None, skip_contigs_file=None):
+    def find_adjs(self, min_ctg_cov, max_size=None, min_size=None, ins_as_ins=False, skip_acen=False, check_alt_paths=False, min_ctg_size=0, bad_coords=None, skip_contigs_file=None,
+		  batch_size=500, max_adjs_in_memory=None):
 	"""Main method to go through the BAM file, extract split and gapped alignments, and calls
-	the respective modules to identify adjs"""
-	def find_events_in_single_align(align):
-	    """Implement as sub-function so that small-scale events can be found on split alignments too"""
-	    adjs = gapped_align.find_adjs(align, contig_seq, False, ins_as_ins=ins_as_ins,
-	                                  query_fasta=self.contig_fasta, target_fasta=self.ref_fasta)
-		
-	    repeats = Set()
-	    for i in range(len(adjs)):
-		adj = adjs[i]
-		
-		if self.skip_simple_repeats and self.break_region_has_low_complexity(adj.chroms[0], adj.breaks):
-		    repeats.add(i)
-		    if self.debug:
-			sys.stdout.write("remove contig %s %s potential simple-repeat %s:%s-%s\n" % (adj.contigs[0], 
-			                                                                             adj.rearrangement, 
-			                                                                             adj.chroms[0], 
-			                                                                             adj.breaks[0], 
-			                                                                             adj.breaks[1]))
-		    continue
-		    
-		# seems unnecessary
-		#new_contig_breaks = self.expand_contig_breaks(adj.chroms[0], adj.breaks, contig, adj.contig_breaks[0], adj.rearrangement, self.debug)
-		#if new_contig_breaks is not None:
-		    #adj.contig_breaks[0] = new_contig_breaks
-		    			    
-	    if repeats:
-		for i in sorted(repeats, reverse=True):
-		    del adjs[i]
-		
-	    return adjs	
+	the respective modules to identify adjs
 	
-	def is_align_in_acen(align, acen):
-	    """Checks to see if alignment overlaps with acentromeric coordinates
-	    Args:
-	        align: alignment (Alignment)
-		acen: acentromeric coordinates parsed from UCSC cytobands file (Dictionary) {chrom:(start, end), (start, end)}
-	    Returns True if overlapped
-	    """
-	    s1, e1 = align.tstart, align.tend
-	    if acen.has_key(align.target):
-		for (start, end) in acen[align.target]:
-		    s2, e2 = int(start) - self.acen_buffer, int(end) + self.acen_buffer
-		    if s1 <= e2 and s2 <= e1:
-			return True
-		    
-	    return False
+	If num_procs > 1, contigs are split into batches of batch_size contigs and processed
+	by a pool of workers, each opening its own BAM and FASTA handles
 	
+	If max_adjs_in_memory is specified, adjacencies are merged with bounded memory
+	(see Adjacency.external_merge), and only merged adjacencies that pass the coordinate
+	and size filters are kept in memory
+	"""
 	def create_set(list_file):
 	    """Creates set from items in a list"""
 	    subset = Set()
@@ -90,132 +79,247 @@ class SVFinder:
 		subset.add(line.strip('\n'))
 	    return subset
 		    
-	acen_coords = None
-	if skip_acen:
-	    acen_coords = get_acen_coords(self.cytobands_file)
+	# acentromeric regions, regions to screen out, non-canonical chromosomes
+	self.mask = GenomicMask.from_files(cytobands_file=self.cytobands_file if skip_acen else None,
+					   acen_buffer=self.acen_buffer,
+					   bad_bed_file=bad_coords,
+					   non_canonical=True)
 	    
 	skip_contigs = None
 	if skip_contigs_file and os.path.exists(skip_contigs_file):
 	    skip_contigs = create_set(skip_contigs_file)
+	    
+	params = {'min_ctg_cov': min_ctg_cov,
+		  'ins_as_ins': ins_as_ins,
+		  'mask': self.mask,
+		  'check_alt_paths': check_alt_paths,
+		  'min_ctg_size': min_ctg_size,
+		  'skip_contigs': skip_contigs,
+		  }
 	
-	all_adjs = []
-	for contig, group in groupby(self.bam.fetch(until_eof=True), lambda x: x.qname):
-	    print 'contig', contig
-	    alns = list(group)
-	    contig_seq = self.contig_fasta.fetch(contig)
+	def in_size_range(adj):
+	    """Checks if size of adjacency is within min_size and max_size"""
+	    size = adj.get_size()
 	    
-	    if len(contig_seq) < min_ctg_size:
-		if self.debug:
-		    sys.stdout.write('%s(%d bp) less than min contig size %d bp\n' % (contig, len(contig_seq), min_ctg_size))
-		continue
+	    if max_size is not None and\
+	       min_size is not None:
+		return type(size) is int and\
+		       size >= min_size and size <= max_size
+
+	    elif max_size is not None:
+		return type(size) is int and\
+		       size <= max_size
+		
+	    elif min_size is not None:
+		return type(size) is not int or\
+		       size >= min_size
 	    
-	    if skip_contigs and contig in skip_contigs:
-		if self.debug:
-		    sys.stdout.write('%s skipped\n' % contig)
-		continue
+	    return True
+	
+	merge_stats = {}
+	if max_adjs_in_memory is not None:
+	    # streaming mode: adjacencies are spilled to disk in sorted runs and k-way merged,
+	    # merged adjacencies are filtered as they are generated
+	    tmp_dir = tempfile.mkdtemp(dir=self.out_dir)
+	    selected = []
+	    for adj in Adjacency.external_merge(self.iter_adjs(params, batch_size=batch_size),
+						 tmp_dir,
+						 run_size=max_adjs_in_memory,
+						 stats=merge_stats):
+		if self.mask.bad_regions is not None and self.in_bad_region(adj):
+		    continue
+		if in_size_range(adj):
+		    selected.append(adj)
+	    shutil.rmtree(tmp_dir)
+	else:
+	    merged_adjs = Adjacency.merge(self.iter_adjs(params, batch_size=batch_size), stats=merge_stats)
 	    
-	    if len(alns) > 1:
-		chimeric_aligns, dubious = split_align.find_chimera(alns, 
-		                                                    self.bam, 
-		                                                    min_coverage=min_ctg_cov, 
-		                                                    check_alt_paths=check_alt_paths, 
-		                                                    debug=self.debug)		
-		if chimeric_aligns:
-		    if acen_coords:
-			skip = False
-			for align in chimeric_aligns:
-			    if acen_coords and is_align_in_acen(align, acen_coords):
-				if self.debug:
-				    sys.stdout.write('skip contig %s because alignment is in centromere %s:%d-%d\n' % (contig,
-					                                                                               align.target,
-					                                                                               align.tstart,
-					                                                                               align.tend
-					                                                                               ))
-				skip = True
-				break
-			if skip:
-			    continue
+	    # screen out adjacencies that overlap segdups
+	    if self.mask.bad_regions is not None:
+		self.screen_by_coordinate(merged_adjs)
+	    
+	    # size filtering
+	    selected = [adj for adj in merged_adjs if in_size_range(adj)]
+	    
+	if self.debug:
+	    sys.stdout.write('merged %d adjacencies into %d (%d supported by multiple contigs, max contigs:%d)\n' % (merge_stats['adjs'],
+														  merge_stats['merged'],
+														  merge_stats['multi_contig'],
+														  merge_stats['max_contigs']))
+	    sys.stdout.write('contig sequence cache %s\n' % self.contig_fasta.stats())
+	    sys.stdout.write('reference block cache %s\n' % self.ref_fasta.stats())
+	
+	return selected
+	
+    
+    def iter_adjs(self, params, batch_size=500):
+	"""Generates adjacencies contig by contig, in BAM order
+	
+	Args:
+	    params: (dict) keyword arguments to find_adjs_in_contig()
+	    batch_size: (int) number of contigs per batch in parallel mode
+	Yields:
+	    Adjacency
+	"""
+	if self.num_procs > 1:
+	    pool = mp.Pool(processes=self.num_procs,
+			   initializer=init_worker,
+			   initargs=(self.init_args(), params))
+	    # imap returns results in batch order, so merging is deterministic
+	    for adjs in pool.imap(worker, create_batches(self.bam_file, batch_size)):
+		for adj in adjs:
+		    yield adj
+	    pool.close()
+	    pool.join()
+	else:
+	    for contig, group in groupby(self.bam.fetch(until_eof=True), lambda x: x.qname):
+		for adj in self.find_adjs_in_contig(contig, list(group), **params):
+		    yield adj
 		
-		    adjs = split_align.find_adjs(chimeric_aligns, contig_seq, dubious=dubious, debug=self.debug)
-		    
-		    bad = Set()
-		    for i in range(len(adjs)):
-			adj = adjs[i]
-			#check if homol is simple repeat
-			if adj.homol_seq and adj.homol_seq[0] != '-' and self.is_homol_low_complexity(adj):
+    def init_args(self):
+	"""Returns arguments for re-creating this object in a worker process
+	(pysam file handles cannot be passed across processes)
+	
+	Returns:
+	    tuple of (positional arguments, keyword arguments)
+	"""
+	return ((self.bam_file, self.contig_fasta_file, self.genome_fasta_file, self.out_dir),
+		{'genome': self.genome,
+		 'index_dir': self.index_dir,
+		 'skip_simple_repeats': self.skip_simple_repeats,
+		 'cytobands_file': self.cytobands_file,
+		 'acen_buffer': self.acen_buffer,
+		 'repeats_index': self.repeats_index_file,
+		 'mmap_genome': self.mmap_genome,
+		 'debug': self.debug})
+    
+    def find_adjs_in_contig(self, contig, alns, min_ctg_cov, ins_as_ins=False, mask=None, check_alt_paths=False, min_ctg_size=0, skip_contigs=None):
+	"""Finds adjacencies from the alignments of a single contig
+	
+	Args:
+	    contig: (str) contig name
+	    alns: (list) pysam.AlignedRead objects of the contig
+	    min_ctg_cov: (float) minimum contig coverage of chimeric alignments
+	    ins_as_ins: (boolean) output small insertions as insertions
+	    mask: (GenomicMask) chimeric alignments overlapping acentromeric regions are skipped
+	    check_alt_paths: (boolean) check alternative paths of chimeric alignments
+	    min_ctg_size: (int) minimum contig size
+	    skip_contigs: (Set) contigs to skip
+	Returns:
+	    List of Adjacencies
+	"""
+	print 'contig', contig
+	adjs_found = []
+	contig_seq = self.contig_fasta.fetch(contig)
+	
+	if len(contig_seq) < min_ctg_size:
+	    if self.debug:
+		sys.stdout.write('%s(%d bp) less than min contig size %d bp\n' % (contig, len(contig_seq), min_ctg_size))
+	    return adjs_found
+	
+	if skip_contigs and contig in skip_contigs:
+	    if self.debug:
+		sys.stdout.write('%s skipped\n' % contig)
+	    return adjs_found
+	
+	if len(alns) > 1:
+	    chimeric_aligns, dubious = split_align.find_chimera(alns, 
+								self.bam, 
+								min_coverage=min_ctg_cov, 
+								check_alt_paths=check_alt_paths, 
+								debug=self.debug)           
+	    if chimeric_aligns:
+		if mask is not None and mask.acen is not None:
+		    for align in chimeric_aligns:
+			if mask.align_in_acen(align):
 			    if self.debug:
-				sys.stdout.write("homol_seq is simple-repeat %s:%s\n" % (adj.contigs[0], adj.homol_seq[0]))
+				sys.stdout.write('skip contig %s because alignment is in centromere %s:%d-%d\n' % (contig,
+														   align.target,
+														   align.tstart,
+														   align.tend
+														   ))
+			    return adjs_found
+	    
+		adjs = split_align.find_adjs(chimeric_aligns, contig_seq, dubious=dubious, debug=self.debug)
+		
+		bad = Set()
+		for i in range(len(adjs)):
+		    adj = adjs[i]
+		    #check if homol is simple repeat
+		    if adj.homol_seq and adj.homol_seq[0] != '-' and self.is_homol_low_complexity(adj):
+			if self.debug:
+			    sys.stdout.write("homol_seq is simple-repeat %s:%s\n" % (adj.contigs[0], adj.homol_seq[0]))
+			bad.add(i)
+		    
+		    # check if event is simple repeat expansions
+		    if self.skip_simple_repeats and self.is_novel_sequence_repeat(adj):
+			if self.debug:
+			    sys.stdout.write("novel_seq is simple-repeat %s:%s\n" % (adj.contigs[0], adj.novel_seq))
+			bad.add(i)
+			
+		    # inversion with size of 1
+		    if adj.rearrangement == 'inv' and adj.get_size() <= 1:
+			if self.debug:
+			    sys.stdout.write("inversion with unreasonable size %s:%d %s:%d-%d\n" % (adj.contigs[0], adj.get_size(), 
+												    adj.chroms[0], adj.breaks[0], adj.breaks[1]))
 			    bad.add(i)
 			
-			# check if event is simple repeat expansions
-			if self.skip_simple_repeats and self.is_novel_sequence_repeat(adj):
+		    if i > 0:
+			if adjs[i].chroms == adjs[i - 1].chroms and\
+			   adjs[i].breaks == adjs[i - 1].breaks and\
+			   adjs[i].orients == adjs[i].orients and\
+			   adjs[i].contig_breaks != adjs[i - 1].contig_breaks:
 			    if self.debug:
-				sys.stdout.write("novel_seq is simple-repeat %s:%s\n" % (adj.contigs[0], adj.novel_seq))
+				sys.stdout.write("%s has 2 contig_breaks for same event\n" % adj.contigs[0])
+			    bad.add(i - 1)
 			    bad.add(i)
-			    
-			# inversion with size of 1
-			if adj.rearrangement == 'inv' and adj.get_size() <= 1:
-			    if self.debug:
-				sys.stdout.write("inversion with unreasonable size %s:%d %s:%d-%d\n" % (adj.contigs[0], adj.get_size(), 
-				                                                                        adj.chroms[0], adj.breaks[0], adj.breaks[1]))
-				bad.add(i)
-			    
-			if i > 0:
-			    if adjs[i].chroms == adjs[i - 1].chroms and\
-			       adjs[i].breaks == adjs[i - 1].breaks and\
-			       adjs[i].orients == adjs[i].orients and\
-			       adjs[i].contig_breaks != adjs[i - 1].contig_breaks:
-				if self.debug:
-				    sys.stdout.write("%s has 2 contig_breaks for same event\n" % adj.contigs[0])
-				bad.add(i - 1)
-				bad.add(i)
-		    
-		    if bad:
-			for i in sorted(bad, reverse=True):
-			    del adjs[i]
-			    
-		    all_adjs.extend(adjs)
-		   
-		    # capture small-scale events within each chimeric alignment
-		    for align in chimeric_aligns:
-			all_adjs.extend(find_events_in_single_align(align))
+		
+		if bad:
+		    for i in sorted(bad, reverse=True):
+			del adjs[i]
 			
-	    best_align = gapped_align.find_single_unique(alns, self.bam, debug=self.debug)
-	    if best_align:
-		all_adjs.extend(find_events_in_single_align(best_align))
+		adjs_found.extend(adjs)
+	       
+		# capture small-scale events within each chimeric alignment
+		for align in chimeric_aligns:
+		    adjs_found.extend(self.find_events_in_single_align(align, contig_seq, ins_as_ins=ins_as_ins))
 		    
-	merged_adjs = Adjacency.merge(all_adjs)
-	
-	# screen out adjacencies that overlap segdups
-	if bad_coords is not None and os.path.exists(bad_coords):
-	    self.screen_by_coordinate(merged_adjs, bad_coords)
+	best_align = gapped_align.find_single_unique(alns, self.bam, debug=self.debug)
+	if best_align:
+	    adjs_found.extend(self.find_events_in_single_align(best_align, contig_seq, ins_as_ins=ins_as_ins))
 	    
-	# size filtering
-	if max_size is not None or min_size is not None:
-	    selected = []
-	    for adj in merged_adjs:
-		size = adj.get_size()
+	return adjs_found
+    
+    def find_events_in_single_align(self, align, contig_seq, ins_as_ins=False):
+	"""Finds small-scale events in a single alignment
+	Implemented separately so that small-scale events can be found on split alignments too"""
+	adjs = gapped_align.find_adjs(align, contig_seq, False, ins_as_ins=ins_as_ins,
+				      query_fasta=self.contig_fasta, target_fasta=self.ref_fasta)
+	    
+	repeats = Set()
+	for i in range(len(adjs)):
+	    adj = adjs[i]
+	    
+	    if self.skip_simple_repeats and self.break_region_has_low_complexity(adj.chroms[0], adj.breaks):
+		repeats.add(i)
+		if self.debug:
+		    sys.stdout.write("remove contig %s %s potential simple-repeat %s:%s-%s\n" % (adj.contigs[0], 
+												 adj.rearrangement, 
+												 adj.chroms[0], 
+												 adj.breaks[0], 
+												 adj.breaks[1]))
+		continue
 		
-		if max_size is not None and\
-		   min_size is not None:
-		    if type(size) is int and\
-		       size >= min_size and size <= max_size:
-			selected.append(adj)
-
-		elif max_size is not None:
-		    if type(size) is int and\
-		       size <= max_size:
-			selected.append(adj)
-			
-		elif min_size is not None:
-		    if type(size) is not int or\
-		       size >= min_size:
-			selected.append(adj)			
-			
-	    return selected
-	else:
-	    return merged_adjs
-	
+	    # seems unnecessary
+	    #new_contig_breaks = self.expand_contig_breaks(adj.chroms[0], adj.breaks, contig, adj.contig_breaks[0], adj.rearrangement, self.debug)
+	    #if new_contig_breaks is not None:
+		#adj.contig_breaks[0] = new_contig_breaks
+					
+	if repeats:
+	    for i in sorted(repeats, reverse=True):
+		del adjs[i]
+	    
+	return adjs 
     
     def create_variants(self, adjs):
 	def track_adjs(used_ids, variants):
@@ -277,7 +381,7 @@ class SVFinder:
 	    adj: (Adjacency)
 	    min_len: (int) minimum length of novel sequence before consideration
 	"""
-	contig_seq = self.contig_fasta.fetch(adj.contigs[0]).upper()	
+	contig_seq = self.contig_fasta.fetch_upper(adj.contigs[0])    
 	contig_breaks = (adj.contig_breaks[0][0], adj.contig_breaks[0][1] - 2)
 
 	len_seq = 0
@@ -302,6 +406,8 @@ class SVFinder:
 	
 	Window of search = 100bp on either side genomic breakpoint
 	True if there is at least "min_units" of repeats that reside in breakpoint region
+	If a repeats index is given, the reference sequence is only scanned if the index has a repeat
+	that may contain the breakpoint
 	
 	Args:
 	    chrom: (str) chromosome name
@@ -312,54 +418,33 @@ class SVFinder:
 	Returns:
 	    True if yes, False if no
 	"""
-	r = re.compile(r"(.+?)\1+")
 	window = 100
-	for i in range(breaks[0] - window, breaks[1] + 1):
-	    try:
-		seq = self.ref_fasta.fetch(chrom, max(0,i), i + 100)
-	    except:
-		print "can't extract reference sequence for complexity checking %s:%s-%s" % (chrom, i, i + 100)
-		continue
-	    
-	    repeats = r.findall(seq)
-	    
-	    if repeats and repeats[0].upper() != 'N':
-		m = re.search('^(%s){1,}' % repeats[0], seq)
-		if m is not None:
-		    repeat_start = i + 1
-		    repeat_end = i + len(m.group(0))
-		    num_units = len(m.group(0)) / len(repeats[0])
-		    if num_units >= min_units:
-			if breaks[0] != breaks[1] and\
-			   breaks[0] + 1 >= repeat_start - buf and breaks[1] - 1 <= repeat_end + buf:
-			    if self.debug:
-				sys.stdout.write('%s %s:%s-%s in low-complexity region %s:%s-%s %sx%d\n' % ('del',
-				                                                                            chrom,
-				                                                                            breaks[0],
-				                                                                            breaks[1],
-				                                                                            chrom,
-				                                                                            repeat_start,
-				                                                                            repeat_end,
-				                                                                            repeats[0].upper(),
-				                                                                            num_units,
-				                                                                            ))
-			    
-			    return True
-			elif breaks[0] == breaks[1] and\
-			     breaks[0] >= repeat_start - buf and breaks[0] + 1 <= repeat_end + buf:
-			    if self.debug:
-				sys.stdout.write('%s %s:%s-%s in low-complexity region %s:%s-%s %sx%d\n' % ('ins',
-				                                                                            chrom,
-				                                                                            breaks[0],
-				                                                                            breaks[1],
-				                                                                            chrom,
-				                                                                            repeat_start,
-				                                                                            repeat_end,
-				                                                                            repeats[0].upper(),
-				                                                                            num_units,
-				                                                                            ))
-			    return True
-	return False
+	if self.repeat_index is not None and\
+	   self.repeat_index.find_break_region_repeat(chrom, breaks, min_units=min_units, buf=buf, window=window) is None:
+	    return False
+	
+	# fetch whole search region once, the sequence examined at every position is a slice of it
+	region_start = max(0, breaks[0] - window)
+	try:
+	    region = self.ref_fasta.fetch(chrom, region_start, breaks[1] + window)
+	except:
+	    print "can't extract reference sequence for complexity checking %s:%s-%s" % (chrom, region_start, breaks[1] + window)
+	    return False
+	
+	repeat = break_region_repeat(region, region_start, breaks, min_units=min_units, buf=buf, window=window)
+	if repeat is not None and self.debug:
+	    repeat_start, repeat_end, repeat_unit, num_units = repeat
+	    sys.stdout.write('%s %s:%s-%s in low-complexity region %s:%s-%s %sx%d\n' % ('del' if breaks[0] != breaks[1] else 'ins',
+										        chrom,
+										        breaks[0],
+										        breaks[1],
+										        chrom,
+										        repeat_start,
+										        repeat_end,
+										        repeat_unit.upper(),
+										        num_units,
+										        ))
+	return repeat is not None
 	    
     def expand_contig_breaks(self, chrom, breaks, contig, contig_breaks, event, debug=False):
 	"""Expands contig_breaks if repeats reside in breakpoints
@@ -536,11 +621,13 @@ class SVFinder:
 		
 	return False
 		
-    def screen_realigns(self, use_realigns=False):
+    def screen_realigns(self, use_realigns=False, stream=False, cache_file=None):
 	"""Realign probe sequences of adjacencies and screen results
 
 	- genome, and index_dir must have been set when object is initialized
-	- output is always set to "realign.fa" and "realign.bam"
+	- output is always set to "realign.fa" and "realign.bam", unless stream is True,
+	  in which case probes are piped to the aligner and its alignments are screened as they are output
+	- if cache_file is given, only probes not in the realignment cache are aligned (not streamed)
 	- will fail Adjacency if probe sequence can align to single location
 	"""
 	if not self.genome or not self.index_dir:
@@ -550,20 +637,28 @@ class SVFinder:
 	all_adjs = []
 	for variant in self.variants:
 	    all_adjs.extend(variant.adjs)
-	realign_bam_file = Adjacency.realign(all_adjs,
-	                                     self.out_dir,
-	                                     probe=True,
-	                                     contigs_fasta=self.contig_fasta,
-	                                     name_sep=name_sep,
-	                                     genome=self.genome, 
-	                                     index_dir=self.index_dir,
-	                                     num_procs=self.num_procs,
-	                                     use_realigns=use_realigns,
-	                                     )
-	try:
-	    bam = pysam.Samfile(realign_bam_file, 'rb')
-	except:
-	    sys.exit('Error parsing realignment BAM:%s' % realign_bam_file)
+	# existing and cached realignments can only be read from file
+	stream = stream and not use_realigns and cache_file is None
+	realigns = Adjacency.realign(all_adjs,
+				     self.out_dir,
+				     probe=True,
+				     contigs_fasta=self.contig_fasta,
+				     name_sep=name_sep,
+				     genome=self.genome, 
+				     index_dir=self.index_dir,
+				     num_procs=self.num_procs,
+				     use_realigns=use_realigns,
+				     stream=stream,
+				     cache_file=cache_file,
+				     )
+	if stream:
+	    realign_alns = realigns
+	else:
+	    try:
+		bam = pysam.Samfile(realigns, 'rb')
+	    except:
+		sys.exit('Error parsing realignment BAM:%s' % realigns)
+	    realign_alns = bam.fetch(until_eof=True)
 	    
 	# creates mapping from query to variant and Adjacency
 	query_to_variant = {}
@@ -574,42 +669,46 @@ class SVFinder:
 		query_to_variant[query] = (i, j)
 		
 	failed_variants = Set()
-	for key, group in groupby(bam.fetch(until_eof=True), lambda x: name_sep.join(x.qname.split(name_sep)[:2])):
-	    alns = list(group)
-	    variant_idx = query_to_variant[key][0]
-	    variant = self.variants[variant_idx]
-	    adj_idx = query_to_variant[key][1]
-	    adj = variant.adjs[adj_idx]
-	    adj_aligns = adj.aligns[0]
+	try:
+	    for key, group in groupby(realign_alns, lambda x: name_sep.join(x.qname.split(name_sep)[:2])):
+		alns = list(group)
+		variant_idx = query_to_variant[key][0]
+		variant = self.variants[variant_idx]
+		adj_idx = query_to_variant[key][1]
+		adj = variant.adjs[adj_idx]
+		adj_aligns = adj.aligns[0]
 	    
-	    indices_to_check = (0, 1)
-	    if variant.event == 'INS':
-		index = None
-		for i in (0, 1):
-		    if variant.chrom == adj.chroms[i] and (variant.pos[0] == adj.breaks[i] or variant.pos[1] == adj.breaks[i]):
-			index = i
-			break
+		indices_to_check = (0, 1)
+		if variant.event == 'INS':
+		    index = None
+		    for i in (0, 1):
+			if variant.chrom == adj.chroms[i] and (variant.pos[0] == adj.breaks[i] or variant.pos[1] == adj.breaks[i]):
+			    index = i
+			    break
 		    
-		if index is not None:
-		    indices_to_check = (index,)
+		    if index is not None:
+			indices_to_check = (index,)
 	    
-	    probe_alns = [aln for aln in alns if not aln.qname[-1].isdigit()]
-	    if not gapped_align.screen_probe_alns(adj_aligns, probe_alns, adj.align_types[0]):
-		if self.debug:
-		    sys.stdout.write('probe align completely to one location or not aligned with confidence: %s\n' % key)
-		failed_variants.add(variant)
-		continue
+		probe_alns = [aln for aln in alns if not aln.qname[-1].isdigit()]
+		if not gapped_align.screen_probe_alns(adj_aligns, probe_alns, adj.align_types[0]):
+		    if self.debug:
+			sys.stdout.write('probe align completely to one location or not aligned with confidence: %s\n' % key)
+		    failed_variants.add(variant)
+		    continue
+	except subprocess.CalledProcessError, e:
+	    sys.exit('Failed to align:%s' % e.cmd)
 	    			
 	for failed_var in failed_variants:
 	    self.variants.remove(failed_var)
 		        
-    def output(self, reference_url=None, assembly_url=None, insertion_as_breakends=None, header=None):
+    def output(self, reference_url=None, assembly_url=None, insertion_as_breakends=None, header=None, bgzip=False):
 	"""Wrapper function to output Variants and Adjacencies
 	Args:
 	    only_somatic: (boolean) Only outputs somatic variants/adjacencies
 	    reference_url: (str) reference url to be put in VCF header (optional)
 	    assembly_url: (str) assembly url to be put in VCF header (optional)
 	    insertion_as_breakends: (boolean) Output big insertion as breakends
+	    bgzip: (boolean) also output bgzip-compressed, tabix-indexed VCF and BEDPE
 	"""
 	variants = [variant for variant in self.variants if not variant.filtered_out]
 	#if only_somatic:
@@ -624,6 +723,7 @@ class SVFinder:
                              assembly_url=assembly_url, 
                              insertion_as_breakends=insertion_as_breakends,
 	                     source=source,
+			     bgzip=bgzip,
 	                     )
     
 	adjs = []
@@ -636,31 +736,27 @@ class SVFinder:
 	self.output_adjacencies(adjs, 
                                 '%s/adjacencies.bedpe' % self.out_dir,
                                 format='bedpe',
-	                        header=header)
+				header=header,
+				bgzip=bgzip)
 		                         	
-    def output_variants(self, variants, out_file, reference_url=None, assembly_url=None, insertion_as_breakends=False, source='NA'):
-	"""Output variants in VCF format
+    def output_variants(self, variants, out_file, reference_url=None, assembly_url=None, insertion_as_breakends=False, source='NA', bgzip=False):
+	"""Output variants in VCF format, sorted by chromosome (in reference order) and position
 	Args:
 	    variants: (List) Variants
 	    out_file: (str) absolute path of output VCF file
 	    reference_url: (str) reference url to be put in VCF header (optional)
 	    assembly_url: (str) assembly url to be put in VCF header (optional)
 	    insertion_as_breakends: (boolean) Output big insertion as breakends
+	    bgzip: (boolean) also output bgzip-compressed, tabix-indexed <out_file>.gz
 	"""
-	records = []
+	# VCF records have chromosome names without "chr" (see Adjacency.as_breakends())
+	writer = SortedWriter(out_file, 'vcf',
+			      chroms=[chrom.lstrip('chr') for chrom in self.ref_fasta.references],
+			      header=VCF.header(source=source, reference_url=reference_url, assembly_url=assembly_url),
+			      bgzip=bgzip)
 	for variant in variants:
-	    output = variant.as_vcf(self.ref_fasta, insertion_as_sv=not insertion_as_breakends)
-	    
-	    if output is not None and output != '':
-		records.extend(output.split('\n'))	
-		
-	out = open(out_file, 'w')
-	out.write('%s\n' % VCF.header(source=source, reference_url=reference_url, assembly_url=assembly_url))
-	# sort by chromosome and pos
-	records.sort(key=lambda record: (record.split('\t')[0], record.split('\t')[1]))
-	for record in records:
-	    out.write('%s\n' % record)
-	out.close()
+	    writer.add_lines(variant.as_vcf(self.ref_fasta, insertion_as_sv=not insertion_as_breakends))
+	writer.close()
 	
     def output_probes(self, adjs, out_file):
 	"""Output probe sequences in FASTA format
@@ -674,19 +770,33 @@ class SVFinder:
 		out.write('>%s %d\n%s\n' % (adj.id, len(adj.probes[0]), adj.probes[0]))
 	out.close()
 	
-    def output_adjacencies(self, adjs, out_file, format, header=None):
+    def output_adjacencies(self, adjs, out_file, format, header=None, bgzip=False):
 	"""Output adjacencies in tsv format
+	BEDPE output is sorted by chromosome (in reference order) and position of first breakpoint
 	Args:
 	    adjs: (List) Adjacencies
 	    out_file: (str) absolute path of output file
 	    format: (str) either "tab" or "bedpe"
 	    header: (str) header string
+	    bgzip: (boolean) also output bgzip-compressed, tabix-indexed <out_file>.gz (bedpe only)
 	"""
+	if format == 'bedpe':
+	    if header is not None:
+		header += '\n' + Adjacency.show_bedpe_headers()
+	    else:
+		header = Adjacency.show_bedpe_headers()
+	    writer = SortedWriter(out_file, 'bedpe', chroms=self.ref_fasta.references, header=header, bgzip=bgzip)
+	    for adj in adjs:
+		try:
+		    writer.add(adj.chroms[0], adj.breaks[0] - 1, adj.as_bedpe())
+		except:
+		    sys.stdout.write("can't output Adjacency")
+	    writer.close()
+	    return
+
 	fn = None
 	args = ()
-	if format == 'bedpe':
-	    fn = 'as_bedpe'
-	elif format == 'tab':
+	if format == 'tab':
 	    fn = 'as_tab'
 
 	if not fn is None:
@@ -694,10 +804,7 @@ class SVFinder:
 	    if header is not None:
 		out.write(header + '\n')
 
-	    if format == 'tab':
-		out.write('%s\n' % Adjacency.show_tab_headers())
-	    elif format == 'bedpe':
-		out.write('%s\n' % Adjacency.show_bedpe_headers())
+	    out.write('%s\n' % Adjacency.show_tab_headers())
 		
 	    for adj in adjs:	    
 		output = getattr(adj, fn)(*args)
@@ -708,80 +815,143 @@ class SVFinder:
 		    
 	    out.close()
 
-    def find_support(self, script, bam, min_support, min_overlap, allow_clipped=False,
+    def find_support(self, bam, min_support, min_overlap, allow_clipped=False,
                      normal_bam=None, min_support_normal=None, min_overlap_normal=None,
-                     allow_clipped_normal=False, min_ratio_mapped=None, force=False, debug=False):
-	cmd = "python %s %s %s %s --num_procs %d" % (script,
-	                                             self.out_dir,
-	                                             bam,
-	                                             self.contig_fasta_file,
-	                                             self.num_procs,
-	                                             )
-	if min_support is not None:
-	    cmd += ' --min_support %d' % min_support
-	if allow_clipped:
-	    cmd += ' --allow_clipped'
-	    if min_ratio_mapped is not None:
-		cmd += ' --support_min_mapped %s' % min_ratio_mapped
-	if min_overlap is not None:
-	    cmd += ' --min_overlap %d' % min_overlap
-
-	# normal
-	if normal_bam is not None:
-	    cmd += ' --normal_bam %s' % normal_bam
-	if min_support_normal is not None:
-	    cmd += ' --min_support_normal %s' % min_support_normal
-	if min_overlap_normal is not None:
-	    cmd += ' --min_overlap_normal %s' % min_overlap_normal
-	if allow_clipped_normal:
-	    cmd += ' --allow_clipped_normal'
-	if force:
-	    cmd += ' --force'
-	if debug:
-	    cmd += ' --debug'
-
-	print cmd
-	process = subprocess.Popen(cmd, shell=True)
-	process.wait()
-    
-    def screen_by_coordinate(self, adjs, bad_bed_file):
-	def create_bed(outfile):
-	    out = open(outfile, 'w')
-	    for adj in adjs:
-		out.write('%s\n' % adj.as_bed())
-	    out.close()
-	    
-	# creates bed file for all adjacencies
-	adjs_bed_file = '%s/adjs.bed' % self.out_dir
-	create_bed(adjs_bed_file)
-	adjs_bed = BedTool(adjs_bed_file)
-	
-	# overlaps adjacencies with bad bed file, keeps breakpoints in Set
-	bad_breaks = Set()
-	regions = BedTool(bad_bed_file)
-	overlaps = regions.intersect(adjs_bed)
-	for olap in overlaps:
-	    bad_breaks.add('%s:%s' % (olap[0], int(olap[1]) + 1))
+		     allow_clipped_normal=False, min_ratio_mapped=None,
+		     reference_url=None, assembly_url=None, insertion_as_breakends=False, header=None, debug=False):
+	"""Gathers read support of variants and outputs variants and adjacencies with enough support
+
+	Variants and Adjacencies are annotated in place.
+	Outputs are "variants_filtered.vcf" and "adjacencies_filtered.bedpe", or if normal_bam is given,
+	"variants_<tumor/normal/somatic>_filtered.vcf" and "adjacencies_<tumor/normal/somatic>_filtered.bedpe",
+	where somatic variants are the tumor variants without any Adjacency supported in the normal.
+	Tumor and normal BAM files are scanned concurrently by the same pool of processes
+	Args:
+	    bam: (str) path of reads-to-contigs BAM file
+	    min_support: (int) minimum number of spanning reads
+	    min_overlap: (int) minimum breakpoint overlap for identifying read support
+	    allow_clipped: (boolean) allow using clipped reads as support
+	    normal_bam: (str) path of reads-to-contigs BAM file of matched normal
+	    min_support_normal: (int) minimum number of spanning reads in normal
+	    min_overlap_normal: (int) minimum breakpoint overlap for identifying read support in normal
+	    allow_clipped_normal: (boolean) allow using clipped reads as support in normal
+	    min_ratio_mapped: (float) when clipped reads are allowed, minimum ratio of read length mapped
+	    reference_url, assembly_url, insertion_as_breakends: see output_variants()
+	    header: (dict) 'software', 'time', 'cmd' for output headers
+	"""
+	variants = [variant for variant in self.variants if not variant.filtered_out]
+	output_args = {'reference_url': reference_url,
+		       'assembly_url': assembly_url,
+		       'insertion_as_breakends': insertion_as_breakends,
+		       'header': header}
+
+	if normal_bam is None:
+	    adjs_passed, variants_passed = annotate_support(variants, bam, self.contig_fasta_file, min_support,
+							    num_procs=self.num_procs,
+							    min_overlap=min_overlap,
+							    allow_clipped=allow_clipped,
+							    min_ratio_mapped=min_ratio_mapped,
+							    debug=debug)
+	    self.output_filtered(variants, variants_passed, adjs_passed, **output_args)
+	    return
+
+	coords = support_coords(variants)
+	support, support_normal = gather_support_samples([(coords, bam, min_overlap, allow_clipped, min_ratio_mapped),
+							  (coords, normal_bam, min_overlap_normal, allow_clipped_normal, min_ratio_mapped)],
+							 self.contig_fasta_file,
+							 num_procs=self.num_procs,
+							 debug=debug)
+	adjs_passed, variants_passed = apply_support(variants, support, min_support)
+	adjs_passed_normal, variants_passed_normal = apply_support(variants, support_normal, min_support_normal, normal=True)
+	germline_adjs = adjs_passed & adjs_passed_normal
+	# tumor output is written before variants are flagged somatic
+	self.output_filtered(variants, variants_passed, adjs_passed, out_prefix='tumor', **output_args)
+	somatic_variants = []
+	for variant in variants_passed:
+	    if not [adj for adj in variant.adjs if adj.id in germline_adjs]:
+		variant.somatic = True
+		somatic_variants.append(variant)
+
+	self.output_filtered(variants, somatic_variants, adjs_passed - germline_adjs, out_prefix='somatic', **output_args)
+	# normal support is output in place of tumor support
+	swap_support(variants)
+	self.output_filtered(variants, variants_passed_normal, adjs_passed_normal, out_prefix='normal', **output_args)
+	swap_support(variants)
+
+    def output_filtered(self, variants, variants_passed, adjs_passed, out_prefix=None,
+			reference_url=None, assembly_url=None, insertion_as_breakends=False, header=None):
+	"""Outputs variants and adjacencies that pass read support filtering
+
+	Args:
+	    variants: (list) all Variants, for ordering Adjacencies
+	    variants_passed: (list) Variants to output
+	    adjs_passed: (Set) ids of Adjacencies to output
+	    out_prefix: (str) prefix of output files e.g. tumor
+	    header: (dict) 'software', 'time', 'cmd' for output headers
+	"""
+	if out_prefix is None:
+	    suffix = 'filtered'
+	else:
+	    suffix = '%s_filtered' % out_prefix
+
+	source = 'NA'
+	adj_header = None
+	if header is not None:
+	    source = header['software']
+	    adj_header = '#%s\n#%s %s' % (header['software'], header['time'], header['cmd'])
+
+	self.output_variants(variants_passed,
+			     '%s/variants_%s.vcf' % (self.out_dir, suffix),
+			     reference_url=reference_url,
+			     assembly_url=assembly_url,
+			     insertion_as_breakends=insertion_as_breakends,
+			     source=source)
+	adjs = []
+	for variant in variants:
+	    adjs.extend([adj for adj in variant.adjs if adj.id in adjs_passed])
+	self.output_adjacencies(adjs,
+				'%s/adjacencies_%s.bedpe' % (self.out_dir, suffix),
+				format='bedpe',
+				header=adj_header)
+
+    def screen_by_coordinate(self, adjs):
+	"""Screens out adjacencies that have a breakpoint in bad regions (e.g. segdups) of mask
 	
+	Args:
+	    adjs: (list) Adjacency, screened out in place
+	"""
 	# screen out adjacencies
 	bad_adj_indices = Set()
 	for i in range(len(adjs)):
-	    for j in (0,1):
-		breakpt = '%s:%s' % (adjs[i].chroms[j], adjs[i].breaks[j])
-		if breakpt in bad_breaks:
-		    bad_adj_indices.add(i)
-		    if self.debug:
-			sys.stdout.write('%s %s:%s %s:%s (%s) overlaps repeat/segdup\n' % (adjs[i].contigs[0],
-			                                                                      adjs[i].chroms[0],
-			                                                                      adjs[i].breaks[0],
-			                                                                      adjs[i].chroms[1],
-			                                                                      adjs[i].breaks[1],
-			                                                                      breakpt
-			                                                                      )
-			                 )
+	    if self.in_bad_region(adjs[i]):
+		bad_adj_indices.add(i)
 	for i in sorted(bad_adj_indices, reverse=True):
 	    del adjs[i]
 	    
+    def in_bad_region(self, adj):
+	"""Checks if adjacency has a breakpoint in bad regions (e.g. segdups) of mask
+	
+	Args:
+	    adj: (Adjacency) adjacency
+	Returns:
+	    True if a breakpoint is in a bad region
+	"""
+	bad = False
+	for j in (0,1):
+	    if self.mask.break_in_bad_region(adj.chroms[j], adj.breaks[j]):
+		breakpt = '%s:%s' % (adj.chroms[j], adj.breaks[j])
+		bad = True
+		if self.debug:
+		    sys.stdout.write('%s %s:%s %s:%s (%s) overlaps repeat/segdup\n' % (adj.contigs[0],
+		                                                                      adj.chroms[0],
+		                                                                      adj.breaks[0],
+		                                                                      adj.chroms[1],
+		                                                                      adj.breaks[1],
+		                                                                      breakpt
+		                                                                      )
+		                     )
+	return bad
+	    
     def filter_variants(self, max_homol=None):
 	"""Filter out events that are believed to be false positive
 	
@@ -809,7 +979,7 @@ class SVFinder:
 		    if self.debug:
 			sys.stdout.write('non AGTC in novel sequence %s %s\n' % (adj.contigs, adj.novel_seq))
 			
-		if not adj.filtered_out and (target_non_canonical(adj.chroms[0]) or target_non_canonical(adj.chroms[1])):
+		if not adj.filtered_out and (self.mask.is_non_canonical(adj.chroms[0]) or self.mask.is_non_canonical(adj.chroms[1])):
 		    adj.filtered_out = True
 		    if self.debug:
 			sys.stdout.write('non canonical chromosome %s %s\n' % (adj.contigs, adj.chroms))
@@ -821,4 +991,75 @@ class SVFinder:
 			    sys.stdout.write('homolgous sequence length %s too long (>%s)\n' % (len(adj.homol_seq[0]), max_homol))
 			    
 		if adj.filtered_out:
-		    variant.filtered_out = True
\ No newline at end of file
+		    variant.filtered_out = True
+
+# one SVFinder (with its own file handles) per worker process
+_worker_finder = None
+_worker_params = None
+
+def init_worker(init_args, params):
+    """Initializes worker process for parallel adjacency discovery
+    
+    Args:
+	init_args: (tuple) positional and keyword arguments to re-create SVFinder
+	params: (dict) keyword arguments to SVFinder.find_adjs_in_contig()
+    """
+    global _worker_finder, _worker_params
+    args, kwargs = init_args
+    _worker_finder = SVFinder(*args, **kwargs)
+    _worker_params = params
+    
+def worker(batch):
+    """Finds adjacencies in a batch of contigs
+    
+    Args:
+	batch: (tuple) virtual file offset of the first alignment of the batch, number of contigs
+    Returns:
+	List of Adjacencies
+    """
+    offset, num_contigs = batch
+    bam = _worker_finder.bam
+    bam.seek(offset)
+    
+    adjs = []
+    count = 0
+    for contig, group in groupby(bam.fetch(until_eof=True), lambda x: x.qname):
+	adjs.extend(_worker_finder.find_adjs_in_contig(contig, list(group), **_worker_params))
+	count += 1
+	if count == num_contigs:
+	    break
+	
+    return adjs
+
+def create_batches(bam_file, batch_size):
+    """Splits contigs of name-sorted BAM file into batches
+    
+    Args:
+	bam_file: (str) path of contigs-to-genome BAM file
+	batch_size: (int) number of contigs per batch
+    Yields:
+	tuple of (virtual file offset of first alignment of batch, number of contigs in batch)
+    """
+    bam = pysam.Samfile(bam_file, 'rb')
+    start = None
+    num_contigs = 0
+    prev_contig = None
+    while True:
+	offset = bam.tell()
+	try:
+	    aln = bam.next()
+	except StopIteration:
+	    break
+	
+	if aln.qname != prev_contig:
+	    if num_contigs == batch_size:
+		yield start, num_contigs
+		num_contigs = 0
+	    if num_contigs == 0:
+		start = offset
+	    num_contigs += 1
+	    prev_contig = aln.qname
+	    
+    if num_contigs > 0:
+	yield start, num_contigs
+    bam.close()
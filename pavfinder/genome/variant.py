@@ -39,6 +39,16 @@ class Variant:
 	    output.append(adj.as_vcf(ref_fasta, size_threshold, genomic))
 	return '\n'.join(output)
 	        
+    def support_info(self):
+	"""Returns read support of variant (minimum over its adjacencies) as INFO fields
+
+	Fields are set to None when there is no support, so that the support of the adjacency
+	the record is generated from is not reported instead
+	"""
+	if self.final_support is None:
+	    return {'SPANNING_READS': None, 'FLANKING_PAIRS': None}
+	return {'SPANNING_READS': self.support['spanning'], 'FLANKING_PAIRS': self.support['flanking']}
+	
     def inversion_as_vcf(self, ref_fasta):
 	info = {}
 	
@@ -54,7 +64,7 @@ class Variant:
 	if self.adjs[1].homol_seq and self.adjs[1].homol_seq[0]  != '-':
 	    info['CIEND'] = '0,%d' % len(self.adjs[1].homol_seq[0])
 	    
-	info['READSUPPORT'] = self.final_support
+	info.update(self.support_info())
 	
 	if self.somatic:
 	    info['SOMATIC'] = 'SOMATIC'
@@ -95,7 +105,7 @@ class Variant:
 	if self.pos[1] != self.pos[0]:
 	    info['CIPOS'] = '0,%d' % (self.pos[1] - self.pos[0])
 	    	
-	info['READSUPPORT'] = self.final_support
+	info.update(self.support_info())
 	
 	if self.somatic:
 	    info['SOMATIC'] = 'SOMATIC'
@@ -0,0 +1,99 @@
+import pysam
+
+class Record(object):
+    """Output line with its sort key"""
+    __slots__ = ('key', 'line')
+
+    def __init__(self, key, line):
+        self.key = key
+        self.line = line
+
+class SortedWriter:
+    """Writes records sorted by chromosome and position, optionally bgzipped and tabix-indexed
+
+    Chromosomes are ranked in the order of the reference (e.g. FASTA index) and positions
+    are compared as integers, so the output is in the order required by tabix.
+    Chromosomes not in the reference come after those that are, sorted by name.
+    Records with the same position keep the order they are added in.
+    """
+    # tabix_index() arguments (0-based columns) of supported formats
+    tabix_columns = {'vcf': {'preset': 'vcf'},
+                     'bedpe': {'seq_col': 0, 'start_col': 1, 'end_col': 2, 'zerobased': True},
+                     }
+
+    def __init__(self, out_file, format, chroms=None, header=None, bgzip=False):
+        """Initializes writer
+
+        Args:
+            out_file: (str) path of output file
+            format: (str) either "vcf" or "bedpe"
+            chroms: (list) chromosome names in reference order
+            header: (str) header lines, written before records
+            bgzip: (boolean) also write bgzip-compressed, tabix-indexed <out_file>.gz
+        """
+        if not self.tabix_columns.has_key(format):
+            raise ValueError('unsupported format:%s' % format)
+        self.out_file = out_file
+        self.format = format
+        self.header = header
+        self.bgzip = bgzip
+        self.chrom_ranks = {}
+        if chroms is not None:
+            for rank, chrom in enumerate(chroms):
+                self.chrom_ranks[chrom] = rank
+        self.records = []
+
+    def chrom_rank(self, chrom):
+        """Returns sort key of chromosome (tuple)"""
+        try:
+            return (self.chrom_ranks[chrom], '')
+        except KeyError:
+            return (len(self.chrom_ranks), chrom)
+
+    def add(self, chrom, pos, line):
+        """Adds record
+
+        Args:
+            chrom: (str) chromosome
+            pos: (int) position used for sorting
+            line: (str) record line without newline
+        """
+        self.records.append(Record((self.chrom_rank(chrom), pos, len(self.records)), line))
+
+    def add_line(self, line):
+        """Adds record line, chromosome and position are taken from first 2 columns
+
+        Args:
+            line: (str) VCF or BEDPE line without newline
+        """
+        cols = line.split('\t', 2)
+        self.add(cols[0], int(cols[1]), line)
+
+    def add_lines(self, lines):
+        """Adds newline-separated record lines (e.g. multiple VCF records of a variant)
+
+        Args:
+            lines: (str) record lines, can be None or empty
+        """
+        if lines:
+            for line in lines.split('\n'):
+                if line:
+                    self.add_line(line)
+
+    def close(self):
+        """Writes sorted records, compresses and indexes output if asked
+
+        Returns:
+            path of compressed file if bgzip is True, else None
+        """
+        self.records.sort(key=lambda record: record.key)
+        with open(self.out_file, 'w') as out:
+            if self.header is not None:
+                out.write('%s\n' % self.header)
+            for record in self.records:
+                out.write('%s\n' % record.line)
+        self.records = []
+
+        if self.bgzip:
+            return pysam.tabix_index(self.out_file, force=True, keep_original=True, **self.tabix_columns[self.format])
+        return None
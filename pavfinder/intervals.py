@@ -0,0 +1,221 @@
+import numpy as np
+
+def coalesce(intervals):
+    """Sorts and merges overlapping or adjacent intervals
+
+    Args:
+        intervals: (list) (start, end) closed integer intervals
+    Returns:
+        list of (start, end), sorted and disjoint
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def coalesce_arrays(starts, ends):
+    """Vectorised coalesce() for many intervals
+
+    Args:
+        starts: (array-like) starts of closed integer intervals
+        ends: (array-like) ends of closed integer intervals
+    Returns:
+        tuple of (starts, ends) NumPy arrays of sorted, disjoint intervals
+    """
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind='mergesort')
+    starts = starts[order]
+    max_ends = np.maximum.accumulate(ends[order])
+    # an interval starts a new run if it is not overlapping or adjacent to all intervals before it
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] > max_ends[:-1] + 1)))
+    last = np.concatenate((first[1:] - 1, [len(starts) - 1]))
+    return starts[first], max_ends[last]
+
+def union_length(starts, ends):
+    """Returns number of integers covered by intervals (int), vectorised
+
+    Args:
+        starts: (array-like) starts of closed integer intervals
+        ends: (array-like) ends of closed integer intervals
+    """
+    merged_starts, merged_ends = coalesce_arrays(starts, ends)
+    return int((merged_ends - merged_starts + 1).sum())
+
+class IntervalSet:
+    """Set of integers stored as sorted, coalesced closed intervals
+
+    Replacement of intspan for spans of alignments and reads: intervals are kept as
+    integer pairs instead of being formatted to and parsed from strings,
+    and operations are linear sweeps over the intervals.
+    """
+    def __init__(self, intervals=None):
+        """Creates set
+
+        Args:
+            intervals: (list) (start, end) closed integer intervals, can overlap
+        """
+        if intervals:
+            self.intervals = coalesce(intervals)
+        else:
+            self.intervals = []
+
+    @classmethod
+    def span(cls, start, end):
+        """Creates set of a single interval
+
+        Args:
+            start: (int) start
+            end: (int) end (inclusive)
+        Returns:
+            IntervalSet
+        """
+        if start > end:
+            raise ValueError('start exceeds end (%s-%s)' % (start, end))
+        interval_set = cls()
+        interval_set.intervals = [(start, end)]
+        return interval_set
+
+    @classmethod
+    def _from_coalesced(cls, intervals):
+        interval_set = cls()
+        interval_set.intervals = intervals
+        return interval_set
+
+    def add(self, start, end):
+        """Adds interval to set
+
+        Args:
+            start: (int) start
+            end: (int) end (inclusive)
+        """
+        self.intervals = coalesce(self.intervals + [(start, end)])
+
+    def union(self, other):
+        """Returns union with other IntervalSet"""
+        return IntervalSet._from_coalesced(coalesce(self.intervals + other.intervals))
+
+    def intersection(self, other):
+        """Returns intersection with other IntervalSet"""
+        intervals = []
+        i = j = 0
+        while i < len(self.intervals) and j < len(other.intervals):
+            start = max(self.intervals[i][0], other.intervals[j][0])
+            end = min(self.intervals[i][1], other.intervals[j][1])
+            if start <= end:
+                intervals.append((start, end))
+            # advance the interval that ends first
+            if self.intervals[i][1] < other.intervals[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet._from_coalesced(intervals)
+
+    def difference(self, other):
+        """Returns integers in this set that are not in other IntervalSet"""
+        intervals = []
+        j = 0
+        for start, end in self.intervals:
+            # skip intervals of other that end before this interval
+            while j < len(other.intervals) and other.intervals[j][1] < start:
+                j += 1
+            k = j
+            while k < len(other.intervals) and other.intervals[k][0] <= end:
+                if other.intervals[k][0] > start:
+                    intervals.append((start, other.intervals[k][0] - 1))
+                start = max(start, other.intervals[k][1] + 1)
+                k += 1
+            if start <= end:
+                intervals.append((start, end))
+        return IntervalSet._from_coalesced(intervals)
+
+    def issubset(self, other):
+        """Checks if all integers of this set are in other IntervalSet"""
+        return len(self.intersection(other)) == len(self)
+
+    def min(self):
+        """Returns smallest integer in set"""
+        return self.intervals[0][0]
+
+    def max(self):
+        """Returns largest integer in set"""
+        return self.intervals[-1][1]
+
+    def ranges(self):
+        """Returns list of (start, end) of disjoint intervals, same as intspan.ranges()"""
+        return list(self.intervals)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __le__(self, other):
+        return self.issubset(other)
+
+    def __lt__(self, other):
+        return self != other and self.issubset(other)
+
+    def __eq__(self, other):
+        return isinstance(other, IntervalSet) and self.intervals == other.intervals
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __len__(self):
+        return sum([end - start + 1 for start, end in self.intervals])
+
+    def __nonzero__(self):
+        return len(self.intervals) > 0
+
+    def __repr__(self):
+        return 'IntervalSet(%s)' % ','.join(['%d-%d' % (start, end) for start, end in self.intervals])
+
+def benchmark(num=100000):
+    """Compares IntervalSet with intspan on operations done per alignment pair
+
+    Args:
+        num: (int) number of repetitions of each operation
+    """
+    import timeit
+    setup = 'from pavfinder.intervals import IntervalSet; from intspan import intspan; a = (100, 350); b = (300, 800)'
+    tests = (('span', "intspan('%d-%d' % a)", "IntervalSet.span(*a)"),
+             ('intersection', "intspan('%d-%d' % a) & intspan('%d-%d' % b)", "IntervalSet.span(*a) & IntervalSet.span(*b)"),
+             ('union length', "len(intspan('%d-%d' % a).union(intspan('%d-%d' % b)))", "len(IntervalSet.span(*a).union(IntervalSet.span(*b)))"),
+             ('difference', "intspan('%d-%d' % (a[0], b[1])) - intspan('%d-%d' % a) - intspan('%d-%d' % b)",
+              "IntervalSet.span(a[0], b[1]) - IntervalSet.span(*a) - IntervalSet.span(*b)"),
+             )
+    for name, intspan_stmt, interval_set_stmt in tests:
+        intspan_time = timeit.timeit(intspan_stmt, setup=setup, number=num)
+        interval_set_time = timeit.timeit(interval_set_stmt, setup=setup, number=num)
+        print '%s intspan:%.2fus IntervalSet:%.2fus speedup:%.1fx' % (name,
+                                                                      intspan_time * 1e6 / num,
+                                                                      interval_set_time * 1e6 / num,
+                                                                      intspan_time / interval_set_time)
+
+    setup = 'import numpy as np; from pavfinder.intervals import IntervalSet, union_length; from intspan import intspan;' +\
+            'np.random.seed(0); starts = np.random.randint(1, 10000, 1000); ends = starts + 100;' +\
+            'pairs = zip(starts.tolist(), ends.tolist())'
+    tests = (('union length of 1000 reads (intspan, IntervalSet, NumPy)',
+              "span = intspan()\nfor pair in pairs: span = span.union(intspan('%d-%d' % pair))\nlen(span)",
+              "len(IntervalSet(pairs))",
+              "union_length(starts, ends)"),
+             )
+    num = max(1, num / 1000)
+    for name, intspan_stmt, interval_set_stmt, numpy_stmt in tests:
+        times = [timeit.timeit(stmt, setup=setup, number=num) * 1e6 / num for stmt in (intspan_stmt, interval_set_stmt, numpy_stmt)]
+        print '%s: %.1fus %.1fus %.1fus' % (name, times[0], times[1], times[2])
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Integer interval sets")
+    parser.add_argument("--benchmark", type=int, metavar='NUM', help="compare speed with intspan, NUM repetitions")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
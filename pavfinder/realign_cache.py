@@ -0,0 +1,244 @@
+import os
+import re
+import glob
+import hashlib
+import sqlite3
+import subprocess
+import pysam
+from collections import OrderedDict
+from pavfinder.genome.alignment import reverse_complement
+
+def aligner_version(aligner):
+    """Returns version string reported by aligner, or 'unknown'
+
+    Args:
+        aligner: (str) aligner executable (e.g. bwa, gmap)
+    """
+    try:
+        proc = subprocess.Popen([aligner, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+    except OSError:
+        return 'unknown'
+    match = re.search(r'[Vv]ersion:?\s+(\S+)', output)
+    if match:
+        return match.group(1)
+    return 'unknown'
+
+def index_identity(index):
+    """Returns identity of aligner index: path, names, sizes and modification times of its files
+
+    Args:
+        index: (str) prefix of index files (e.g. bwa), or index directory (e.g. gmap)
+    """
+    index = os.path.realpath(index)
+    if os.path.isdir(index):
+        files = glob.glob(os.path.join(index, '*'))
+    else:
+        files = glob.glob(index + '*')
+    stats = []
+    for ff in sorted(files):
+        if os.path.isfile(ff):
+            stat = os.stat(ff)
+            stats.append('%s:%d:%d' % (os.path.basename(ff), stat.st_size, int(stat.st_mtime)))
+    return '%s %s' % (index, ','.join(stats))
+
+def read_fasta(fasta_file):
+    """Reads sequences of Fasta file
+
+    Args:
+        fasta_file: (str) path of Fasta file
+    Returns:
+        OrderedDict of sequence name: sequence
+    """
+    seqs = OrderedDict()
+    name = None
+    with open(fasta_file, 'r') as fasta:
+        for line in fasta:
+            line = line.rstrip()
+            if not line:
+                continue
+            if line[0] == '>':
+                name = line[1:].split()[0]
+                seqs[name] = []
+            elif name is not None:
+                seqs[name].append(line)
+    for name in seqs.keys():
+        seqs[name] = ''.join(seqs[name])
+    return seqs
+
+class RealignCache:
+    """Persistent cache of alignments of sequences (e.g. probes) to a reference genome
+
+    Alignments are stored in a SQLite database, keyed by a hash of the sequence and of the alignment
+    context: aligner, its version and parameters, and identity of the genome index (paths, sizes and
+    modification times of index files). Alignments of a sequence are stored as its SAM records without
+    query name, with the sequence field replaced by a symbol when it is the query sequence or its
+    reverse complement, so they can be re-used for any query with the same sequence.
+    """
+    def __init__(self, db_file, aligner, params, index):
+        """Opens (creates if necessary) cache
+
+        Args:
+            db_file: (str) path of SQLite database
+            aligner: (str) aligner executable (e.g. bwa, gmap)
+            params: (str) aligner parameters that affect alignments
+            index: (str) prefix of index files, or index directory
+        """
+        self.db_file = db_file
+        self.db = sqlite3.connect(db_file)
+        self.db.text_factory = str
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS alignments (key TEXT PRIMARY KEY, records TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS headers (context TEXT PRIMARY KEY, header TEXT)')
+        self.context = hashlib.sha1('\t'.join((aligner, aligner_version(aligner), params, index_identity(index)))).hexdigest()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, seq):
+        """Returns cache key of sequence (str)"""
+        return hashlib.sha1(self.context + '\n' + seq.upper()).hexdigest()
+
+    def lookup(self, seqs):
+        """Gets cached alignments of sequences
+
+        Args:
+            seqs: (dict) query name: sequence
+        Returns:
+            dict of query name: list of SAM records (without query name)
+        """
+        cached = {}
+        for name, seq in seqs.iteritems():
+            row = self.db.execute('SELECT records FROM alignments WHERE key = ?', (self.key(seq),)).fetchone()
+            if row is not None:
+                cached[name] = row[0].split('\n') if row[0] else []
+        return cached
+
+    def get_header(self):
+        """Returns SAM header text of context (str), None if not cached"""
+        row = self.db.execute('SELECT header FROM headers WHERE context = ?', (self.context,)).fetchone()
+        if row is not None:
+            return row[0]
+        return None
+
+    @classmethod
+    def compact(cls, aln, seq):
+        """Converts alignment to cached record: SAM record without query name
+
+        Args:
+            aln: (pysam.AlignedSegment) alignment
+            seq: (str) query sequence
+        Returns:
+            record (str)
+        """
+        cols = aln.to_string().split('\t')
+        if cols[9] == seq:
+            cols[9] = '+'
+        elif cols[9] == reverse_complement(seq):
+            cols[9] = '-'
+        return '\t'.join(cols[1:])
+
+    @classmethod
+    def expand(cls, record, name, seq):
+        """Converts cached record back to SAM record
+
+        Args:
+            record: (str) record returned by compact()
+            name: (str) query name
+            seq: (str) query sequence
+        Returns:
+            SAM record (str)
+        """
+        cols = record.split('\t')
+        if cols[8] == '+':
+            cols[8] = seq
+        elif cols[8] == '-':
+            cols[8] = reverse_complement(seq)
+        return '%s\t%s' % (name, '\t'.join(cols))
+
+    def store(self, bam_file, seqs):
+        """Stores alignments of given BAM file
+
+        The aligner is expected to output at least one record (unmapped if not aligned) for every query.
+        Nothing is stored if the BAM file cannot be read to the end or any query has no record,
+        as this indicates that the aligner failed or its output was truncated
+
+        Args:
+            bam_file: (str) path of BAM file
+            seqs: (dict) query name: sequence of all queries aligned
+        Returns:
+            tuple of header text and dict of query name: list of cached records
+        Raises:
+            ValueError if BAM file is truncated or records of queries are missing
+        """
+        records = dict((name, []) for name in seqs.keys())
+        try:
+            bam = pysam.AlignmentFile(bam_file, 'rb', check_sq=False)
+            header = str(bam.header)
+            for aln in bam.fetch(until_eof=True):
+                if records.has_key(aln.query_name):
+                    records[aln.query_name].append(self.compact(aln, seqs[aln.query_name]))
+            bam.close()
+        except (IOError, OSError), e:
+            raise ValueError('failed to read alignments %s: %s' % (bam_file, e))
+
+        unaligned = [name for name in records.keys() if not records[name]]
+        if unaligned:
+            raise ValueError('no alignment records of %d of %d queries in %s (e.g. %s)' % (len(unaligned), len(records), bam_file, unaligned[0]))
+
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO headers VALUES (?, ?)', (self.context, header))
+            self.db.executemany('INSERT OR REPLACE INTO alignments VALUES (?, ?)',
+                                [(self.key(seqs[name]), '\n'.join(records[name])) for name in records.keys()])
+        return header, records
+
+    def align(self, fasta_file, bam_file, run_align):
+        """Aligns sequences not in cache and writes BAM file of all alignments
+
+        Alignments of each query are written together, in order of queries in Fasta file
+
+        Args:
+            fasta_file: (str) path of Fasta file of queries
+            bam_file: (str) path of output BAM file
+            run_align: (function) aligns given Fasta file to given BAM file, returns non-zero on failure
+        Returns:
+            path of output BAM file
+        Raises:
+            CalledProcessError if aligner fails, ValueError if its output is incomplete.
+            Nothing is added to the cache in either case
+        """
+        seqs = read_fasta(fasta_file)
+        records = self.lookup(seqs)
+        missing = OrderedDict((name, seq) for name, seq in seqs.iteritems() if not records.has_key(name))
+        header = self.get_header()
+        self.hits += len(records)
+        self.misses += len(missing)
+
+        if missing or header is None:
+            prefix = os.path.splitext(bam_file)[0]
+            missing_fasta_file = prefix + '.uncached.fa'
+            missing_bam_file = prefix + '.uncached.bam'
+            with open(missing_fasta_file, 'w') as out:
+                for name, seq in missing.iteritems():
+                    out.write('>%s\n%s\n' % (name, seq))
+            return_code = run_align(missing_fasta_file, missing_bam_file)
+            if return_code:
+                raise subprocess.CalledProcessError(return_code, 'alignment of %s' % missing_fasta_file)
+            header, new_records = self.store(missing_bam_file, missing)
+            records.update(new_records)
+            os.remove(missing_fasta_file)
+            os.remove(missing_bam_file)
+
+        header = pysam.AlignmentHeader.from_text(header)
+        out = pysam.AlignmentFile(bam_file, 'wb', header=header)
+        for name, seq in seqs.iteritems():
+            for record in records[name]:
+                out.write(pysam.AlignedSegment.fromstring(self.expand(record, name, seq), header))
+        out.close()
+        return bam_file
+
+    def stats(self):
+        """Returns cache statistics (str)"""
+        return 'hits:%d misses:%d' % (self.hits, self.misses)
+
+    def close(self):
+        self.db.close()
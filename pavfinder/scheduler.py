@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import math
+import heapq
+import pysam
+import multiprocessing as mp
+
+def mapped_reads(bam_file):
+    """Returns number of mapped reads of each reference from BAM index statistics (samtools idxstats)
+
+    Args:
+        bam_file: (str) path of indexed BAM file
+    Returns:
+        dict of reference name: number of mapped reads, empty if statistics are not available
+    """
+    try:
+        stats = pysam.idxstats(bam_file)
+    except pysam.utils.SamtoolsError:
+        return {}
+    counts = {}
+    for line in stats.splitlines():
+        cols = line.split('\t')
+        if len(cols) >= 3 and cols[0] != '*':
+            counts[cols[0]] = int(cols[2])
+    return counts
+
+def contig_costs(bam_file, spans, window_size=None):
+    """Estimates cost of gathering read support of breakpoints of each contig
+
+    Reads are assumed to be evenly spread along a contig, the cost is the number of reads
+    fetched plus the number of reads evaluated for each span, plus one for each span
+
+    Args:
+        bam_file: (str) path of indexed reads-to-contigs BAM file
+        spans: (dict) contig: list of (start, end), sorted coordinates
+        window_size: (int) reads are fetched and evaluated within this distance of each span,
+                     None if all reads of the contig are fetched and evaluated for each span
+    Returns:
+        dict of contig: cost (float)
+    """
+    reads = mapped_reads(bam_file)
+    bam = pysam.AlignmentFile(bam_file, 'rb')
+    lengths = dict(zip(bam.references, bam.lengths))
+    bam.close()
+
+    costs = {}
+    for contig, contig_spans in spans.iteritems():
+        length = max(1, lengths.get(contig, 1))
+        depth = reads.get(contig, 0) / float(length)
+        if window_size is None:
+            fetched = evaluated = reads.get(contig, 0)
+        else:
+            region = max([end for start, end in contig_spans]) - min([start for start, end in contig_spans])
+            fetched = depth * min(length, region + 2 * window_size)
+            evaluated = depth * min(length, 2 * window_size)
+        costs[contig] = fetched + len(contig_spans) * (evaluated + 1)
+    return costs
+
+def make_chunks(units, num_procs, chunks_per_proc=4, divisible=False):
+    """Packs units of work into chunks of similar cost
+
+    Units are assigned largest first to the chunk of least cost so far.
+    There are several chunks per process so that processes finishing early can pick up more work
+
+    Args:
+        units: (list) (cost, list of items), e.g. breakpoints of a contig
+        num_procs: (int) number of processes
+        chunks_per_proc: (int) number of chunks per process
+        divisible: (boolean) units more costly than a chunk are split into consecutive items of equal cost,
+                   so that even a single unit is spread over all processes
+    Returns:
+        list of (cost, list of items), largest first
+    """
+    units = [unit for unit in units if unit[1]]
+    if not units:
+        return []
+    num_chunks = num_procs * chunks_per_proc if num_procs > 1 else 1
+    if not divisible:
+        num_chunks = min(num_chunks, len(units))
+    else:
+        # split against the target number of chunks, chunks left empty are dropped below
+        target = sum([cost for cost, items in units]) / num_chunks
+        split_units = []
+        for cost, items in units:
+            num_parts = 1
+            if target > 0 and cost > target:
+                num_parts = min(len(items), int(math.ceil(cost / target - 1e-6)))
+            for i in range(num_parts):
+                part = items[i * len(items) / num_parts:(i + 1) * len(items) / num_parts]
+                split_units.append((cost * len(part) / float(len(items)), part))
+        units = split_units
+
+    chunks = [(0, i, []) for i in range(num_chunks)]
+    for cost, items in sorted(units, key=lambda unit: unit[0], reverse=True):
+        chunk_cost, i, chunk_items = heapq.heappop(chunks)
+        chunk_items.extend(items)
+        heapq.heappush(chunks, (chunk_cost + cost, i, chunk_items))
+
+    return [(cost, items) for cost, i, items in sorted(chunks, reverse=True) if items]
+
+def timed_worker(args):
+    """Runs worker on arguments of one chunk, returns (process id, time spent, cost, result)"""
+    worker, cost, worker_args = args
+    start = time.time()
+    result = worker(worker_args)
+    return os.getpid(), time.time() - start, cost, result
+
+def run(worker, jobs, num_procs, name='workers', out=sys.stdout):
+    """Runs jobs, largest first, in a pool of processes and reports utilisation of each process
+
+    Jobs are dispatched one at a time as processes become free (imap_unordered)
+
+    Args:
+        worker: (function) module-level function taking the arguments of a job
+        jobs: (list) (cost, arguments of worker), largest first
+        num_procs: (int) number of processes
+        name: (str) name of jobs in report
+        out: (file) where report is written, None for no report
+    Returns:
+        list of results of worker, in order of completion
+    """
+    start = time.time()
+    tasks = [(worker, cost, worker_args) for cost, worker_args in jobs]
+    if num_procs > 1 and len(tasks) > 1:
+        pool = mp.Pool(processes=num_procs)
+        outputs = list(pool.imap_unordered(timed_worker, tasks, chunksize=1))
+        pool.close()
+        pool.join()
+    else:
+        outputs = map(timed_worker, tasks)
+    wall_time = time.time() - start
+
+    if out is not None:
+        report(outputs, wall_time, name, out)
+
+    return [result for pid, elapsed, cost, result in outputs]
+
+def report(outputs, wall_time, name, out):
+    """Writes time spent, number of chunks and estimated cost of each process
+
+    Args:
+        outputs: (list) (process id, time spent, cost, result) returned by timed_worker()
+        wall_time: (float) time from start to end of all jobs
+        name: (str) name of jobs
+        out: (file) output
+    """
+    stats = {}
+    for pid, elapsed, cost, result in outputs:
+        if not stats.has_key(pid):
+            stats[pid] = [0, 0.0, 0.0]
+        stats[pid][0] += 1
+        stats[pid][1] += elapsed
+        stats[pid][2] += cost
+
+    out.write('%s: %d chunks %d processes wall:%.2fs\n' % (name, len(outputs), len(stats), wall_time))
+    for pid in sorted(stats.keys()):
+        num_chunks, busy, cost = stats[pid]
+        utilisation = busy / wall_time * 100 if wall_time > 0 else 100.0
+        out.write('%s: process %d chunks:%d cost:%.0f busy:%.2fs utilisation:%.0f%%\n' % (name, pid, num_chunks, cost, busy, utilisation))
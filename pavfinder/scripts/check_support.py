@@ -5,7 +5,8 @@ import os
 from collections import OrderedDict, defaultdict
 from sets import Set
 import subprocess
-from pavfinder.genome.read_support import sum_support, filter_support
+from copy import deepcopy
+from pavfinder.genome.read_support import sum_support, filter_support, gather_support_samples, write_support, EvidenceStore
 
 def parse_adjs(bedpe):
     adjs = []
@@ -163,30 +164,25 @@ def filter_events(adjs, variants, vid_to_aid, support, min_support):
                 
     return failed_adjs, failed_variants
 
-def get_support(coords_file, bam_file, contigs_fa, support_file, num_procs,
-                min_overlap=None,
-                allow_clipped_support=False,
-                support_min_mapped=None,
-                debug=False):
-    import pavfinder.genome.read_support
-    script = '%s/read_support.py' % os.path.dirname(os.path.abspath(pavfinder.genome.read_support.__file__))
-    cmd = "python %s %s %s %s %s -n %d" % (script,
-                                           coords_file,
-                                           bam_file,
-                                           contigs_fa,
-                                           support_file,
-                                           num_procs)
-    if allow_clipped_support:
-        cmd += ' --allow_clipped_support'
-    if support_min_mapped is not None:
-        cmd += ' --support_min_mapped %s' % support_min_mapped
-    if min_overlap is not None:
-        cmd += ' --min_overlap %d' % min_overlap
-    if debug:
-        cmd += ' --debug'
-    print cmd
-    process = subprocess.Popen(cmd, shell=True)
-    process.wait()
+def get_evidence(coords_file, samples, contigs_fa, num_procs, debug=False):
+    """Collects evidence of samples concurrently and saves evidence store of each sample
+
+    Args:
+        samples: (list) (bam_file, evidence_file)
+    Returns:
+        list of EvidenceStore of each sample
+    """
+    coords = []
+    for line in open(coords_file, 'r'):
+        coords.append(line.rstrip('\n').split('\t'))
+    stores = gather_support_samples([(coords, bam_file, None, None, None) for bam_file, evidence_file in samples],
+                                    contigs_fa,
+                                    num_procs=num_procs,
+                                    evidence=True,
+                                    debug=debug)
+    for sample, store in zip(samples, stores):
+        store.save(sample[1])
+    return stores
         
 def output(adjs, variants, adjs_failed, variants_failed, outdir, out_prefix=None, adj_meta=None):
     if out_prefix is None:
@@ -239,54 +235,100 @@ def output(adjs, variants, adjs_failed, variants_failed, outdir, out_prefix=None
                 vcf.write('%s\n' % line)
 
 def gather_and_filter(adjs, variants, vid_to_aid, coords_file, contigs_fa,
-                      bam_file, out_dir, out_prefix, num_procs,
-                      min_support, min_overlap, allow_clipped, support_min_mapped,
+                      samples, out_dir, num_procs,
                       adj_meta=None, force=False, debug=False):
-    # get support
-    if out_prefix is None:
-        support_file = '%s/support.tsv' % out_dir
-    else:
-        support_file = '%s/%s_support.tsv' % (out_dir, out_prefix)
-    if not os.path.exists(support_file) or force:
-        get_support(coords_file, bam_file, contigs_fa, support_file, num_procs,
-                    min_overlap=min_overlap,
-                    allow_clipped_support=allow_clipped,
-                    support_min_mapped=support_min_mapped,
-                    debug=debug)
-        print 'done getting support', bam_file
+    """Gathers support of samples (concurrently), filters events and outputs events passing filter
+
+    Reads that can support events are kept in an evidence store of each sample, so filtering with
+    other thresholds counts support from the store instead of scanning BAM files again.
+    Support files of older runs without evidence store are re-used, unless force is True
+
+    Args:
+        samples: (list) (bam_file, out_prefix, min_support, min_overlap, allow_clipped, support_min_mapped)
+    Returns:
+        dict of out_prefix: (adjs, variants, failed adj names, failed variant indices),
+        adjs and variants are copies annotated with support of the sample
+    """
+    support_files = []
+    evidence_files = []
+    for bam_file, out_prefix, min_support, min_overlap, allow_clipped, support_min_mapped in samples:
+        if out_prefix is None:
+            support_files.append('%s/support.tsv' % out_dir)
+            evidence_files.append('%s/evidence.npz' % out_dir)
+        else:
+            support_files.append('%s/%s_support.tsv' % (out_dir, out_prefix))
+            evidence_files.append('%s/%s_evidence.npz' % (out_dir, out_prefix))
+
+    # collect evidence of samples without evidence or support output
+    stores = {}
+    missing = [i for i in range(len(samples)) if force or\
+               (not os.path.exists(evidence_files[i]) and not os.path.exists(support_files[i]))]
+    if missing:
+        collected = get_evidence(coords_file,
+                                 [(samples[i][0], evidence_files[i]) for i in missing],
+                                 contigs_fa, num_procs, debug=debug)
+        for i, store in zip(missing, collected):
+            stores[i] = store
+            print 'done getting support', samples[i][0]
+    for i in range(len(samples)):
+        if not stores.has_key(i) and os.path.exists(evidence_files[i]):
+            stores[i] = EvidenceStore.load(evidence_files[i])
+
+    # count support with thresholds of each sample
+    supports = {}
+    for i, store in stores.iteritems():
+        min_overlap, allow_clipped, support_min_mapped = samples[i][3:]
+        supports[i] = store.support(min_overlap=min_overlap, allow_clipped=allow_clipped, min_ratio_mapped=support_min_mapped)
+        write_support(supports[i], support_files[i])
 
     # filter
-    if os.path.exists(support_file):
-        # parse support
-        support = parse_support(support_file)
+    results = {}
+    for i in range(len(samples)):
+        bam_file, out_prefix, min_support = samples[i][:3]
+        if supports.has_key(i):
+            support = supports[i]
+        elif os.path.exists(support_files[i]):
+            # parse support
+            support = parse_support(support_files[i])
+        else:
+            continue
 
         # filter support
-        adjs_failed, variants_failed = filter_events(adjs, variants, vid_to_aid, support, min_support)
+        sample_adjs, sample_variants = deepcopy(adjs), deepcopy(variants)
+        adjs_failed, variants_failed = filter_events(sample_adjs, sample_variants, vid_to_aid, support, min_support)
 
         # output
-        output(adjs, variants, adjs_failed, variants_failed, out_dir, out_prefix=out_prefix, adj_meta=adj_meta)
+        output(sample_adjs, sample_variants, adjs_failed, variants_failed, out_dir, out_prefix=out_prefix, adj_meta=adj_meta)
+        results[out_prefix] = sample_adjs, sample_variants, adjs_failed, variants_failed
+
+    return results
 
-def subtract_events(out_dir):
-    tumor_adjs, tumor_meta = parse_adjs(out_dir + '/adjacencies_tumor_filtered.bedpe')
-    tumor_variants = parse_variants(out_dir + '/variants_tumor_filtered.vcf')
+def subtract_events(tumor, normal, out_dir, adj_meta=None):
+    """Outputs tumor events without adjacencies that pass filter in normal
 
-    normal_adjs, normal_meta = parse_adjs(out_dir + '/adjacencies_normal_filtered.bedpe')
+    Args:
+        tumor: (tuple) (adjs, variants, failed adj names, failed variant indices) of tumor
+        normal: (tuple) (adjs, variants, failed adj names, failed variant indices) of normal
+    """
+    tumor_adjs, tumor_variants, tumor_adjs_failed, tumor_variants_failed = tumor
+    normal_adjs, normal_variants, normal_adjs_failed, normal_variants_failed = normal
 
-    tumor_adj_ids = Set([adj['name'] for adj in tumor_adjs])
-    normal_adj_ids = Set([adj['name'] for adj in normal_adjs])
+    tumor_adj_ids = Set([adj['name'] for adj in tumor_adjs if not adj['name'] in tumor_adjs_failed])
+    normal_adj_ids = Set([adj['name'] for adj in normal_adjs if not adj['name'] in normal_adjs_failed])
     germline_adj_ids = tumor_adj_ids & normal_adj_ids
 
     # identify variants
-    germline_variants = []
+    germline_variants = Set()
     for v in range(len(tumor_variants)):
         variant = tumor_variants[v]
-        if type(variant) is str:
+        if type(variant) is str or v in tumor_variants_failed:
             continue
         for i in variant['ID'].split('-'):
             if i in germline_adj_ids:
-                germline_variants.append(v)
+                germline_variants.add(v)
 
-    output(tumor_adjs, tumor_variants, germline_adj_ids, germline_variants, out_dir, out_prefix='somatic', meta_adj=tumor_meta)
+    output(tumor_adjs, tumor_variants, tumor_adjs_failed | germline_adj_ids, tumor_variants_failed | germline_variants,
+           out_dir, out_prefix='somatic', adj_meta=adj_meta)
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -323,19 +365,16 @@ def main():
     create_coords_file(adjs, vid_to_aid, coords_file)
     print 'done creating coords file'
     
-    support_args = [(args.bam, None, args.min_support, args.min_overlap, args.allow_clipped, args.support_min_mapped)]
     if args.normal_bam:
         support_args = [(args.bam, 'tumor', args.min_support, args.min_overlap, args.allow_clipped, args.support_min_mapped),
                         (args.normal_bam, 'normal', args.min_support_normal, args.min_overlap_normal, args.allow_clipped_normal, args.support_min_mapped)]
     else:
         support_args = [(args.bam, None, args.min_support, args.min_overlap, args.allow_clipped, args.support_min_mapped)]
-    for bam_file, out_prefix, min_support, min_overlap, allow_clipped, support_min_mapped in support_args:
-        gather_and_filter(adjs, variants, vid_to_aid, coords_file, args.contigs_fa,
-                          bam_file, out_dir, out_prefix, args.num_procs,
-                          min_support, min_overlap, allow_clipped, support_min_mapped,
-                          adj_meta=meta, force=args.force, debug=args.debug)
+    results = gather_and_filter(adjs, variants, vid_to_aid, coords_file, args.contigs_fa,
+                                support_args, out_dir, args.num_procs,
+                                adj_meta=meta, force=args.force, debug=args.debug)
 
-    if args.normal_bam:
-        subtract_events(out_dir)
+    if args.normal_bam and results.has_key('tumor') and results.has_key('normal'):
+        subtract_events(results['tumor'], results['normal'], out_dir, adj_meta=meta)
     
 main()
\ No newline at end of file
@@ -15,6 +15,7 @@ def parse_args():
     parser.add_argument("--index_dir", dest="index_dir", help="bwa index directory")
     parser.add_argument("--r2c", type=str, help="reads to genome bam")
     parser.add_argument("--normal_bam", type=str, help="reads-to-contigs bam file of match normal")
+    parser.add_argument("--mmap_genome", action="store_true", help="memory-map genome fasta (must be uncompressed) instead of reading it through faidx")
     parser.add_argument("--num_threads", help="number of threads/processes. Default:8", type=int, default=8)
     parser.add_argument("--debug", action="store_true", help="debug mode")
     parser.add_argument("--version", action='version', version='%s %s' % (pv.__name__, pv.__version__))
@@ -23,10 +24,13 @@ def parse_args():
     sv.add_argument("--max_homol", help="maximum bases of microhomology. Default:25", type = int, default=25)
     sv.add_argument("--min_ctg_cov", help="minimum contig coverage. Default:0.95", type=float, default=0.95)
     sv.add_argument("--skip_simple_repeats", help="skip simple repeats", action="store_true", default=False)
+    sv.add_argument("--repeats_index", help="index of simple repeats of genome (built by 'python -m pavfinder.genome.repeats') for --skip_simple_repeats, genome sequence is only scanned around breakpoints in an indexed repeat")
     sv.add_argument("--max_size", help="maximum size of variant", type=int)
     sv.add_argument("--min_size", help="minimum size of variant", type=int)
     sv.add_argument("--ins_as_ins", help="keep small duplications as insertions", action="store_true", default=False)
     sv.add_argument("--use_realigns", help="use existing realignments", action="store_true", default=False)
+    sv.add_argument("--stream_realigns", help="pipe probes to aligner and screen alignments as they are output, without writing realign.fa and realign.bam", action="store_true", default=False)
+    sv.add_argument("--realign_cache", help="SQLite file of cached probe realignments, re-used across runs (created if absent)")
     sv.add_argument("--skip_acen", help="skip acentromeric regions", action="store_true", default=False)
     sv.add_argument("--cytobands", help="cytobands file")
     sv.add_argument("--acen_buffer", help="buffer added to acen region. Default:100000", type=int, default=100000)
@@ -34,6 +38,7 @@ def parse_args():
     sv.add_argument("--min_ctg_size", help="minimum contig size. Default:0 (no screening)", type=int, default=0)
     sv.add_argument("--bad_coords", help="BED file for coordinates to screen out e.g. segdups")
     sv.add_argument("--skip_contigs", help="text file of contig names to skip")
+    sv.add_argument("--max_adjs_in_memory", help="maximum number of adjacencies kept in memory before spilling to disk during merging, only merged adjacencies passing coordinate and size filters are kept afterwards. Default:None (no spilling)", type=int)
 
     support = parser.add_argument_group('support filtering')
     support.add_argument("--min_support", help="minimum read support. Default:2", type=int, default=2)
@@ -43,12 +48,13 @@ def parse_args():
     support.add_argument("--allow_clipped", help="allow using clipped reads in gathering read support", action="store_true", default=False)
     support.add_argument("--allow_clipped_normal", help="allow using clipped reads in gathering normal read support", action="store_true", default=False)
     support.add_argument("--support_min_mapped", help="when clipped reads are allowed as read support, minimum ratio of read length mapped Default:0.8", type=float, default=0.8)
-    support.add_argument("--force_support", help="overwrite previous read support if any", action="store_true", default=False)
+    support.add_argument("--force_support", help="obsolete, read support is always gathered", action="store_true", default=False)
 
     output = parser.add_argument_group('output')
     output.add_argument("--reference_url", help="URL of reference")
     output.add_argument("--assembly_url", help="URL of assembly file for VCF")
     output.add_argument("--insertion_as_breakends", help="outputs large insertion as breakends in VCF (Default will output as SV)", action="store_true", default=False)
+    output.add_argument("--bgzip", help="also output bgzip-compressed and tabix-indexed variants.vcf.gz and adjacencies.bedpe.gz", action="store_true", default=False)
 
     args = parser.parse_args()
     return args
@@ -66,6 +72,8 @@ def main():
                          skip_simple_repeats=args.skip_simple_repeats,
                          cytobands_file=args.cytobands,
                          acen_buffer=args.acen_buffer,
+                         repeats_index=args.repeats_index,
+                         mmap_genome=args.mmap_genome,
                          debug=args.debug)
 
     # discover adjacencies from alignments
@@ -77,7 +85,8 @@ def main():
                                check_alt_paths=args.check_alt_paths,
                                min_ctg_size=args.min_ctg_size,
                                bad_coords=args.bad_coords,
-                               skip_contigs_file=args.skip_contigs)
+                               skip_contigs_file=args.skip_contigs,
+                               max_adjs_in_memory=args.max_adjs_in_memory)
     
     # create variants from adjacencies
     sv_finder.create_variants(adjs)
@@ -86,7 +95,7 @@ def main():
         
     # realign to increase specificity
     if args.genome and args.index_dir and sv_finder.variants:
-	sv_finder.screen_realigns(use_realigns=args.use_realigns)
+        sv_finder.screen_realigns(use_realigns=args.use_realigns, stream=args.stream_realigns, cache_file=args.realign_cache)
             
     # output
     cmd = ' '.join(sys.argv)
@@ -96,14 +105,18 @@ def main():
                      assembly_url=args.assembly_url,
                      insertion_as_breakends=args.insertion_as_breakends,
                      header={'cmd': cmd, 'time':time, 'software':software},
+                     bgzip=args.bgzip,
                      )
     
     if args.r2c:
-	support_script = '%s/check_support.py' % (os.path.dirname(__file__))
-	sv_finder.find_support(support_script, args.r2c,
+        sv_finder.find_support(args.r2c,
 	                       args.min_support, args.min_overlap, args.allow_clipped,
 	                       args.normal_bam, args.min_support_normal, args.min_overlap_normal,
 	                       args.allow_clipped_normal, args.support_min_mapped,
-	                       force=args.force_support, debug=args.debug)
+                               reference_url=args.reference_url,
+                               assembly_url=args.assembly_url,
+                               insertion_as_breakends=args.insertion_as_breakends,
+                               header={'cmd': cmd, 'time':time, 'software':software},
+                               debug=args.debug)
 
 main()
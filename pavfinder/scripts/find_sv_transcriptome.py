@@ -10,6 +10,7 @@ from pavfinder.transcriptome.transcript import Transcript
 from pavfinder.transcriptome.sv_finder import SVFinder
 from pavfinder.transcriptome.adjacency import Adjacency
 from pavfinder.transcriptome.read_support import find_support
+from pavfinder.fasta import BlockCache
 
 def combine_events(events, mappings):
     """Combine events via genome and transcripts alignment on contig level"""
@@ -138,6 +139,7 @@ def parse_args():
     parser.add_argument("--r2c", type=str, help="reads to genome bam")
     parser.add_argument("--nproc", type=int, help="number of processes. Default:4", default=4)
     parser.add_argument("--genome_index", type=str, help="genome index path and name", nargs=2)
+    parser.add_argument("--mmap_genome", action="store_true", help="memory-map genome fasta (must be uncompressed) instead of reading it through faidx")
     parser.add_argument("--sort_by_coord", action="store_true", help="sort output by genome coordinates")
     parser.add_argument("--only_fusions", action="store_true", help="report only fusions and read-throughs")
     parser.add_argument("--version", action='version', version='%s %s' % (pv.__name__, pv.__version__))
@@ -157,6 +159,7 @@ def parse_args():
     filtering.add_argument("--probe_len", type=int, help="probe sequence length for filtering. Default:100", default=100)
     filtering.add_argument("--disable_subseq_filtering", action="store_true", help="disable subseq filtering")
     filtering.add_argument("--disable_probe_filtering", action="store_true", help="disable probe filtering")
+    filtering.add_argument("--realign_cache", type=str, help="SQLite file of cached probe and subseq alignments, re-used across runs (created if absent)")
 
     args = parser.parse_args()
     return args
@@ -171,6 +174,12 @@ def create_pysam_fasta(path):
         return pysam.FastaFile(path)
     return None
 
+def create_genome_fasta(path, use_mmap=False):
+    """Reference bases are fetched a few at a time, so blocks of sequences are cached"""
+    if path is not None and os.path.exists(path):
+        return BlockCache(path, use_mmap=use_mmap)
+    return None
+
 def create_pysam_tabix(path):
     if path is not None and os.path.exists(path):
         return pysam.Tabixfile(path, parser=pysam.asGTF())
@@ -182,7 +191,7 @@ def main():
     gbam = create_pysam_bam(args.gbam)
     tbam = create_pysam_bam(args.tbam)
     query_fasta = create_pysam_fasta(args.query_fasta)
-    genome_fasta = create_pysam_fasta(args.genome_fasta)
+    genome_fasta = create_genome_fasta(args.genome_fasta, use_mmap=args.mmap_genome)
     transcripts_fasta = create_pysam_fasta(args.transcripts_fasta)
     transcripts_dict = Transcript.extract_transcripts(args.gtf)
     annot_tabix = create_pysam_tabix(args.gtf)
@@ -237,9 +246,10 @@ def main():
     if events_merged and args.genome_index and len(args.genome_index) == 2:
         if not args.disable_subseq_filtering:
             sf.filter_subseqs(events_merged, query_fasta, args.genome_index[0], args.genome_index[1], args.outdir,
-                              subseq_len=args.subseq_len, debug=args.debug)
+                              subseq_len=args.subseq_len, cache_file=args.realign_cache, debug=args.debug)
         if not args.disable_probe_filtering:
-            sf.filter_probes(events_merged, args.genome_index[0], args.genome_index[1], args.outdir, args.probe_len, debug=args.debug)
+            sf.filter_probes(events_merged, args.genome_index[0], args.genome_index[1], args.outdir, args.probe_len,
+                             cache_file=args.realign_cache, debug=args.debug)
 
     # read support
     if args.r2c:
@@ -10,6 +10,7 @@ from pavfinder.transcriptome.transcript import Transcript
 from pavfinder.transcriptome.novel_splice_finder import extract_features, filter_events, corroborate_genome
 from pavfinder.transcriptome.adjacency import Adjacency
 from pavfinder.transcriptome.read_support import find_support
+from pavfinder.fasta import BlockCache
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -24,6 +25,7 @@ def parse_args():
     parser.add_argument("--min_support", type=int, help="minimum read support. Default:4", default=4)
     parser.add_argument("--suppl_annot", type=str, nargs="+", help="supplementary annotation file(s) for checking novel splice events")
     parser.add_argument("--genome_bam", type=str, help="genome bam")
+    parser.add_argument("--mmap_genome", action="store_true", help="memory-map genome fasta (must be uncompressed) instead of reading it through faidx")
     parser.add_argument("--max_diff_splice", type=int, help="maximum number of base differences in splice motif. Default:1", default=1)
     
     args = parser.parse_args()
@@ -39,6 +41,12 @@ def create_pysam_fasta(path):
         return pysam.FastaFile(path)
     return None
 
+def create_genome_fasta(path, use_mmap=False):
+    """Reference bases are fetched a few at a time, so blocks of sequences are cached"""
+    if path is not None and os.path.exists(path):
+        return BlockCache(path, use_mmap=use_mmap)
+    return None
+
 def create_pysam_tabix(path):
     if path is not None and os.path.exists(path):
         return pysam.Tabixfile(path, parser=pysam.asGTF())
@@ -48,7 +56,7 @@ def main():
     args = parse_args()
     bam = create_pysam_bam(args.bam)
     query_fasta = create_pysam_fasta(args.query_fasta)
-    genome_fasta = create_pysam_fasta(args.genome_fasta)
+    genome_fasta = create_genome_fasta(args.genome_fasta, use_mmap=args.mmap_genome)
     transcripts_dict = Transcript.extract_transcripts(args.gtf)
     annot_tabix = create_pysam_tabix(args.gtf)
     genome_bam = None
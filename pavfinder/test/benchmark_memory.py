@@ -0,0 +1,86 @@
+"""Measures memory used per genome Alignment and Adjacency
+
+    python benchmark_memory.py 200000
+"""
+import sys
+import argparse
+import resource
+from sets import Set
+from pavfinder.genome.adjacency import Adjacency
+from pavfinder.genome.alignment import Alignment, cigar_to_blocks
+
+def get_object_size(obj, seen=None):
+    """Returns memory used by object and all objects it references, each counted once
+
+    Args:
+        obj: object
+        seen: (set) ids of objects already counted
+    Returns:
+        size in bytes (int)
+    """
+    if seen is None:
+        seen = Set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += get_object_size(key, seen) + get_object_size(value, seen)
+    elif isinstance(obj, (list, tuple, Set, set, frozenset)):
+        for item in obj:
+            size += get_object_size(item, seen)
+    elif hasattr(obj, '__slots__'):
+        for attr in obj.__slots__:
+            if hasattr(obj, attr):
+                size += get_object_size(getattr(obj, attr), seen)
+    elif hasattr(obj, '__dict__'):
+        size += get_object_size(obj.__dict__, seen)
+    return size
+
+def create_align(contig, target, tstart, strand, cigar):
+    align = Alignment(query=contig, target=target, strand=strand)
+    align.cigar = cigar
+    align.query_len = sum([length for op, length in cigar if op != 2 and op != 3])
+    align.blocks, align.query_blocks = cigar_to_blocks(cigar, tstart, strand)
+    align.set_start_end_from_blocks()
+    align.edit_distance = 2
+    return align
+
+def benchmark_memory(num_adjs):
+    """Measures memory used per Alignment and per Adjacency
+
+    Creates split-alignment adjacencies (2 alignments each) similar to those found from contigs,
+    and reports the average size of each object (including everything it references)
+    and the growth of the resident set size of the process
+
+    Args:
+        num_adjs: (int) number of adjacencies to create
+    """
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    adjs = []
+    for i in xrange(num_adjs):
+        contig = 'k%d_%d' % (i % 8, i)
+        aligns = (create_align(contig, 'chr1', 1000000 + i, '+', [(0, 150), (1, 2), (0, 50), (4, 300)]),
+                  create_align(contig, 'chr5', 5000000 + i, '-', [(5, 200), (0, 300)]))
+        adj = Adjacency(('chr1', 'chr5'), (1000200 + i, 5000000 + i), 'trl',
+                        contig=contig, contig_breaks=(200, 201), contig_sizes=500,
+                        orients=('L', 'R'), aligns=aligns, align_types='split')
+        adjs.append(adj)
+    rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    align_size = sum([get_object_size(align) for adj in adjs[:1000] for align in adj.aligns[0]]) / float(2 * min(1000, num_adjs))
+    adj_size = sum([get_object_size(adj) for adj in adjs[:1000]]) / float(min(1000, num_adjs))
+    print 'adjacencies:%d' % num_adjs
+    print 'bytes per Alignment:%.1f' % align_size
+    print 'bytes per Adjacency (including its 2 Alignments):%.1f' % adj_size
+    # ru_maxrss is in kilobytes on Linux
+    print 'RSS growth per Adjacency:%.1f' % ((rss_end - rss_start) * 1024.0 / num_adjs)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measures memory used per Alignment and Adjacency")
+    parser.add_argument("num_adjs", type=int, help="number of adjacencies to create")
+    args = parser.parse_args()
+
+    benchmark_memory(args.num_adjs)
@@ -0,0 +1,130 @@
+import os
+import copy
+import random
+import shutil
+import tempfile
+import unittest
+from pavfinder.genome.adjacency import Adjacency
+from pavfinder.genome.alignment import Alignment
+
+chroms = ['chr%d' % i for i in range(1, 6)]
+
+def create_adj(contig, chroms, breaks, orients, rearrangement='trl'):
+    """Creates split adjacency with an alignment of 100bp on the side of each break given by its orientation"""
+    aligns = []
+    for chrom, pos, orient in zip(chroms, breaks, orients):
+        if orient == 'L':
+            aligns.append(Alignment(query=contig, target=chrom, tstart=pos - 100, tend=pos))
+        else:
+            aligns.append(Alignment(query=contig, target=chrom, tstart=pos, tend=pos + 100))
+    adj = Adjacency(chroms, breaks, rearrangement, contig=contig, orients=orients, aligns=aligns, align_types='split')
+    adj.id = contig
+    return adj
+
+def create_trls(num_adjs):
+    """Creates random translocations, dense enough for neighbourhoods of different insertions to overlap,
+    about half of them are pairs forming an insertion at the first (target) chromosome"""
+    trls = []
+    while len(trls) < num_adjs:
+        target_chrom, source_chrom = random.sample(chroms, 2)
+        target = random.randint(1000, 1000 + num_adjs * 200)
+        source = random.randint(1000, 1000 + num_adjs * 200)
+        contig = 'k%d' % len(trls)
+        if random.random() < 0.5:
+            size = random.randint(200, 5000)
+            trls.append(create_adj(contig, (target_chrom, source_chrom), (target, source), ('L', 'R')))
+            trls.append(create_adj(contig + 'b', (target_chrom, source_chrom),
+                                   (target + random.randint(-600, 600), source + size), ('R', 'L')))
+        else:
+            trls.append(create_adj(contig, (target_chrom, source_chrom), (target, source),
+                                   (random.choice('LR'), random.choice('LR'))))
+    random.shuffle(trls)
+    return trls
+
+def create_splits(num_adjs):
+    """Creates random split adjacencies, about half of them are pairs forming an imprecise insertion
+    (breaks of the 2 adjacencies at the target are within 50bp), some contigs have more than 1 adjacency"""
+    splits = []
+    while len(splits) < num_adjs:
+        target_chrom = random.choice(chroms)
+        source_chrom = random.choice(chroms)
+        target = random.randint(1000, 1000 + num_adjs * 20)
+        source = random.randint(1000, 1000 + num_adjs * 20)
+        contig = 'k%d' % random.randint(0, num_adjs * 0.9)
+        rearrangement = 'trl' if target_chrom != source_chrom else random.choice(('del', 'dup'))
+        if random.random() < 0.5:
+            size = random.randint(60, 5000)
+            splits.append(create_adj(contig, (target_chrom, source_chrom), (target, source), ('L', 'R'), rearrangement))
+            splits.append(create_adj(contig + 'b', (source_chrom, target_chrom),
+                                     (source + size, target + random.randint(1, 60)), ('L', 'R'), rearrangement))
+        else:
+            splits.append(create_adj(contig, (target_chrom, source_chrom), (target, source),
+                                     (random.choice('LR'), random.choice('LR')), rearrangement))
+    random.shuffle(splits)
+    return splits
+
+class TestGroupInsertions(unittest.TestCase):
+    """Grouping of adjacencies into insertions through an index gives the same results as comparing all pairs"""
+    num_adjs = 300
+    seeds = range(5)
+
+    def test_extract_interchrom_ins(self):
+        for seed in self.seeds:
+            random.seed(seed)
+            trls = create_trls(self.num_adjs)
+            results = []
+            for indexed in (True, False):
+                adjs = copy.deepcopy(trls)
+                variants, remained = Adjacency.extract_interchrom_ins(adjs, indexed=indexed)
+                positions = dict([(id(adj), i) for i, adj in enumerate(adjs)])
+                results.append(([tuple([positions[id(adj)] for adj in variant.adjs]) for variant in variants],
+                                [positions[id(adj)] for adj in remained],
+                                [(adj.rearrangement, adj.insertion_size) for adj in adjs]))
+            self.assertTrue(results[0][0])
+            self.assertEqual(results[0], results[1])
+
+    def test_extract_imprecise_ins(self):
+        for seed in self.seeds:
+            random.seed(seed)
+            splits = create_splits(self.num_adjs)
+            results = []
+            for indexed in (True, False):
+                adjs = copy.deepcopy(splits)
+                variants, used_adjs = Adjacency.extract_imprecise_ins(adjs, indexed=indexed)
+                positions = dict([(id(adj), i) for i, adj in enumerate(adjs)])
+                results.append(([tuple([positions[id(adj)] for adj in variant.adjs]) for variant in variants],
+                                sorted(used_adjs),
+                                [(adj.rearrangement, adj.insertion_size) for adj in adjs]))
+            self.assertTrue(results[0][0])
+            self.assertEqual(results[0], results[1])
+
+class TestMerge(unittest.TestCase):
+    def test_external_merge(self):
+        """Merging with runs spilled to disk gives the same results as merging in memory"""
+        random.seed(0)
+        adjs = []
+        for i in range(500):
+            # some adjacencies are found by several contigs
+            adjs.append(Adjacency(tuple(sorted(random.sample(chroms, 2))),
+                                  (random.randint(1000, 1050), random.randint(1000, 1050)),
+                                  'trl', contig='k%d' % i, contig_breaks=(100, 101), contig_sizes=200,
+                                  orients=('L', 'R'), probes='ACGT'))
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            results = []
+            for merge in (lambda adjs, stats: Adjacency.merge(adjs, stats=stats),
+                          lambda adjs, stats: Adjacency.external_merge(iter(adjs), tmp_dir, run_size=64, stats=stats)):
+                stats = {}
+                merged = merge(copy.deepcopy(adjs), stats)
+                results.append(([(adj.id, adj.key(), adj.contigs) for adj in merged], stats))
+            self.assertEqual(results[0], results[1])
+            self.assertTrue(results[0][1]['multi_contig'] > 0)
+            self.assertEqual(results[0][1]['adjs'], 500)
+            # run files are removed once all merged adjacencies are generated
+            self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    unittest.main()
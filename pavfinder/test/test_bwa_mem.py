@@ -0,0 +1,55 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from subprocess import CalledProcessError
+from pavfinder.genome import bwa_mem
+
+sam = '@SQ\tSN:chr1\tLN:1000\n' +\
+      'q1\t0\tchr1\t101\t60\t16M\t*\t0\t0\tACGTACGTAAGGCCTT\t*\n' +\
+      'q2\t4\t*\t0\t0\t*\t*\t0\t0\tTTTTGGGGCCCCAAAA\t*\n'
+
+def write_fasta(out):
+    out.write('>q1\nACGTACGTAAGGCCTT\n>q2\nTTTTGGGGCCCCAAAA\n')
+
+class TestStream(unittest.TestCase):
+    """Runs stream() with a fake bwa executable that reads its input and writes given output"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = '%s:%s' % (self.dir, self.path)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.dir)
+
+    def fake_bwa(self, output, returncode=0):
+        with open(os.path.join(self.dir, 'sam'), 'w') as out:
+            out.write(output)
+        bwa = os.path.join(self.dir, 'bwa')
+        with open(bwa, 'w') as out:
+            out.write('#!/bin/sh\ncat > /dev/null\ncat %s\nexit %d\n' % (os.path.join(self.dir, 'sam'), returncode))
+        os.chmod(bwa, os.stat(bwa).st_mode | stat.S_IEXEC)
+
+    def stream(self):
+        return [aln.query_name for aln in bwa_mem.stream(write_fasta, 'genome', self.dir, 1)]
+
+    def test_stream(self):
+        self.fake_bwa(sam)
+        self.assertEqual(self.stream(), ['q1', 'q2'])
+
+    def test_aligner_fails(self):
+        self.fake_bwa(sam, 1)
+        self.assertRaises(CalledProcessError, self.stream)
+
+    def test_aligner_fails_without_output(self):
+        self.fake_bwa('', 1)
+        self.assertRaises(CalledProcessError, self.stream)
+
+    def test_unparsable_output(self):
+        self.fake_bwa(sam + 'q3\tnot\ta\tsam\trecord\n' + sam.split('\n', 1)[1] * 1000)
+        self.assertRaises((ValueError, IOError), self.stream)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import random
+import unittest
+from pavfinder import chimera_paths
+from pavfinder.genome import split_align
+from pavfinder.genome.alignment import Alignment
+
+targets = ['chr1', 'chr2', 'chr3']
+
+def create_align(qstart, qend, target, tstart, query_len):
+    align = Alignment(query='q', qstart=qstart, qend=qend, target=target, tstart=tstart, tend=tstart + qend - qstart)
+    align.query_len = query_len
+    return align
+
+def create_aligns(query_len=300):
+    """Creates random alignments roughly tiling the query (with small gaps and overlaps) and a few random ones,
+    some covering the same query region"""
+    regions = []
+    qstart = 1
+    while qstart < query_len:
+        qend = min(query_len, qstart + random.randint(30, 120))
+        regions.append((qstart, qend))
+        qstart = max(qstart + 1, qend + random.randint(-5, 5))
+    for i in range(random.randint(0, 3)):
+        qstart = random.randint(1, query_len - 20)
+        regions.append((qstart, min(query_len, qstart + random.randint(20, 150))))
+    random.shuffle(regions)
+
+    aligns = []
+    for qstart, qend in regions:
+        for i in range(random.choice((1, 1, 2, 3))):
+            aligns.append(create_align(qstart, qend, random.choice(targets), random.randint(1, 10000000), query_len))
+    return aligns
+
+def score_path(aligns, path):
+    """Scores path by (bases covered, -bases overlapped, -number of targets) from scratch"""
+    covered = set()
+    for i in path:
+        covered.update(range(aligns[i].qstart, aligns[i].qend + 1))
+    overlapped = sum([max(0, aligns[i].qend - aligns[j].qstart + 1) for i, j in zip(path, path[1:])])
+    return (len(covered), -overlapped, -len(set([aligns[i].target for i in path])))
+
+def all_paths(aligns, starts, ends, min_coverage=None, min_aligns=1, max_aligns=None):
+    """Enumerates all paths of alignments from starts to ends passing end-to-end coverage"""
+    graph = chimera_paths.construct_graph(aligns)
+    paths = []
+    def extend(path):
+        if path[-1] in ends and len(path) >= min_aligns and\
+           (min_coverage is None or
+            float(aligns[path[-1]].qend - aligns[path[0]].qstart + 1) / aligns[0].query_len >= min_coverage):
+            paths.append(path)
+        if max_aligns is None or len(path) < max_aligns:
+            for j in graph.get(path[-1], []):
+                extend(path + [j])
+    for i in starts:
+        extend([i])
+    return paths
+
+class TestFindPaths(unittest.TestCase):
+    """Paths found by dynamic programming over query regions are the best of all paths between alignments"""
+    num_sets = 300
+
+    def check(self, aligns, starts, ends, **kwargs):
+        paths = all_paths(aligns, starts, ends, **kwargs)
+        best_path = chimera_paths.find_paths(aligns, starts, ends, **kwargs)
+        if not paths:
+            self.assertEqual(best_path, [])
+            return False
+        self.assertTrue(best_path in paths)
+        self.assertEqual(score_path(aligns, best_path), max([score_path(aligns, path) for path in paths]))
+
+        # best path between every start and end alignment
+        best_scores = {}
+        for path in paths:
+            key = (path[0], path[-1])
+            best_scores[key] = max(best_scores.get(key), score_path(aligns, path))
+        found = chimera_paths.find_paths(aligns, starts, ends, get_all=True, max_paths=None, **kwargs)
+        self.assertEqual(sorted([(path[0], path[-1]) for path in found]), sorted(best_scores.keys()))
+        for path in found:
+            self.assertTrue(path in paths)
+            self.assertEqual(score_path(aligns, path), best_scores[(path[0], path[-1])])
+        return True
+
+    def test_random(self):
+        random.seed(0)
+        found = 0
+        for n in range(self.num_sets):
+            aligns = create_aligns()
+            starts = [i for i in range(len(aligns)) if aligns[i].qstart <= 60]
+            ends = [i for i in range(len(aligns)) if aligns[i].qend >= 240]
+            for kwargs in ({}, {'min_coverage': 0.9}, {'min_aligns': 2}, {'max_aligns': 2}, {'min_aligns': 2, 'max_aligns': 3}):
+                if self.check(aligns, starts, ends, **kwargs):
+                    found += 1
+        self.assertTrue(found > self.num_sets)
+
+    def test_replace_trl(self):
+        """Every alternative alignment of a region is paired with the other region"""
+        aligns = [create_align(1, 100, 'chr2', 80000000, 200),
+                  create_align(1, 100, 'chr2', 10200000, 200),
+                  create_align(101, 200, 'chr2', 10500000, 200)]
+        self.assertEqual(split_align.find_paths(aligns, get_all=True, max_aligns=2), [[0, 2], [1, 2]])
+
+    def test_same_target(self):
+        """Alignment to a target already in the path is picked among those of the same region"""
+        aligns = [create_align(1, 100, 'chr1', 1000, 300),
+                  create_align(101, 200, 'chr2', 5000, 300),
+                  create_align(101, 200, 'chr1', 1100, 300),
+                  create_align(201, 300, 'chr1', 1200, 300)]
+        self.assertEqual(chimera_paths.find_paths(aligns, [0], [3]), [0, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
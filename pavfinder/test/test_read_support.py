@@ -0,0 +1,173 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import pysam
+from pavfinder.genome.read_support import find_spanning, find_flanking, sweep_support, batch_support, EvidenceStore
+
+read_len = 100
+window_size = 300
+kinds = ('match', 'match', 'match', 'mismatch', 'soft_start', 'soft_end', 'soft_both', 'hard_start', 'unmapped')
+
+def random_seq(size):
+    return ''.join([random.choice('ACGT') for i in range(size)])
+
+def create_read(qname, contig_seq, pos, kind, reverse=False, proper=True, pnext=0, tlen=0):
+    """Creates read aligned to contig at pos, clipped or with a mismatch according to kind"""
+    read = pysam.AlignedSegment()
+    read.query_name = qname
+    read.reference_id = 0
+    read.reference_start = pos
+    read.mapping_quality = 60
+    read.next_reference_id = 0
+    read.next_reference_start = pnext
+    if kind == 'unmapped':
+        read.query_sequence = random_seq(read_len)
+        read.flag = 0x1 | 0x4
+        return read
+
+    clip = random.randint(5, 40)
+    aligned_len = read_len - clip if kind != 'soft_both' else read_len - 2 * clip
+    aligned_len = min(aligned_len, len(contig_seq) - pos)
+    aligned = contig_seq[pos:pos + aligned_len]
+    nm = 0
+    if kind in ('match', 'mismatch'):
+        cigar, seq = [(0, aligned_len)], aligned
+        if kind == 'mismatch':
+            i = random.randrange(aligned_len)
+            seq = seq[:i] + random.choice([base for base in 'ACGT' if base != seq[i].upper()]) + seq[i + 1:]
+            nm = 1
+    elif kind == 'soft_start':
+        cigar, seq = [(4, clip), (0, aligned_len)], random_seq(clip) + aligned
+    elif kind == 'soft_end':
+        cigar, seq = [(0, aligned_len), (4, clip)], aligned + random_seq(clip)
+    elif kind == 'soft_both':
+        cigar, seq = [(4, clip), (0, aligned_len), (4, clip)], random_seq(clip) + aligned + random_seq(clip)
+    elif kind == 'hard_start':
+        cigar, seq = [(5, clip), (0, aligned_len)], aligned
+    read.query_sequence = seq
+    read.flag = 0x1 | (0x2 if proper else 0) | (0x10 if reverse else 0)
+    read.cigartuples = cigar
+    read.template_length = tlen
+    read.set_tag('NM', nm)
+    return read
+
+def create_reads(contig_seq, num_pairs):
+    """Creates read pairs of random kinds in coordinate order, some starting at the same position
+    or clipped at the edges of the contig"""
+    contig_len = len(contig_seq)
+    reads = []
+    for n in range(num_pairs):
+        qname = 'r%d' % n
+        kind1, kind2 = random.choice(kinds), random.choice(kinds)
+        r = random.random()
+        if r < 0.05:
+            pos1 = 0
+        elif r < 0.1:
+            pos1 = contig_len - random.randint(read_len - 40, read_len)
+        elif r < 0.2 and reads:
+            # same start as a previous read
+            pos1 = random.choice(reads).reference_start
+        else:
+            pos1 = random.randint(0, contig_len - read_len)
+        pos2 = min(contig_len - read_len, pos1 + random.randint(0, 400))
+        proper = random.random() < 0.8 and kind1 != 'unmapped' and kind2 != 'unmapped'
+        tlen = pos2 + read_len - pos1 if proper or random.random() < 0.5 else 0
+        if kind1 == 'unmapped':
+            pos1 = pos2
+        elif kind2 == 'unmapped':
+            pos2 = pos1
+        reads.append(create_read(qname, contig_seq, pos1, kind1, reverse=False, proper=proper, pnext=pos2, tlen=tlen))
+        reads.append(create_read(qname, contig_seq, pos2, kind2, reverse=True, proper=proper, pnext=pos1, tlen=-tlen))
+    reads.sort(key=lambda read: read.reference_start)
+    return reads
+
+def create_spans(contig_len, num_spans):
+    spans = []
+    for i in range(num_spans):
+        start = random.randint(1, contig_len - 1)
+        spans.append((start, min(contig_len, start + random.choice((0, 1, 5, 30)))))
+    return spans
+
+def window_reads(reads, span, contig_len):
+    """Reads fetched around span by fetch_support() without sweep"""
+    start, end = max(0, span[0] - window_size), min(contig_len, span[1] + window_size)
+    return [read for read in reads if read.reference_start < end and
+            (read.reference_start + read.alen if read.alen else read.reference_start + 1) > start]
+
+class TestSupport(unittest.TestCase):
+    """Support found for all spans of a contig at once is the same as support found for each span"""
+    num_contigs = 10
+    params = ({'overlap_buffer': 0},
+              {'overlap_buffer': 4},
+              {'overlap_buffer': 4, 'perfect': True},
+              {'overlap_buffer': 2, 'allow_clipped': True, 'min_ratio_mapped': 0.8},
+              {'overlap_buffer': 4, 'allow_clipped': True, 'min_ratio_mapped': 0.5, 'perfect': True})
+
+    def test_support(self):
+        random.seed(0)
+        num_supported = 0
+        for n in range(self.num_contigs):
+            contig_seq = random_seq(random.randint(300, 2000))
+            reads = create_reads(contig_seq, len(contig_seq) / 5)
+            spans = create_spans(len(contig_seq), 20)
+            for kwargs in self.params:
+                expected = {}
+                for span in spans:
+                    span_reads = window_reads(reads, span, len(contig_seq))
+                    kwargs_flanking = dict([(key, value) for key, value in kwargs.iteritems() if key != 'perfect'])
+                    expected[span] = (find_spanning(span_reads, span, contig_seq, **kwargs),
+                                      find_flanking(span_reads, span, len(contig_seq), **kwargs_flanking)[0])
+                self.assertEqual(sweep_support(iter(reads), spans, contig_seq, window_size=window_size, **kwargs), expected)
+                self.assertEqual(batch_support(iter(reads), spans, contig_seq, window_size=window_size, **kwargs), expected)
+                num_supported += len([support for support in expected.values() if support[0] and support[1]])
+        self.assertTrue(num_supported > 0)
+
+    def test_no_reads(self):
+        self.assertEqual(batch_support(iter([]), [(10, 11)], 'ACGT' * 10), {(10, 11): (0, 0)})
+        self.assertEqual(sweep_support(iter([]), [(10, 11)], 'ACGT' * 10), {(10, 11): (0, 0)})
+
+class TestEvidenceStore(unittest.TestCase):
+    """Support counted from collected evidence is the same as support found from reads with the same thresholds"""
+    def setUp(self):
+        random.seed(1)
+        self.dir = tempfile.mkdtemp()
+        self.contigs = []
+        stores = []
+        for n in range(5):
+            contig = 'k%d' % n
+            contig_seq = random_seq(random.randint(300, 2000))
+            reads = create_reads(contig_seq, len(contig_seq) / 5)
+            spans = [tuple(sorted(span)) for span in create_spans(len(contig_seq), 20)]
+            self.contigs.append((contig, contig_seq, reads, spans))
+            stores.append(EvidenceStore.collect(iter(reads), contig, spans, contig_seq, window_size=window_size))
+        self.store = EvidenceStore.merge(stores)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, store):
+        num_supported = 0
+        for min_overlap in (0, 1, 4, 10):
+            for allow_clipped, min_ratio_mapped in ((False, None), (True, None), (True, 0.8), (True, 0.5)):
+                support = store.support(min_overlap=min_overlap, allow_clipped=allow_clipped, min_ratio_mapped=min_ratio_mapped)
+                for contig, contig_seq, reads, spans in self.contigs:
+                    expected = batch_support(iter(reads), spans, contig_seq, overlap_buffer=min_overlap,
+                                             allow_clipped=allow_clipped, min_ratio_mapped=min_ratio_mapped, window_size=window_size)
+                    self.assertEqual(support[contig], dict([('%s-%s' % span, expected[span]) for span in spans]))
+                    num_supported += len([span for span in spans if expected[span][0] and expected[span][1]])
+        self.assertTrue(num_supported > 0)
+
+    def test_support(self):
+        self.check(self.store)
+
+    def test_save_load(self):
+        store_file = os.path.join(self.dir, 'evidence.npz')
+        self.store.save(store_file)
+        store = EvidenceStore.load(store_file)
+        self.assertEqual(store.contigs, self.store.contigs)
+        self.check(store)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import subprocess
+import unittest
+import pysam
+from pavfinder.realign_cache import RealignCache
+
+header = {'HD': {'VN': '1.0'}, 'SQ': [{'SN': 'chr1', 'LN': 1000}]}
+seqs = (('q1', 'ACGTACGTAAGGCCTT'), ('q2', 'TTTTGGGGCCCCAAAA'))
+
+def write_bam(bam_file, names):
+    """Writes BAM file with an alignment of each given query"""
+    out = pysam.AlignmentFile(bam_file, 'wb', header=header)
+    for name in names:
+        aln = pysam.AlignedSegment()
+        aln.query_name = name
+        aln.query_sequence = dict(seqs)[name]
+        aln.flag = 0
+        aln.reference_id = 0
+        aln.reference_start = 100
+        aln.mapping_quality = 60
+        aln.cigartuples = [(0, len(aln.query_sequence))]
+        out.write(aln)
+    out.close()
+
+def aligned(fasta_file):
+    """Returns names of queries in Fasta file"""
+    return [line[1:].split()[0] for line in open(fasta_file) if line[0] == '>']
+
+class TestRealignCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, 'cache.db')
+        self.fasta_file = os.path.join(self.dir, 'probes.fa')
+        self.bam_file = os.path.join(self.dir, 'probes.bam')
+        with open(self.fasta_file, 'w') as out:
+            for name, seq in seqs:
+                out.write('>%s\n%s\n' % (name, seq))
+        self.cache = RealignCache(self.db_file, 'no_such_aligner', '-a', self.dir)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.dir)
+
+    def assertNothingCached(self):
+        self.assertEqual(self.cache.lookup(dict(seqs)), {})
+        self.assertEqual(self.cache.get_header(), None)
+
+    def test_align(self):
+        self.cache.align(self.fasta_file, self.bam_file, lambda fasta, bam: write_bam(bam, aligned(fasta)))
+        self.assertEqual(sorted(self.cache.lookup(dict(seqs)).keys()), ['q1', 'q2'])
+
+        def fail(fasta, bam):
+            self.fail('cached sequences aligned again')
+        self.cache.align(self.fasta_file, self.bam_file, fail)
+        self.assertEqual([aln.query_name for aln in pysam.AlignmentFile(self.bam_file)], ['q1', 'q2'])
+        self.assertEqual(self.cache.stats(), 'hits:2 misses:2')
+
+    def test_aligner_fails(self):
+        def fail(fasta, bam):
+            write_bam(bam, aligned(fasta))
+            return 1
+        self.assertRaises(subprocess.CalledProcessError, self.cache.align, self.fasta_file, self.bam_file, fail)
+        self.assertNothingCached()
+
+    def test_header_only_output(self):
+        self.assertRaises(ValueError, self.cache.align, self.fasta_file, self.bam_file, lambda fasta, bam: write_bam(bam, []))
+        self.assertNothingCached()
+
+    def test_missing_records(self):
+        self.assertRaises(ValueError, self.cache.align, self.fasta_file, self.bam_file, lambda fasta, bam: write_bam(bam, ['q1']))
+        self.assertNothingCached()
+
+    def test_truncated_output(self):
+        def truncate(fasta, bam):
+            write_bam(bam, aligned(fasta))
+            size = os.path.getsize(bam)
+            with open(bam, 'r+b') as out:
+                out.truncate(size - 40)
+        self.assertRaises(ValueError, self.cache.align, self.fasta_file, self.bam_file, truncate)
+        self.assertNothingCached()
+
+if __name__ == '__main__':
+    unittest.main()
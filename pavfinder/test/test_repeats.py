@@ -0,0 +1,106 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import pysam
+from pavfinder.genome.repeats import tandem_repeat_at, break_region_repeat, find_tandem_repeats, build_index, RepeatIndex
+
+def random_seq(size):
+    return ''.join([random.choice('ACGT') for i in range(size)])
+
+class TestTandemRepeats(unittest.TestCase):
+    def test_tandem_repeat_at(self):
+        seq = 'GTCACACACAGT'
+        self.assertEqual(tandem_repeat_at(seq, 2, len(seq)), ('CA', 4))
+        self.assertEqual(tandem_repeat_at(seq, 2, 8), ('CA', 3))
+        self.assertEqual(tandem_repeat_at(seq, 0, len(seq)), None)
+        # shortest unit at position
+        self.assertEqual(tandem_repeat_at('AACAACAACAAC', 0, 12), ('A', 2))
+
+    def test_find_tandem_repeats(self):
+        repeats = find_tandem_repeats('GTCACACACAGTTTTTGGNNNNNNNATGATGatgATGG', min_units=4)
+        self.assertEqual([(r['start'], r['end'], r['unit_len']) for r in repeats],
+                         [(2, 10, 2), (11, 16, 1), (25, 37, 3)])
+        self.assertTrue((repeats['max_end'] == [10, 16, 37]).all())
+
+    def test_non_primitive_units(self):
+        repeats = find_tandem_repeats('G' + 'AC' * 12 + 'G', max_unit_len=6, min_units=4)
+        self.assertEqual([(r['start'], r['end'], r['unit_len']) for r in repeats], [(1, 25, 2)])
+
+    def test_empty(self):
+        self.assertEqual(len(find_tandem_repeats('')), 0)
+        self.assertEqual(len(find_tandem_repeats('ACGT')), 0)
+
+class TestRepeatIndex(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.dir = tempfile.mkdtemp()
+        self.seqs = {}
+        # random sequence with repeats of different units, some soft-masked or interrupted
+        for chrom in ('chr1', 'chr2'):
+            parts = []
+            for i in range(60):
+                parts.append(random_seq(random.randint(20, 150)))
+                unit = random_seq(random.randint(1, 8))
+                repeat = unit * random.randint(2, 12)
+                if random.random() < 0.3:
+                    repeat = repeat.lower()
+                elif random.random() < 0.3:
+                    pos = random.randint(0, len(repeat) - 1)
+                    repeat = repeat[:pos] + random.choice('ACGT') + repeat[pos + 1:]
+                parts.append(repeat)
+            self.seqs[chrom] = ''.join(parts)
+        self.seqs['chr3'] = 'ACGT'
+        fasta_file = os.path.join(self.dir, 'genome.fa')
+        with open(fasta_file, 'w') as out:
+            for chrom in sorted(self.seqs.keys()):
+                out.write('>%s\n%s\n' % (chrom, self.seqs[chrom]))
+        pysam.faidx(fasta_file)
+        self.index_file = os.path.join(self.dir, 'repeats.idx')
+        build_index(fasta_file, self.index_file)
+        self.index = RepeatIndex(self.index_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_overlap(self):
+        seq = self.seqs['chr1']
+        repeats = find_tandem_repeats(seq)
+        for start in range(0, len(seq), 37):
+            end = start + random.randint(1, 200)
+            expected = [(int(r['start']), int(r['end']), int(r['unit_len'])) for r in repeats if r['start'] < end and r['end'] > start]
+            self.assertEqual(self.index.overlap('chr1', start, end), expected)
+        self.assertEqual(self.index.overlap('chr3', 0, 4), [])
+        self.assertEqual(self.index.overlap('chrX', 0, 4), [])
+
+    def scan(self, chrom, breaks, window=100):
+        region_start = max(0, breaks[0] - window)
+        region = self.seqs[chrom][region_start:breaks[1] + window]
+        return break_region_repeat(region, region_start, breaks, window=window)
+
+    def test_find_break_region_repeat(self):
+        """Index finds a repeat for every breakpoint the scan finds one for"""
+        found = missed = 0
+        for chrom in ('chr1', 'chr2'):
+            for pos in range(1, len(self.seqs[chrom]), 3):
+                for breaks in ((pos, pos), (pos, pos + random.randint(2, 30))):
+                    scanned = self.scan(chrom, breaks)
+                    indexed = self.index.find_break_region_repeat(chrom, breaks)
+                    if scanned is not None:
+                        self.assertNotEqual(indexed, None, '%s:%s-%s' % (chrom, breaks[0], breaks[1]))
+                        found += 1
+                    elif indexed is not None:
+                        missed += 1
+        self.assertTrue(found > 0)
+        # soft-masked repeats and repeats with a shorter unit at their start are only found through the index
+        self.assertTrue(missed > 0)
+
+    def test_shortest_unit(self):
+        """Scan only considers the shortest unit at each position, index considers all units"""
+        seq = 'GATTGCTCAG' + 'AACAACAACAAC' + 'TGTCAGGCTT'
+        self.assertEqual(break_region_repeat(seq, 0, (16, 16)), None)
+        self.assertEqual([(r['start'], r['end'], r['unit_len']) for r in find_tandem_repeats(seq)], [(10, 22, 3)])
+
+if __name__ == '__main__':
+    unittest.main()
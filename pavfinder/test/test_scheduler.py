@@ -0,0 +1,40 @@
+import unittest
+from pavfinder.scheduler import make_chunks
+
+class TestMakeChunks(unittest.TestCase):
+    def items(self, chunks):
+        return sorted([item for cost, items in chunks for item in items])
+
+    def test_split_single_unit(self):
+        chunks = make_chunks([(1000.0, range(1000))], 8, divisible=True)
+        self.assertEqual(len(chunks), 32)
+        self.assertEqual(self.items(chunks), range(1000))
+        self.assertTrue(max([cost for cost, items in chunks]) <= 1000.0 / 32 + 1)
+
+    def test_split_fewer_items_than_chunks(self):
+        chunks = make_chunks([(5.0, [1, 2])], 8, divisible=True)
+        self.assertEqual(sorted(chunks), [(2.5, [1]), (2.5, [2])])
+
+    def test_indivisible(self):
+        chunks = make_chunks([(1000.0, range(1000)), (10.0, [1000])], 8)
+        self.assertEqual([cost for cost, items in chunks], [1000.0, 10.0])
+
+    def test_balanced(self):
+        units = [(float(cost), [cost]) for cost in range(1, 21)]
+        chunks = make_chunks(units, 2, chunks_per_proc=2)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(self.items(chunks), range(1, 21))
+        costs = [cost for cost, items in chunks]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+        self.assertTrue(costs[0] - costs[-1] <= 3.0)
+
+    def test_single_process(self):
+        chunks = make_chunks([(1.0, [1]), (2.0, [2]), (3.0, [])], 1, divisible=True)
+        self.assertEqual(chunks, [(3.0, [2, 1])])
+
+    def test_empty(self):
+        self.assertEqual(make_chunks([], 4), [])
+        self.assertEqual(make_chunks([(1.0, [])], 4, divisible=True), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from pavfinder.genome.adjacency import Adjacency
+from pavfinder.genome.variant import Variant
+from pavfinder.genome.read_support import apply_support
+
+class Reference:
+    """Reference sequence of N's"""
+    def fetch(self, chrom, start, end):
+        return 'N' * (end - start)
+
+def create_adj(contig, chroms, breaks, rearrangement, orients):
+    adj = Adjacency(chroms, breaks, rearrangement, contig=contig, contig_breaks=(100, 101), contig_sizes=200,
+                    orients=orients, align_types='split')
+    adj.id = contig
+    return adj
+
+def vcf_info(record):
+    return dict([field.split('=') for field in record.split('\t')[7].split(';') if '=' in field])
+
+class TestSupport(unittest.TestCase):
+    """Support of INS and INV variants is the minimum support of their adjacencies"""
+    def setUp(self):
+        self.support = {'k1': {'100-101': (10, 3)}, 'k2': {'100-101': (4, 8)}}
+
+    def check(self, variant):
+        adjs_passed, variants_passed = apply_support([variant], self.support, 4)
+        self.assertEqual(variants_passed, [variant])
+        info = vcf_info(variant.as_vcf(Reference()))
+        self.assertEqual((info['SPANNING_READS'], info['FLANKING_PAIRS']), ('4', '3'))
+        self.assertFalse(info.has_key('READSUPPORT'))
+
+        # no support of variant is reported when one of its adjacencies has no support
+        del self.support['k2']
+        apply_support([variant], self.support, 4)
+        info = vcf_info(variant.as_vcf(Reference()))
+        self.assertFalse(info.has_key('SPANNING_READS') or info.has_key('FLANKING_PAIRS'))
+
+    def test_inversion(self):
+        adjs = [create_adj('k1', ('chr1', 'chr1'), (1000, 5000), 'inv', ('L', 'L')),
+                create_adj('k2', ('chr1', 'chr1'), (1001, 5001), 'inv', ('R', 'R'))]
+        self.check(Variant('INV', adjs))
+
+    def test_insertion(self):
+        adjs = [create_adj('k1', ('chr1', 'chr2'), (1000, 5000), 'trl', ('L', 'R')),
+                create_adj('k2', ('chr1', 'chr2'), (1001, 5500), 'trl', ('R', 'L'))]
+        for adj in adjs:
+            adj.rearrangement = 'ins'
+            adj.insertion_size = 500
+        self.check(Variant('INS', adjs, chrom='chr1', pos=[1000, 1001]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
-from intspan import intspan
+import sys
 from sets import Set
 from alignment import reverse_complement, compare_chr
 from adjacency import Adjacency
+from pavfinder import chimera_paths
+from pavfinder.intervals import IntervalSet
 
 def find_chimera(aligns, query_seq=None, max_splits=3, debug=False):
     path = find_paths(aligns, min_coverage=0.01, from_edge=0.8, debug=debug)
@@ -30,8 +32,8 @@ def find_chimera(aligns, query_seq=None, max_splits=3, debug=False):
 
 def check_inv_dup(adj, aligns):
     if adj.rearrangement == 'inv':
-	target_span_before_bp = intspan('%s-%s' % (aligns[0].tstart, aligns[0].tend))
-	target_span_after_bp = intspan('%s-%s' % (aligns[1].tstart, aligns[1].tend))
+	target_span_before_bp = IntervalSet.span(aligns[0].tstart, aligns[0].tend)
+	target_span_after_bp = IntervalSet.span(aligns[1].tstart, aligns[1].tend)
 	if target_span_after_bp < target_span_before_bp:
 	    adj.rearrangement = 'inv-dup'
 	    
@@ -99,8 +101,8 @@ def call_event(align1, align2, query_seq=None, no_sort=False, max_inv_target_ola
     if aligns[0].target != aligns[1].target:
 	rearrangement = 'trl'
     elif orients[0] == orients[1]:
-	span1 = intspan('%s-%s' % (aligns[0].tstart, aligns[0].tend))
-	span2 = intspan('%s-%s' % (aligns[1].tstart, aligns[1].tend))
+	span1 = IntervalSet.span(aligns[0].tstart, aligns[0].tend)
+	span2 = IntervalSet.span(aligns[1].tstart, aligns[1].tend)
 	olap = span1 & span2
 	if len(olap) <= max_inv_target_olap:
 	    rearrangement = 'inv'
@@ -183,7 +185,23 @@ def call_event(align1, align2, query_seq=None, no_sort=False, max_inv_target_ola
     return adj
 
     
-def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, max_nodes=500, max_paths=5, max_ends=50, no_trim=[], same_target=None, from_edge=0.3, debug=False):
+def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, max_nodes=None, max_paths=5, max_ends=50, no_trim=[], same_target=None, from_edge=0.3, debug=False):
+    """Finds path(s) of alignments that cover the query (see chimera_paths.find_paths())
+    
+    Args:
+	aligns: (list) Alignments of a single query
+	min_coverage: (float) minimum fraction of query covered by path
+	use_end_to_end: (boolean) coverage is the span from first to last alignment instead of bases covered
+	get_all: (boolean) return best path between each start and end alignment
+	max_nodes: (int) no path is constructed if more alignments have links
+	max_paths: (int) maximum number of paths returned when get_all is True
+	max_ends: (int) maximum number of start and end alignments
+	no_trim: (list) indices of alignments never removed for being promiscuous
+	same_target: (str) only use alignments to this target
+	from_edge: (float) fraction of query length from either end where paths start and end
+    Returns:
+	list of indices of aligns (best path), or list of paths if get_all is True
+    """
     def _find_end_points():
 	starts = []
 	ends = []
@@ -203,155 +221,24 @@ def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, ma
 		
 	return starts, ends
     
-    def _trim_aligns(max_mappings=100):
-	regions = {}
-	for i in range(len(aligns)):
-	    if i in no_trim:
-		continue
-	    
-	    key = '%s-%s:%s' % (aligns[i].qstart, aligns[i].qend, aligns[i].strand)
-	    try:
-		regions[key].append(i)
-	    except:
-		regions[key] = [i]
-		
-	extra = []
-	for key in regions.keys():
-	    if len(regions[key]) > max_mappings:
-		for i in regions[key][max_mappings:]:
-		    extra.append(i)
-		
-	if extra:
-	    new_aligns = []
-	    for i in range(len(aligns)):
-		if not i in extra:
-		    new_aligns.append(aligns[i])
-		    
-	    return new_aligns
-	
-	return None
-
-    def _construct_graph(max_links=100, max_olap=0.2, max_gap=0.2):
-	"""
-	Alignments must be like to be an edge
-	   ----> j
-	----> i
-	"""
-	graph = {}
-	for i in range(len(aligns)):
-	    len_i = aligns[i].qend - aligns[i].qstart + 1
-	    for j in range(len(aligns)):
-		if i != j:
-		    len_j = aligns[j].qend - aligns[j].qstart + 1
-		    olap = max(0, aligns[i].qend - aligns[j].qstart + 1)
-		    gap = max(0, aligns[j].qstart - aligns[i].qend - 1)
-		    # only allows gap = 0, gap > 0, or partial overlap
-		    if aligns[j].qend > aligns[i].qend and aligns[j].qstart > aligns[i].qstart:
-			if float(olap)/len_i >= max_olap or\
-			   float(olap)/len_j >= max_olap or\
-			   float(gap)/len_i >= max_gap or\
-			   float(gap)/len_j >= max_gap:
-			    continue
-			try:
-			    graph[i].append(j)
-			except:
-			    graph[i] = [j]
-			    
-	return graph
-
-    
-    def _bfs(graph, start, end):
-	"""Breath-first search
-	http://stackoverflow.com/questions/8922060/breadth-first-search-trace-path
-	"""
-	paths = []
-	# maintain a queue of paths
-	queue = []
-	# push the first path into the queue
-	queue.append([start])
-	while queue:
-	    # get the first path from the queue
-	    path = queue.pop(0)
-	    # get the last node from the path
-	    node = path[-1]
-	    # path found
-	    if node == end:
-		# captures all paths
-		paths.append(path)
-		# this will return shortest path
-		#return path
-	    # enumerate all adjacent nodes, construct a new path and push it into the queue
-	    for adjacent in graph.get(node, []):
-		new_path = list(path)
-		new_path.append(adjacent)
-		queue.append(new_path)
-		
-	return paths
-    
-    def _coverage(path):
-	spans = [intspan('%d-%d' % (aligns[i].qstart, aligns[i].qend)) for i in path]
-	covered = spans[0]
-	overlaps = []
-	for i in range(1, len(spans)):
-	    covered = covered.union(spans[i])
-	    
-	    overlap = spans[i - 1].intersection(spans[i])
-	    if len(overlap) > 0:
-		overlaps.append(overlap)
-	    
-	return covered, overlaps
-    
-    def _screen(covered, overlaps):
-	passed = True
-	if min_coverage is not None:
-	    if not use_end_to_end:
-		coverage = len(covered) / float(aligns[0].query_len)
-	    else:
-		coverage = (max(covered) - min(covered) + 1) / float(aligns[0].query_len)
-
-	    if coverage < min_coverage:
-		passed = False
-		
-	return passed
-    
-    def _pick_best(path_info):
-	best = {'index': None, 'covered': None, 'overlapped': None}
-	for i in sorted(path_info.keys()):
-	    covered = len(path_info[i]['covered'])
-	    if not path_info[i]['overlaps']:
-		overlapped = 0
-	    else:
-		overlapped = sum([len(olap) for olap in path_info[i]['overlaps']])
-
-	    if best['index'] is None or\
-	       covered > best['covered'] or\
-	       overlapped < best['overlapped']:
-		best['index'] = i
-		best['covered'] = covered
-		best['overlapped'] = overlapped
-	
-	return best['index']
-    
-	    
     # check promiscuity
-    trimmed_aligns = _trim_aligns()
-    if trimmed_aligns:
-	aligns = trimmed_aligns
-	
+    indices = chimera_paths.trim_aligns(aligns, no_trim=no_trim)
+    
     # same target
     if same_target:
-	aligns = [align for align in aligns if align.target == same_target]
+	indices = [i for i in indices if aligns[i].target == same_target]
     
-    if not aligns:
+    if not indices:
 	return []
+    # paths are found in the selected alignments, and converted back to indices of given alignments
+    aligns = [aligns[i] for i in indices]
     
-    # construct graph
-    graph = _construct_graph()
-	    
-    if len(graph.keys()) > max_nodes:
-	if debug:
-	    sys.stdout.write('%s: too many nodes(%d) to construct path(max:%d)\n' % (aligns[0].query, len(graph.keys()), max_nodes))
-	return []
+    if max_nodes is not None:
+	num_nodes = len(chimera_paths.construct_graph(aligns).keys())
+	if num_nodes > max_nodes:
+	    if debug:
+		sys.stdout.write('%s: too many nodes(%d) to construct path(max:%d)\n' % (aligns[0].query, num_nodes, max_nodes))
+	    return []
     
     # get end points
     starts, ends = _find_end_points()
@@ -363,30 +250,9 @@ def find_paths(aligns, min_coverage=None, use_end_to_end=True, get_all=False, ma
     if len(ends) > max_ends:
 	ends = ends[:max_ends]
     
-    # find paths
-    paths = []
-    for start in starts:
-	if max_paths and len(paths) >= max_paths:
-	    break
-	for end in ends:
-	    paths.extend(_bfs(graph, start, end))
-	    if max_paths and len(paths) >= max_paths:
-		break
-	    	
-    # screen
-    path_info = {}
-    for i in range(len(paths)):
-	if len(paths[i]) == 1:
-	    continue
-	covered, overlaps = _coverage(paths[i])
-	if _screen(covered, overlaps):
-	    chroms = Set([aligns[j].target for j in paths[i]])
-	    path_info[i] = {'path': paths[i], 'covered': covered, 'overlaps': overlaps, 'chroms':chroms}
-	    	
-    if path_info:
-	if get_all:
-	    return [paths[i] for i in path_info.keys()]
-	else:
-	    return paths[_pick_best(path_info)]
+    paths = chimera_paths.find_paths(aligns, starts, ends, min_coverage=min_coverage, use_end_to_end=use_end_to_end,
+				     get_all=get_all, max_paths=max_paths, min_aligns=2, count_targets=False)
+    if get_all:
+	return [[indices[i] for i in path] for path in paths]
     else:
-	return []
+	return [indices[i] for i in paths]
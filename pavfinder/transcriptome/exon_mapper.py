@@ -2,7 +2,7 @@ import argparse
 import sys
 import os
 import pysam
-from intspan import intspan
+from pavfinder.intervals import IntervalSet
 from itertools import groupby
 from sets import Set
 from alignment import Alignment
@@ -235,15 +235,9 @@ class ExonMapper:
     def overlap(self, align, transcript):
         """Overlaps alignment spans with exon-spans of each matching transcript"""
 	def create_span(blocks):
-	    """Creates intspan for each block"""
-	    span = None
-	    for block in blocks:
-		if (type(block) is tuple or type(block) is list) and len(block) == 2:
-		    if span is None:
-			span = intspan('%s-%s' % (block[0], block[1]))
-		    else:
-			span = span.union(intspan('%s-%s' % (block[0], block[1])))
-	    return span
+	    """Creates IntervalSet of blocks"""
+	    return IntervalSet([(block[0], block[1]) for block in blocks\
+				if (type(block) is tuple or type(block) is list) and len(block) == 2])
 
         align_span = create_span(align.blocks)
 	exon_span = create_span(transcript.exons)
@@ -5,8 +5,10 @@ from itertools import groupby, chain
 import argparse
 from sets import Set
 import multiprocessing as mp
-from intspan import intspan
 from collections import defaultdict
+from pavfinder.fasta import SequenceCache
+from pavfinder.intervals import coalesce_arrays
+from pavfinder import scheduler
 
 events_flanking = ('fusion', 'read_through')
 
@@ -174,7 +176,8 @@ def check_tiling(reads, breaks, contig_len, debug=False):
     Returns:
         Boolean if there are reads spanning across breakpoints with no gaps
     """
-    span = None
+    starts = []
+    ends = []
     for read in reads:
 	# skip reads that is unmapped, not properly paired, or the second mate, or not fully mapped
         if not read.alen or not is_fully_mapped(read, contig_len):
@@ -184,15 +187,13 @@ def check_tiling(reads, breaks, contig_len, debug=False):
 	if read.pos + read.alen < breaks[0] or read.pos > breaks[1]:
 	    continue
 	
-	try:
-	    span = span.union(intspan('%d-%d' % (read.pos + 1, read.pos + read.alen)))
-	except:
-	    span = intspan('%d-%d' % (read.pos + 1, read.pos + read.alen))
+	starts.append(read.pos + 1)
+	ends.append(read.pos + read.alen)
 	    	
-    if span is not None:
-	break_span = intspan('%d-%d' % (breaks[0], breaks[1]))
+    if starts:
+	span_starts, span_ends = coalesce_arrays(starts, ends)
 	# make sure there is no gap in tiling reads and spans the entire breakpoint
-	if len(span.ranges()) == 1 and len(span & break_span) == len(break_span):
+	if len(span_starts) == 1 and span_starts[0] <= breaks[0] and span_ends[0] >= breaks[1]:
 	    return True
     
     return False
@@ -239,20 +240,19 @@ def worker(args):
     Args:
         args: (tuple) list of items returned by create_batches()
     """
-    bam_file, contigs, coords, tids, overlap_buffer, contig_fasta_file, perfect, get_seq, debug = args
+    bam_file, contigs, coords, overlap_buffer, contig_fasta_file, perfect, get_seq, debug = args
     bam = pysam.Samfile(bam_file, 'rb')
-    contig_fasta = pysam.Fastafile(contig_fasta_file)
-    return extract_reads(bam, Set(contigs), coords, tids, overlap_buffer, contig_fasta, perfect=perfect, get_seq=get_seq, debug=debug)
+    contig_fasta = SequenceCache(contig_fasta_file)
+    return extract_reads(bam, contigs, coords, overlap_buffer, contig_fasta, perfect=perfect, get_seq=get_seq, debug=debug)
     
-def extract_reads(bam, contigs, coords, tids, overlap_buffer, contig_fasta, perfect=False, get_seq=False, debug=False):
+def extract_reads(bam, contigs, coords, overlap_buffer, contig_fasta, perfect=False, get_seq=False, debug=False):
     """Extract read support of given list of contigs
     
     Args:
-        bam: (Pysam bam handle)
-        contigs: (set) contig names to get support for
+	bam: (Pysam bam handle) indexed
+	contigs: (list) contig names to get support for
         coords: (dictionary) coords[contig] = [spans]
                 spans = (list) of (start, end) where 'start' and 'end' are not sorted
-        tids: target ids of corresponding contigs 
     Returns:
         List of tuples:
         contig: (str) contig name
@@ -262,26 +262,13 @@ def extract_reads(bam, contigs, coords, tids, overlap_buffer, contig_fasta, perf
         negative spanning reads: (int) number of negative spanning reads
         flanking pairs: (int) number of flanking pairs
     """
-    min_tid = min(tids)
-    max_tid = max(tids)
-    
     support = []
-    count = 1
     tlens_all = []
-    for key, group in groupby(bam.fetch(until_eof=True), lambda x: x.tid):        
-        if key < 0 or key > max_tid:
-            break
-        elif key < min_tid or key not in tids:
-            continue        
-        else:
-            contig = bam.getrname(key)
-            if not contig in contigs:
-                continue
-            
+    for contig in contigs:
 	contig_seq = contig_fasta.fetch(contig)
 	contig_len = len(contig_seq)
         results = {}
-        reads = list(group)
+	reads = list(bam.fetch(contig))
 	support_reads = []
         for event, breaks in coords[contig]:
             # initialization
@@ -302,45 +289,33 @@ def extract_reads(bam, contigs, coords, tids, overlap_buffer, contig_fasta, perf
             #support.append((contig, breaks[0], breaks[1], results[breaks]['spanning'], results[breaks]['flanking'], results[breaks]['tiling'], support_reads))
 	    support.append((contig, breaks[0], breaks[1], results[breaks]['spanning'], results[breaks]['flanking']))
 
-        count += 1        
-        if count > len(contigs):
-            break
-            
     #support.append(tlens_all)
     return support
                     
-def create_batches(bam_file, coords, contigs, size, overlap_buffer, contig_fasta_file, perfect, get_seq, debug=False):
+def create_batches(bam_file, coords, chunks, overlap_buffer, contig_fasta_file, perfect, get_seq, debug=False):
     """Iterator to creates list of arguments of processes spawned
     
     Args:
         bam_file: (str) absolute path of reads-to-contigs bam file
         coords: (dictionary) coords[contig] = [spans]
                 spans = (list) of (start, end) where 'start' and 'end' are not sorted
-        contigs: (list) contig names
-        sizes: (int) number of contigs per process
+	chunks: (list) (cost, contig names) returned by scheduler.make_chunks()
     Yeilds:
-        tuple of:
+	tuple of cost and:
         bam_file: (str) original bam file argument
         contigs: (list) contig names to be processed
-        coords: (dict) original coords argument
-        tids: (list) target ids of corresponding contigs 
+	coords: (dict) coords of contigs to be processed
         debug: (boolean) outputs debug statements
     """
-    bam = pysam.Samfile(bam_file, 'rb')
-    tids = [bam.gettid(contig) for contig in contigs]
-    
-    if size == 0:
-        yield bam_file, contigs, coords, tids, overlap_buffer, contig_fasta_file, perfect, get_seq, debug
-    else:
-        for i in xrange(0, len(contigs), size):
-            if len(contigs) - (i + size) < size:
-                yield bam_file, contigs[i:], coords, tids[i:], overlap_buffer, contig_fasta_file, perfect, get_seq, debug
-                break
-            else:
-                yield bam_file, contigs[i:i + size], coords, tids[i:i + size], overlap_buffer, contig_fasta_file, perfect, get_seq, debug
+    for cost, contigs in chunks:
+	coords_chunk = dict((contig, coords[contig]) for contig in contigs)
+	yield cost, (bam_file, contigs, coords_chunk, overlap_buffer, contig_fasta_file, perfect, get_seq, debug)
             
 def scan_all(coords, bam_file, contig_fasta_file, num_procs, overlap_buffer, perfect=False, get_seq=False, debug=False):
     """Scans every read in reads to contig bam file for support
+
+    Contigs are packed into chunks of similar estimated cost (from numbers of mapped reads in
+    BAM index and numbers of spans), which are dispatched largest first to processes as they become free
     
     Args:
         coords: (dictionary) coords[contig] = [spans]
@@ -357,12 +332,11 @@ def scan_all(coords, bam_file, contig_fasta_file, num_procs, overlap_buffer, per
         spanning_neg: (int) number unique postively spanning reads
         flanking: (int) number of unique flanking pairs
     """
-    contigs = coords.keys()
-    batches = list(create_batches(bam_file, coords, contigs, len(contigs)/num_procs, overlap_buffer, contig_fasta_file, perfect, get_seq, debug=debug))
-    pool = mp.Pool(processes=num_procs)
-    batch_results = pool.map(worker, batches)
-    pool.close()
-    pool.join()
+    # every read of a contig is evaluated for each span (extract_reads())
+    costs = scheduler.contig_costs(bam_file, dict((contig, [sorted(breaks) for event, breaks in coords[contig]]) for contig in coords.keys()))
+    chunks = scheduler.make_chunks([(costs[contig], [contig]) for contig in coords.keys()], num_procs)
+    batches = list(create_batches(bam_file, coords, chunks, overlap_buffer, contig_fasta_file, perfect, get_seq, debug=debug))
+    batch_results = scheduler.run(worker, batches, num_procs, name='read support')
     
     results = {}
     tlens_all = []
@@ -399,7 +373,7 @@ def fetch_support(coords, bam_file, contig_fasta_file, overlap_buffer=0, perfect
         flanking: (int) number of unique flanking pairs
     """
     bam = pysam.AlignmentFile(bam_file)
-    contig_fasta = pysam.FastaFile(contig_fasta_file)
+    contig_fasta = SequenceCache(contig_fasta_file)
     results = {}
     tlens_all = []
     for contig, event_spans in coords.iteritems():
@@ -14,6 +14,7 @@ from itertools import groupby
 import subprocess
 import pysam
 from intspan import intspan
+from pavfinder.realign_cache import RealignCache
 
 class SVFinder:
     
@@ -360,7 +361,7 @@ class SVFinder:
 	return events_by_query, mappings_by_query
     
     @classmethod
-    def filter_probes(cls, events, genome_index_dir, genome_index, working_dir, probe_length, debug=False):
+    def filter_probes(cls, events, genome_index_dir, genome_index, working_dir, probe_length, cache_file=None, debug=False):
 	def create_query_fasta(events, fa_file, min_size=0):
 	    qname_to_event = {}
 	    fa = open(fa_file, 'w')
@@ -393,25 +394,28 @@ class SVFinder:
 	def run_align(probes_fa, nthreads=12):
 	    aln_bam_file = '%s/probes.bam' % working_dir
 	    
-	    cmd = 'gmap -D %s -d %s %s -n0 -f samse -t %d | samtools view -bhS - -o %s' % (genome_index_dir,
-	                                                                                   genome_index,
-	                                                                                   probes_fa,
-	                                                                                   nthreads,
-	                                                                                   aln_bam_file)
-	    failed = False
-	    try:
-		if debug:
-		    print cmd
-		subprocess.call(cmd, shell=True)
-	    except:
-		sys.stderr.write('Failed to run:%s\n' % cmd)
-		failed = True
-		
-	    failed = False
-	    if not failed:
-		return pysam.AlignmentFile(aln_bam_file)
+	    def align(probes_fa, aln_bam_file):
+		cmd = 'gmap -D %s -d %s %s -n0 -f samse -t %d | samtools view -bhS - -o %s' % (genome_index_dir,
+											       genome_index,
+											       probes_fa,
+											       nthreads,
+											       aln_bam_file)
+		try:
+		    if debug:
+			print cmd
+		    return subprocess.call(cmd, shell=True)
+		except:
+		    sys.stderr.write('Failed to run:%s\n' % cmd)
+		    return 1
+
+	    # only probes not aligned in previous runs are aligned
+	    if cache_file is not None:
+		cache = RealignCache(cache_file, 'gmap', '-n0 -f samse', '%s/%s' % (genome_index_dir, genome_index))
+		cache.align(probes_fa, aln_bam_file, align)
+		cache.close()
 	    else:
-		return None
+		align(probes_fa, aln_bam_file)
+	    return pysam.AlignmentFile(aln_bam_file)
 	    
 	def parse_and_filter(bam, fasta_file, qname_to_event, indel_size_check=20):
 	    def within_same_gene(alns, query_seq, event, min_mapped=0.9, window=50):
@@ -518,7 +522,7 @@ class SVFinder:
 		    os.remove(ff)
 
     @classmethod
-    def filter_subseqs(cls, events, query_fa, genome_index_dir, genome_index, working_dir, subseq_len=None, debug=False):
+    def filter_subseqs(cls, events, query_fa, genome_index_dir, genome_index, working_dir, subseq_len=None, cache_file=None, debug=False):
 	def pick_sub_seqs(event):
 	    contigs = event.seq_id.split(',')
 	    seq_breaks = [map(int, b.split('-')) for b in event.seq_breaks.split(',')]
@@ -556,25 +560,28 @@ class SVFinder:
 	def run_align(probes_fa, nthreads=12):
 	    aln_bam_file = '%s/subseqs.bam' % working_dir
 	    
-	    cmd = 'gmap -D %s -d %s %s -f samse -t %d | samtools view -bhS - -o %s' % (genome_index_dir,
-	                                                                               genome_index,
-	                                                                               probes_fa,
-	                                                                               nthreads,
-	                                                                               aln_bam_file)
-	    failed = False
-	    try:
-		if debug:
-		    print cmd
-		subprocess.call(cmd, shell=True)
-	    except:
-		sys.stderr.write('Failed to run:%s\n' % cmd)
-		failed = True
-		
-	    failed = False
-	    if not failed:
-		return pysam.AlignmentFile(aln_bam_file)
+	    def align(probes_fa, aln_bam_file):
+		cmd = 'gmap -D %s -d %s %s -f samse -t %d | samtools view -bhS - -o %s' % (genome_index_dir,
+											   genome_index,
+											   probes_fa,
+											   nthreads,
+											   aln_bam_file)
+		try:
+		    if debug:
+			print cmd
+		    return subprocess.call(cmd, shell=True)
+		except:
+		    sys.stderr.write('Failed to run:%s\n' % cmd)
+		    return 1
+
+	    # only subsequences not aligned in previous runs are aligned
+	    if cache_file is not None:
+		cache = RealignCache(cache_file, 'gmap', '-f samse', '%s/%s' % (genome_index_dir, genome_index))
+		cache.align(probes_fa, aln_bam_file, align)
+		cache.close()
 	    else:
-		return None
+		align(probes_fa, aln_bam_file)
+	    return pysam.AlignmentFile(aln_bam_file)
 	    
 	def is_mapped(aln, size, min_aligned):
 	    if not aln.is_unmapped and int(aln.get_tag('NM')) == 0:
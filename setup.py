@@ -19,7 +19,7 @@ setup(
         ],
     packages=find_packages(),
     install_requires = [
-        'pysam>=0.8.1',
+        'pysam>=0.15',
         'pybedtools>=0.7.0',
         'intspan>=0.701',
         'numpy>=1.9.2',